@@ -0,0 +1,93 @@
+# Per read cost of classifying reads as proviral for 1 to 10,000 viral references.
+# Run from the repository root: python -m benchmarks.proviralLookup
+import time
+import random
+import argparse
+import pysam
+from scripts.pipeline import partitionReads
+
+hostChromosomes = ["chr{}".format(x) for x in list(range(1, 23)) + ["X", "Y", "M"]]
+
+
+class DiscardGroup(object):
+  def addRead(self, read):
+    pass
+
+
+def makeHeader(nViral):
+  viralIds = ["provirus{}".format(i) for i in range(nViral)]
+  header = pysam.AlignmentHeader.from_dict({
+    "HD": {"VN": "1.6", "SO": "coordinate"},
+    "SQ": [{"SN": name, "LN": 100000000} for name in hostChromosomes] + [{"SN": name, "LN": 9700} for name in viralIds]})
+
+  return header, viralIds
+
+
+def makeReads(header, nReads, viralFraction = 0.01, seed = 1):
+  # properly paired host reads, with a share of reads and mates on viral references
+  random.seed(seed)
+  nHost = len(hostChromosomes)
+  nRefs = len(header.references)
+
+  reads = []
+  for i in range(nReads):
+    read = pysam.AlignedSegment(header)
+    read.query_name = "read{}".format(i // 2)
+    read.query_sequence = "A" * 50
+    read.flag = 1 + 2 + (64 if i % 2 == 0 else 128)
+    read.reference_id = random.randrange(nHost, nRefs) if random.random() < viralFraction and nRefs > nHost else random.randrange(nHost)
+    read.reference_start = random.randrange(1000)
+    read.next_reference_id = read.reference_id
+    read.next_reference_start = read.reference_start
+    read.cigartuples = [(0, 50)]
+    reads.append(read)
+
+  return reads
+
+
+def timePerRead(func, reads, repeats):
+  best = None
+  for i in range(repeats):
+    start = time.perf_counter()
+    func(reads)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+
+  return best / len(reads) * 1e9
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description = "Per read cost of proviral reference lookups in partitionReads")
+
+  parser.add_argument("--reads",
+    default = 100000,
+    type = int,
+    help = "Reads per reference set size. Default is 100000")
+  parser.add_argument("--viralRefs",
+    default = "1,10,100,1000,10000",
+    help = "Comma separated numbers of viral references. Default is 1,10,100,1000,10000")
+  parser.add_argument("--repeats",
+    default = 3,
+    type = int,
+    help = "Timed runs of partitionReads per size (the fastest is reported). The name list lookup is timed once. Default is 3")
+
+  args = parser.parse_args()
+
+  print("viralRefs\tpartitionReads_ns_per_read\tnameListLookup_ns_per_read")
+  for nViral in [int(x) for x in args.viralRefs.split(",")]:
+    header, viralIds = makeHeader(nViral)
+    reads = makeReads(header, args.reads)
+
+    def partition(reads):
+      partitionReads(reads, viralIds, DiscardGroup(), DiscardGroup(), DiscardGroup())
+
+    # the name list membership tests partitionReads used before tid lookups
+    def nameListLookup(reads):
+      for read in reads:
+        read.reference_name in viralIds
+        read.next_reference_name in viralIds
+
+    print("{}\t{:.0f}\t{:.0f}".format(nViral,
+      timePerRead(partition, reads, args.repeats),
+      timePerRead(nameListLookup, reads, 1)))
@@ -12,689 +12,17 @@ from scripts.outputModules import *
 from scripts.baseFunctions import *
 from scripts.io import *
 from scripts.terminalPrinting import *
-
-
-def getProviralFastaIDs(fafile, recordSeqs):
-  ids = []
-  for record in SeqIO.parse(fafile, format = "fasta"):
-    ids.append(record.id)
-    recordSeqs[record.id].append(record.seq)
-
-  return ids
-
-
-def getLTRseq(seq, start, end):
-  ltrSeq = seq[start - 1:end]
-  return ltrSeq
-
-
-def parseLTRMatches(LTRargs, proviralSeqs, position = False, endBuffer = 20):
-  LTRdict = defaultdict(lambda: {
-    "5p": None,
-    "5pRevComp": None,
-    "5pStart": None,
-    "5pEnd": None,
-    "3p": None,
-    "3pStart": None,
-    "3pEnd": None,
-    "3pRevComp": None})
-
-  if position:
-    marks = [int(x) for x in LTRargs.split(",")]
-
-    for k in proviralSeqs:
-      proviralSeq = proviralSeqs[k][0]
-      ltr5p = getLTRseq(proviralSeq, marks[0], marks[1])
-      ltr3p = getLTRseq(proviralSeq, marks[2], marks[3])
-
-      LTRdict[k]["5p"] = ltr5p
-      LTRdict[k]["5pStart"] = marks[0]
-      LTRdict[k]["5pEnd"] = marks[1]
-      LTRdict[k]["5pRevComp"] = ltr5p.reverse_complement()
-      LTRdict[k]["3p"] = ltr3p
-      LTRdict[k]["5pStart"] = marks[0]
-      LTRdict[k]["5pEnd"] = marks[1]
-      LTRdict[k]["3pRevComp"] = ltr3p.reverse_complement()
-
-  else:
-    with open(LTRargs, "r") as fhandle:
-      rd = csv.reader(fhandle, delimiter = "\t")
-
-      for row in rd:
-        # index 1 = subject ID (i.e. the original sample's viral fasta ID)
-        # index 2 = percent match
-        # index 6 = query start
-        # index 7 = query end
-        # index 8 = subject start
-        # index 9 = subject end
-        
-        subjID = row[1]
-        sstart = int(row[8])
-        send = int(row[9])
-        slen = len(proviralSeqs[subjID][0])
-        
-        # must be at least 550bp long
-        if abs(send - sstart) < 550:
-          continue
-        elif sstart < endBuffer:
-          if send > sstart:
-            seq = getLTRseq(proviralSeqs[subjID][0], 1, send)
-            LTRdict[subjID]["5pEnd"] = send
-          else:
-            seq = getLTRseq(proviralSeqs[subjID][0], 1, sstart)
-            LTRdict[subjID]["5pEnd"] = send
-
-          LTRdict[subjID]["5p"] = seq
-          LTRdict[subjID]["5pStart"] = 1
-          LTRdict[subjID]["5pRevComp"] = seq.reverse_complement()
-
-        elif slen - send < endBuffer:
-          if send > sstart:
-            seq = getLTRseq(proviralSeqs[subjID][0], sstart, slen)
-            LTRdict[subjID]["3pStart"] = sstart
-          
-          else:
-            seq = getLTRseq(proviralSeqs[subjID][0], send, slen)
-            LTRdict[subjID]["3pStart"] = send
-
-          LTRdict[subjID]["3p"] = seq
-          LTRdict[subjID]["3pEnd"] = slen          
-          LTRdict[subjID]["3pRevComp"] = seq.reverse_complement()
-
-  return LTRdict
-
-
-def getSoftClip(read, clipMinLen, softClipPad, useAlt = None):
-  # cutoff same as epiVIA
-  cigar = read.cigartuples
-  clippedFrag = Seq("")
-  adjacentFrag = Seq("")
-
-  clip5Present = False
-  clip3Present = False
-
-  if useAlt is None:
-    # loop through cigar to make sure there's only 1 soft clip
-    if read.cigarstring.count("S") > 1:
-      return None
-
-    passing5p = cigar[0][0] == 4 and cigar[0][1] >= clipMinLen
-    passing3p = cigar[-1][0] == 4 and cigar[-1][1] >= clipMinLen
-
-    clipLen5p = cigar[0][1]
-    clipLen3p = cigar[-1][1]
-
-  else:
-    if useAlt["cigarstring"].count("S") > 1:
-      return None
-    
-    readAltCigar = separateCigarString(useAlt["cigarstring"])
-    passing5p = readAltCigar[0][1] == "S" and int(readAltCigar[0][0]) >= clipMinLen
-    passing3p = readAltCigar[-1][1] == "S" and int(readAltCigar[-1][0]) >= clipMinLen
-
-    clipLen5p = int(readAltCigar[0][0])
-    clipLen3p = int(readAltCigar[-1][0])
-
-  if passing5p:
-    clippedFrag = read.seq[0:clipLen5p]
-    adjacentFrag = read.seq[clipLen5p:clipLen5p + softClipPad]
-    clip5Present = True
-  
-  if passing3p:
-    clippedFrag = read.seq[clipLen3p * -1: ]
-    adjacentFrag = read.seq[clipLen3p * -1 - softClipPad: clipLen3p * -1]
-    clip3Present = True    
-
-  # clip can only be present at one end
-  if clip5Present and clip3Present:
-    return None
-  elif not clip5Present and not clip3Present:
-    return None
-  else:
-    if clip5Present:
-      adjacentPos = read.reference_start + len(clippedFrag)
-    else:
-      adjacentPos = read.reference_start + (len(read.query_sequence) - len(clippedFrag) - 1)
-
-    clippedFragObj = {
-      "clippedFrag": clippedFrag,
-      "adjacentFrag": adjacentFrag,
-      "useAlt": useAlt,
-      "adjacentPosToClip": adjacentPos,
-      "clip5Present": clip5Present,
-      "clip3Present": clip3Present}
-
-    return clippedFragObj
-
-
-def isSoftClipProviral(read, proviralLTRSeqs, proviralSeqs, clipMinLen = 11, softClipPad = 3):
-  clippedFragObj = getSoftClip(read, clipMinLen, softClipPad)
-  
-  # skip if no clipped fragment long enough is found
-  if clippedFragObj is None:
-    return False
-
-  strClippedFrag = str(clippedFragObj["clippedFrag"])
-
-  # skip if there are any characters other than ATGC 
-  if bool(re.compile(r'[^ATGC]').search(strClippedFrag)):
-    return False
-  
-  hits = {
-    "plus": [],
-    "minus" : [],
-    "clip5P": clippedFragObj["clip5Present"],
-    "clip3P": clippedFragObj["clip3Present"]}
-
-  allowedLTRKeys = []
-  # only allow specific keys based on orientation
-  if clippedFragObj["clip5Present"]:
-    allowedLTRKeys = ["3p", "5pRevComp"]
-  elif clippedFragObj["clip3Present"]:
-    allowedLTRKeys = ["5p", "3pRevComp"]
-
-  # find hits...
-  foundHit = False
-  for key in proviralLTRSeqs:
-    keyPair = proviralLTRSeqs[key]
-
-    for ltrType in allowedLTRKeys:
-      s = keyPair[ltrType]
-      if s is None:
-        continue
-
-      # find orientation
-      orient = "plus" if ltrType == "5p" or ltrType == "3p" else "minus"
-
-      # adjust this as needed based on read length...
-      interestLen = 50
-      strS = str(s)
-      if (ltrType == "5p" or ltrType == "3pRevComp"):
-        sInterest = strS[0:interestLen]
-      elif (ltrType == "3p" or ltrType == "5pRevComp"):
-        sInterest = strS[-interestLen:]
-
-      matches = [x.start() for x in re.finditer(strClippedFrag, sInterest)]
-      if len(matches) == 0:
-        continue
-
-      ltrLen = len(str(s))
-      # add to matches to get compatibility with original code
-      if (ltrType == "3p" or ltrType == "5pRevComp"):
-        matches = [x + (ltrLen - interestLen) for x in matches]
-
-      # check if match is within soft buffer zone
-      if (ltrType == "5p" or ltrType == "3pRevComp") and min(matches) > softClipPad:
-        continue
-      elif (ltrType == "3p" or ltrType == "5pRevComp") and max(matches) + len(strClippedFrag) < ltrLen - softClipPad:
-        continue
-
-      # check if the adjacent host clips could have also been aligned to the viral LTR,
-      # thus explaining the lack of viral clip not being at either end of LTR
-      ltrEnd = ""
-      adjustment = 0
-      if (ltrType == "5p" or ltrType == "3pRevComp") and min(matches) != 0:
-        adjustment = -1 * min(matches)
-        ltrEnd = str(s)[0:min(matches)]
-        hostAdjacentSeq = clippedFragObj["adjacentFrag"][adjustment:]
-
-      elif (ltrType == "3p" or ltrType == "5pRevComp") and max(matches) != ltrLen - softClipPad:
-        adjustment = ltrLen - max(matches) - len(strClippedFrag)
-        ltrEnd = str(s)[max(matches) + len(strClippedFrag): ltrLen]
-        hostAdjacentSeq = clippedFragObj["adjacentFrag"][0:adjustment]
-        
-      if ltrEnd != "" and ltrEnd != hostAdjacentSeq:
-        # print("{}: Viral clip not found at the end of LTR".format(read.query_name))
-        continue
-
-      # passes all checks!
-      print("{}: chimeric match found".format(read.query_name))
-      
-      if ltrType == "5p" or ltrType == "5pRevComp":
-        proviralStartPos = 0
-        proviralEndPos = len(clippedFragObj["clippedFrag"]) + abs(adjustment) - 1
-      elif ltrType == "3p" or ltrType == "3pRevComp":
-        proviralStartPos = len(proviralSeqs[key][0]) - len(clippedFragObj["clippedFrag"]) - abs(adjustment)
-        proviralEndPos = len(proviralSeqs[key][0]) - 1
-
-      intsite = IntegrationSite(
-        chr = read.reference_name,
-        orient = "-" if orient == "minus" else "+",
-        pos = clippedFragObj["adjacentPosToClip"] + adjustment)
-
-      proviralFrag = ProviralFragment()
-      proviralFrag.setManually(
-        seqname = key,
-        startBp = proviralStartPos,
-        endBp = proviralEndPos,
-        cbc = extractCellBarcode(read),
-        readname = read.qname,
-        usingAlt = None
-      )
-
-      chimera = ChimericRead(read = read, intsite = intsite, proviralFragment = proviralFrag)
-      hits[orient].append(chimera)
-      foundHit = True
-
-  # can only be plus orientation OR minus orientation only
-  if not foundHit:
-    return False
-  elif len(hits["plus"]) != 0 and len(hits["minus"]) == 0:
-    return hits
-  elif len(hits["minus"]) != 0 and len(hits["plus"]) == 0:
-    return hits
-
-
-def parseHostReadsWithPotentialChimera(readPairs, proviralLTRSeqs, proviralSeqs, clipMinLen):
-  validChimeras = []
-  readPairLen = len(readPairs.keys())
-  readKeyCounter = 0
-
-  for key in readPairs:
-    if (readKeyCounter % 100000 == 0):
-      printProgressBar(readKeyCounter, readPairLen, "Processing Host Reads with Chimera")
-      
-    readKeyCounter += 1
-
-    # only allow one read mate to have soft clip
-    if len(readPairs[key]) != 1:
-      continue 
-    
-    read = readPairs[key][0]
-    # must contain valid cell barcode passing allowlist
-    if extractCellBarcode(read) is None:
-     continue
-    
-    validHits = isSoftClipProviral(read, proviralLTRSeqs, proviralSeqs, clipMinLen)
-    if validHits:
-      printBlue([str(x) for x in validHits['minus']])
-      printBlue([str(x) for x in validHits['plus']])
-      validChimeras.append(validHits)
-
-  return validChimeras
-
-
-def checkForPotentialHostClip(read, refLen, proviralSeqs, clipMinLen = 17, useAlts = None, softClipPad = 3):
-  readInfo = {
-    "start": read.reference_start,
-    "cigar": read.cigar,
-    "cigarstring": read.cigarstring
-  }
-
-  if useAlts is not None:
-    readInfo["start"] = int(useAlts[1].lstrip("[+-]"))
-    readInfo["cigarstring"] = useAlts[2]
-
-    readClip = getSoftClip(read, clipMinLen, softClipPad, useAlt = readInfo)
-  
-  else:
-    readClip = getSoftClip(read, clipMinLen, softClipPad)
-
-  readNear5p = readInfo["start"] <= softClipPad
-  readNear3p = readInfo["start"] >= refLen - read.query_length - softClipPad - 1
-
-  if readClip is None or (not readNear5p and not readNear3p):
-    # print("{} is not close enough to LTR".format(read1.query_name))
-    return None
-
-  clip = readClip["clippedFrag"]
-  provirusStart = readInfo["start"]
-
-  returnObj = {
-    "read": read,
-    "hostSoftClip": readClip,
-    "adjustment": 0,
-    "adjustedHostSoftClip": None,
-    "provirusStart": provirusStart
-  }
-
-  if readNear5p:
-    adjustment = 0 - provirusStart
-    clipPartial = clip[adjustment: ]
-    provirusActual = proviralSeqs[read.reference_name][0][0:provirusStart]
-
-    if provirusStart == 0:
-      return returnObj
-    elif provirusStart != 0 and clipPartial == provirusActual:
-      returnObj["adjustment"] = adjustment
-      returnObj["adjustedHostSoftClip"] = clip[:len(clip) + adjustment]
-      return returnObj
-  
-  elif readNear3p:
-    fragmentLen = len(clip)
-    readProviralLen = len(read.seq) - fragmentLen
-
-    proviralEnd = len(proviralSeqs[read.reference_name][0])
-    reqProviralStartPos = proviralEnd - readProviralLen
-    
-    adjustment = reqProviralStartPos - read.reference_start
-
-    clipPartial = clip[:adjustment]
-    provirusActual = proviralSeqs[read.reference_name][0][-1 * adjustment:]
-
-    if provirusStart == reqProviralStartPos:
-      return returnObj
-    
-    elif provirusStart != reqProviralStartPos and clipPartial == provirusActual:
-      returnObj["adjustment"] = adjustment
-      returnObj["adjustedHostSoftClip"] = clip[adjustment:]
-      returnObj["provirusStart"] = reqProviralStartPos
-      return returnObj
-
-  return None
-
-
-def alignClipToHost(fafile, hostGenomeIndex, potentialChimeras, hostClipLen = 17, nonChimeras = None):
-  if not os.path.exists(fafile) or os.stat(fafile).st_size == 0:
-    printGreen("No records in fasta file. Skipping alignment.") 
-    return None
-
-  outputSam = fafile + ".sam"
-  command = "bwa mem -T {quality} -k {seed} -a -Y -q {index} {fa} -o {sam}".format(
-      index = hostGenomeIndex,
-      fa = fafile,
-      sam = outputSam,
-      quality = hostClipLen,
-      seed = hostClipLen - 2)
-
-  child = subprocess.Popen(command, shell = True)
-  child.wait()
-  if child.poll() != 0:
-    raise Exception("Error with alignment")
-  
-  validIntSites = defaultdict(list)
-  qnamesWithMultipleHits = []
-  alignment = pysam.AlignmentFile(outputSam, "r")
-  for rec in alignment:
-    if rec.mapq == 0:
-      if nonChimeras is not None:
-        nonChimeras[rec.qname].unsetPotentialClipEdit()
-
-      continue
-
-    if len(validIntSites[rec.qname]) > 0:
-      printRed("{}: integration site can't be found due to multiple hits in host genome".format(rec.qname))
-      validIntSites.pop(rec.qname)
-      qnamesWithMultipleHits.append[rec.qname]
-
-      if nonChimeras is not None:
-        nonChimeras[rec.qname].unsetPotentialClipEdit()
-      continue
-    elif rec.qname in qnamesWithMultipleHits:
-      continue
-    
-    # check orientation of alignment
-    currentChimera = potentialChimeras[rec.qname]
-    if currentChimera["adjustment"] != 0:
-      if str(currentChimera["adjustedHostSoftClip"]) != str(rec.seq):
-        orient = "-"
-      else:
-        orient = "+"
-    else:
-      if str(currentChimera["hostSoftClip"]["clippedFrag"] != str(rec.seq)):
-        orient = "-"
-      else:
-        orient = "+"
-
-    # TODO edit dualproviralobject if 1) edit is used, just change read and 2) if alt is used, change both
-
-    intsite = IntegrationSite(rec.reference_name, orient, rec.reference_start)
-    proviralFrag = ProviralFragment()
-    proviralFrag.setManually(
-      seqname = currentChimera["read"].reference_name,
-      startBp = currentChimera["provirusStart"],
-      endBp = currentChimera["read"].reference_end - 1,
-      cbc = extractCellBarcode(currentChimera["read"]),
-      readname = currentChimera["read"].qname
-    )
-
-    if nonChimeras is not None:
-      nonChimeras[rec.qname].updateWithConfirmedEdit(proviralFrag)
-
-    
-    chimera = ChimericRead(
-      read = currentChimera["read"],
-      intsite = intsite,
-      proviralFragment = proviralFrag
-    )
-
-    validIntSites[rec.qname].append(chimera)
-
-  return validIntSites
-
-
-def parseProviralReads(readPairs, proviralSeqs, hostClipFastaFn, clipMinLen = 17):
-  validReads = defaultdict()
-  potentialValidChimeras = defaultdict()
-
-  for rpName in readPairs:
-    # must be paired
-    if len(readPairs[rpName]) != 2:
-      continue
-    
-    read1 = readPairs[rpName][0]
-    read2 = readPairs[rpName][1]
-    
-    # must contain a valid cell barcode passing allowlist
-    if extractCellBarcode(read1) is None:
-      continue
-
-    # skip if only single mate mapped
-    if read1.is_unmapped or read2.is_unmapped:
-      continue
-    
-    # rearrange depending on where alignment is
-    if read1.reference_start > read2.reference_start:
-      read1, read2 = read2, read1
-
-    # move on to chimera analysis
-    refLen = len(proviralSeqs[read1.reference_name][0])
-    read1AllAlts = getAltAlign(read1)
-    read2AllAlts = getAltAlign(read2)
-
-    # add to allowed proviral reads...
-    rd1ProviralFrag = ProviralFragment()
-    rd1ProviralFrag.setFromRead(read1)
-    rd1ProviralFrag.setAlt(read1AllAlts)
-
-    rd2ProviralFrag = ProviralFragment()
-    rd2ProviralFrag.setFromRead(read2)
-    rd2ProviralFrag.setAlt(read2AllAlts)
-
-    rdPair = ReadPairDualProviral(read1 = rd1ProviralFrag, read2 = rd2ProviralFrag)
-    validReads[read1.qname] = rdPair
-
-    # skip if there's multiple soft clips
-    if read1.cigarstring.count("S") + read2.cigarstring.count("S") > 1:
-      continue
-
-    potentialAltChimera = None
-    readContainingChimera = ""
-    if read1AllAlts is not None and read2AllAlts is not None:
-      read1Alts = [alt for alt in read1AllAlts if alt[0] == read1.reference_name]
-      read2Alts = [alt for alt in read2AllAlts if alt[0] == read2.reference_name]
-      
-      read1AltCheck = None
-      read2AltCheck = None
-      if len(read1Alts) > 1 or len(read2Alts) > 1:
-        printRed("{}: has multiple alt aligns. Verify manually.".format(read1.qname))
-      
-      if len(read1Alts) == 1:
-        read1AltCheck = checkForPotentialHostClip(read1, refLen, proviralSeqs = proviralSeqs,
-          clipMinLen = clipMinLen, useAlts = read1Alts[0])
-      if len(read2Alts) == 1:
-        read2AltCheck = checkForPotentialHostClip(read2, refLen, proviralSeqs = proviralSeqs,
-          clipMinLen = clipMinLen, useAlts = read2Alts[0])
-
-      if read1AltCheck is None and read2AltCheck is not None:
-        potentialAltChimera = read2AltCheck
-        readContainingChimera = "read2"
-      elif read1AltCheck is not None and read2AltCheck is None:
-        potentialAltChimera = read1AltCheck
-        readContainingChimera = "read1"
-
-    potentialChimera = None
-    read1Check = checkForPotentialHostClip(read1, refLen, proviralSeqs = proviralSeqs,
-      clipMinLen = clipMinLen, useAlts = None)
-    read2Check = checkForPotentialHostClip(read2, refLen, proviralSeqs = proviralSeqs,
-      clipMinLen = clipMinLen, useAlts = None)  
-  
-    if read1Check is None and read2Check is not None:
-      potentialChimera = read2Check
-      readContainingChimera = "read2"
-    elif read1Check is not None and read2Check is None:
-      potentialChimera = read1Check
-      readContainingChimera = "read1"
-
-    if potentialAltChimera is not None and potentialChimera is not None:
-      printRed("{}: please verify. Clip identified in both alt and normal align.".format(read1.qname))
-    elif potentialAltChimera is not None:
-      potentialValidChimeras[read1.qname] = potentialAltChimera
-      validReads[read1.qname].setPotentialClipEdit(readContainingChimera, potentialAltChimera, isAlt = True)
-
-    elif potentialChimera is not None:
-      potentialValidChimeras[read1.qname] = potentialChimera
-      validReads[read1.qname].setPotentialClipEdit(readContainingChimera, potentialChimera, isAlt = False)
-
-  writeFasta(potentialValidChimeras, hostClipFastaFn)
-
-  returnVal = {"validReads" : validReads, "potentialValidChimeras": potentialValidChimeras}
-  return returnVal
-
-
-def parseUnmappedReads(readPairs, proviralSeqs, proviralLTRSeqs, unmappedHostClipFn,
-  LTRClipMinLen = 11, hostClipMinLen = 17, minHostQuality = 30):
-
-  viralFrags = []
-  validChimera = []
-  potentialChimera = []
-
-  for k in readPairs:
-    readPair = readPairs[k]
-    if readPair[0].reference_name in proviralSeqs.keys():
-      viralRead = readPair[0]
-      hostRead = readPair[1]
-    else:
-      viralRead = readPair[1]
-      hostRead = readPair[0]
-
-    # host read must have high enough mapq
-    # for viral read, no check since mapq is unrealiable if using multiple viral seqs
-    if hostRead.mapq < minHostQuality:
-      continue
-    
-    hostReadSubs = hostRead.cigarstring.count("S")
-    viralReadSubs = viralRead.cigarstring.count("S")
-
-    proviralFrag = ProviralFragment()
-    proviralFrag.setFromRead(viralRead)
-    proviralFrag.setAlt(getAltAlign(viralRead))
-    
-    # can't have mulutiple soft clips present
-    if hostReadSubs + viralReadSubs > 1:
-      viralFrags.append(proviralFrag)
-      continue
-
-    # if no soft clips, just save viral read
-    if hostReadSubs == 0 and viralReadSubs == 0:
-      viralFrags.append(proviralFrag)
-      continue
-
-    # special case. #TODO add this case.
-    if hostReadSubs == 1 and viralReadSubs == 1:
-      printRed("{}: Soft clip detected in both host and viral".format(viralRead.query_name))
-
-    # host read soft clip
-    elif hostReadSubs == 1:
-      potentialHits = isSoftClipProviral(hostRead, proviralLTRSeqs, proviralSeqs, LTRClipMinLen)
-      if potentialHits:
-        validChimera.append(potentialHits)
-        viralFrags.append(proviralFrag)
-      else:
-        viralFrags.append(proviralFrag)
-
-    # viral read soft clip
-    elif viralReadSubs == 1:
-      refLen = len(proviralSeqs[viralRead.reference_name][0])
-      readAllAlts = getAltAlign(viralRead)
-
-      viralSoftClipAlt = None
-      if readAllAlts is not None:
-        readAlts = [alt for alt in readAllAlts if alt[0] == viralRead.reference_name]
-        if len(readAlts) == 1:
-          viralSoftClipAlt = checkForPotentialHostClip(viralRead, refLen, proviralSeqs = proviralSeqs,
-            clipMinLen = hostClipMinLen, useAlts = readAlts[0])
-
-      viralSoftClip = checkForPotentialHostClip(viralRead, refLen, proviralSeqs = proviralSeqs,
-        clipMinLen = hostClipMinLen, useAlts = None)
-
-      if viralSoftClip is not None:
-        print("{}: Valid soft clip detected in virus. Proceed further".format(viralRead.query_name))
-        print(viralRead.to_string())
-        potentialChimera.append(viralSoftClip)
-      elif viralSoftClipAlt is not None:
-        print("{}: Valid alternate soft clip detected in virus. Proceed further".format(viralRead.query_name))
-        print(viralRead.to_string())
-        proviralFrag.setPotentialClipEdit(viralRead.query_name, potentialChimera, isAlt = False)
-        potentialChimera.append(viralSoftClipAlt)
-
-    else:
-      viralFrags.append(proviralFrag)
-
-  writeFasta(potentialChimera, unmappedHostClipFn)
-
-  return {
-    "validChimera": validChimera,
-    "viralFrags": viralFrags,
-    "potentialChimera": potentialChimera}
-
-
-def parseCellrangerBam(bamfile, proviralFastaIds, proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera, top_n = -1):
-  bam = pysam.AlignmentFile(bamfile, "rb", threads = 20)
-  
-  readIndex = 0
-  for read in bam:
-    if readIndex % 1000000 == 0:
-      print("Parsing {}th read".format(str(readIndex)), end = "\r")
-
-    if top_n != -1 and readIndex > top_n:
-      return
-
-    readIndex += 1
-
-    # ignore if optical/PCR duplicate OR without a mate
-    if (read.flag & 1024) or (not read.flag & 1):
-      readIndex += 1
-      continue
-    
-    refnameIsProviral = read.reference_name in proviralFastaIds
-    # supposed to take mate's ref name or if no mate, the next record in BAM file
-    nextRefnameIsProviral = read.next_reference_name in proviralFastaIds
-    
-    cigarString = read.cigartuples
-    # 4 is soft clip
-    hasSoftClipAtEnd = cigarString != None and (cigarString[-1][0] == 4 or cigarString[0][0] == 4)
-    softClipInitThresh = 11
-    softClipIsLongEnough = cigarString != None and \
-      ((cigarString[-1][0] == 4 and cigarString[-1][1] >= softClipInitThresh) or \
-        (cigarString[0][0] == 4 and cigarString[0][1] >= softClipInitThresh))
-    
-    # if read is properly mapped in a pair AND not proviral aligned AND there is soft clipping involved
-    if (read.flag & 2) and (not refnameIsProviral) and (hasSoftClipAtEnd and softClipIsLongEnough):
-      # move to chimera identification
-      hostReadsWithPotentialChimera[read.query_name].append(read)
-    
-    # if there is a mate AND both are proviral only 
-    elif refnameIsProviral and nextRefnameIsProviral:
-      # save into proviral
-      proviralReads[read.query_name].append(read)
-
-    # read or mate must be mapped AND either read or its mate must be proviral
-    elif (not read.flag & 14) and (refnameIsProviral or nextRefnameIsProviral):
-      # move to chimera identification
-      unmappedPotentialChimera[read.query_name].append(read)
-    
-  return bam
+from scripts.pipeline import *
+from scripts.hostIndex import HostKmerIndex, buildHostKmerIndex, hostKmerIndexExists
+from scripts.scheduler import StageScheduler
+from scripts.resources import ResourceBudget, parseMemory
+from scripts.nameGrouping import ExternalNameGrouper
+from scripts.profiling import StageProfiler
+from scripts.dedup import FragmentDeduplicator
+from scripts.siteDatabase import SiteDatabase
+from scripts.adapters import AdapterClipFilter
+from scripts.topUp import TopUp
+from scripts.metrics import RunMetrics, metricsFormats
 
 
 def main(args):
@@ -710,16 +38,56 @@ def main(args):
     "unmappedHostClipFasta": "unmappedHostClipFasta.fa",
     "integrationSites": "integrationSites.tsv",
     "viralFragsFromIntegrationSites": "integrationSites_viralFrags.tsv",
-    "viralFrags": "viralFrags.tsv"
+    "viralFrags": "viralFrags.tsv",
+    "viralCoverage": "viralCoverage"
   }
 
   for k in outputFNs:
     outputFNs[k] = args.outputDir + "/" + outputFNs[k]
 
-  # set up initial dictionaries
-  dualProviralAlignedReads = defaultdict(list)
-  hostReadsWithPotentialChimera = defaultdict(list)
-  unmappedPotentialChimera = defaultdict(list)
+  # a top-up parses only the new BAM, into its own directory, and merges its results
+  # into the existing TSVs of outputDir
+  topUp = None
+  if args.topUp:
+    topUp = TopUp(args.outputDir, args.bamfile)
+    printGreen("Topping up {} with {}. New reads are parsed into {}".format(args.outputDir, args.bamfile, topUp.runDir))
+
+    for k in ["proviralReads", "hostWithPotentialChimera", "umappedWithPotentialChimera",
+      "viralReadHostClipFasta", "unmappedHostClipFasta"]:
+      outputFNs[k] = topUp.runDir + "/" + os.path.basename(outputFNs[k])
+
+  # a parameter sweep parses the BAM once at the loosest threshold and then evaluates
+  # every LTRClipLen x hostClipLen setting
+  sweep = args.sweepLTRClipLen is not None or args.sweepHostClipLen is not None
+  LTRClipLens = parseIntList(args.sweepLTRClipLen) if args.sweepLTRClipLen is not None else [args.LTRClipLen]
+  hostClipLens = parseIntList(args.sweepHostClipLen) if args.sweepHostClipLen is not None else [args.hostClipLen]
+
+  # one budget shared by every stage
+  resources = ResourceBudget(threads = args.threads,
+    memory = parseMemory(args.memory) if args.memory is not None else None)
+
+  # per stage profiles are written to outputDir/profile
+  profiler = None
+  if args.profile:
+    profiler = StageProfiler(args.outputDir + "/profile", counters = args.profileCounters)
+
+  # progress and throughput for cluster monitoring, written while the run goes on
+  metrics = None
+  if args.metricsFile is not None:
+    metrics = RunMetrics(args.metricsFile, format = args.metricsFormat, interval = args.metricsInterval)
+    metrics.setStage("setup")
+
+  # set up initial read groups. Reads are grouped by query name as they are parsed and
+  # spill to disk past the memory budget, so the input BAM doesn't need to be name sorted
+  tmpDir = args.tmpDir if args.tmpDir is not None else args.outputDir + "/tmp"
+  # BAMs written while parsing: the intermediate BAMs, the checkpoint chunks and one
+  # spilled read group run at a time
+  nParseOutputs = (0 if args.skipIntermediateBams else 3) + (3 if args.checkpointEvery is not None else 0) + \
+    (1 if resources.memory is not None else 0)
+  decompressionThreads, compressionThreads = resources.parseThreads(nOutputs = nParseOutputs)
+  readGroupers = [ExternalNameGrouper(memoryLimit = resources.memoryShare(3), tmpDir = tmpDir, threads = compressionThreads)
+    for i in range(3)]
+  dualProviralAlignedReads, hostReadsWithPotentialChimera, unmappedPotentialChimera = readGroupers
 
   #############################
   # Prepare LTR IDs and seqs
@@ -730,113 +98,217 @@ def main(args):
   proviralSeqs = defaultdict(lambda: [])
   proviralFastaIds = getProviralFastaIDs(args.viralFasta, proviralSeqs)
 
+  proviralSeqLengths = {k: len(proviralSeqs[k][0]) for k in proviralFastaIds}
+
+  # optional cell barcode -> group (ex: cluster) for per group coverage tracks
+  barcodeGroups = None
+  if args.barcodeGroups is not None:
+    barcodeGroups = readBarcodeGroups(args.barcodeGroups)
+
+  # soft clips from Tn5/Nextera adapter read-through are rejected before the chimera analyses
+  adapterFilter = None if args.keepAdapterClips else AdapterClipFilter()
+
   # get possible LTR regions from fasta file
-  if args.LTRmatches is not None:
-    printGreen("Getting potential LTRs")
-    potentialLTR = parseLTRMatches(args.LTRmatches, proviralSeqs)
-  elif args.LTRpositions is not None:
-    printGreen("LTR positions provided as {}".format(args.LTRpositions))
-    potentialLTR = parseLTRMatches(args.LTRpositions, proviralSeqs, position = True)
+  potentialLTR = loadPotentialLTRs(proviralSeqs,
+    LTRmatches = args.LTRmatches,
+    LTRpositions = args.LTRpositions,
+    locateLTRs = args.locateLTRs,
+    LTRreference = args.LTRreference)
+
+  # exact host placement of short clips without starting bwa
+  hostKmerIndex = None
+  if args.hostKmerIndex is not None:
+    if not hostKmerIndexExists(args.hostKmerIndex):
+      printGreen("Building host k-mer index from {}".format(args.hostGenomeIndex))
+      buildHostKmerIndex(args.hostGenomeIndex, args.hostKmerIndex, memoryLimit = resources.memory)
+
+    hostKmerIndex = HostKmerIndex(args.hostKmerIndex)
 
   #############################
   # Parse or load BAM files
   #############################
 
+  # keep the CRAM reference in the local cache so later runs only need --refCache
+  if args.reference is not None and args.refCache is not None:
+    printGreen("Adding {} to reference cache {}".format(args.reference, args.refCache))
+    populateRefCache(args.reference, args.refCache)
+
   if not os.path.exists(outputFNs["proviralReads"]):
     # parse BAM file
-    printGreen("Parsing cellranger BAM (namesorted)")
-    parseCellrangerBam(bamfile = args.bamfile,
-      proviralFastaIds = proviralFastaIds,
-      proviralReads = dualProviralAlignedReads,
-      hostReadsWithPotentialChimera = hostReadsWithPotentialChimera,
-      unmappedPotentialChimera = unmappedPotentialChimera,
-      top_n = args.topNReads) #debugging
-
-    # output BAM files
-    printGreen("Writing out BAM files of parsed records")
+    teeFNs = None
+    if not args.skipIntermediateBams:
+      printGreen("Parsing cellranger BAM and writing out BAM files of parsed records")
+      teeFNs = {k: outputFNs[k] for k in ["proviralReads", "hostWithPotentialChimera", "umappedWithPotentialChimera"]}
+    else:
+      printGreen("Parsing cellranger BAM")
+
+    parseKwargs = {
+      "bamfile": args.bamfile,
+      "proviralFastaIds": proviralFastaIds,
+      "proviralReads": dualProviralAlignedReads,
+      "hostReadsWithPotentialChimera": hostReadsWithPotentialChimera,
+      "unmappedPotentialChimera": unmappedPotentialChimera,
+      "top_n": args.topNReads, #debugging
+      "teeFNs": teeFNs,
+      "decompressionThreads": decompressionThreads,
+      "compressionThreads": compressionThreads,
+      "reference": args.reference,
+      "refCache": args.refCache,
+      "softClipMinLen": min([11] + LTRClipLens),
+      "LTRClipLens": LTRClipLens,
+      "deduplicator": FragmentDeduplicator(maxEntries = args.dedupMaxEntries) if args.dedup else None,
+      "checkpointDir": os.path.dirname(outputFNs["proviralReads"]) + "/checkpoint" if args.checkpointEvery is not None else None,
+      "checkpointEvery": args.checkpointEvery,
+      "proviralLTRSeqs": None if args.noLTRPrescreen else potentialLTR,
+      "adapterFilter": adapterFilter,
+      "metrics": metrics}
+
+    if profiler is not None:
+      profiler.call("parseCellrangerBam", parseCellrangerBam, parseKwargs)
+    else:
+      parseCellrangerBam(**parseKwargs)
 
-    cellrangerBam = pysam.AlignmentFile(args.bamfile, "rb")
-    writeBam(outputFNs["proviralReads"], cellrangerBam, dualProviralAlignedReads)
-    writeBam(outputFNs["hostWithPotentialChimera"], cellrangerBam, hostReadsWithPotentialChimera)
-    writeBam(outputFNs["umappedWithPotentialChimera"], cellrangerBam, unmappedPotentialChimera)
-    cellrangerBam.close()
+    # merge any spilled runs before the groups are shared with worker processes
+    for grouper in readGroupers:
+      grouper.finalize()
 
   else:
     printGreen("Parsed BAM files already found. Importing these files to save time.")
+    if isStreamInput(args.bamfile):
+      printRed("Input stream {} is not read".format(args.bamfile))
     
     # import files
     dualProviralAlignedReads = importProcessedBam(outputFNs["proviralReads"],
-      returnDict = True)
+      returnDict = True, threads = resources.decompressionThreads())
     hostReadsWithPotentialChimera = importProcessedBam(outputFNs["hostWithPotentialChimera"],
-      returnDict = True)
+      returnDict = True, threads = resources.decompressionThreads())
     unmappedPotentialChimera = importProcessedBam(outputFNs["umappedWithPotentialChimera"],
-      returnDict = True)
+      returnDict = True, threads = resources.decompressionThreads())
 
   #############################
   # Begin downstream proc
   #############################
 
-  # parse host reads with potential chimera
-  printGreen("Finding valid chimeras from host reads")
-  validChimerasFromHostReads = parseHostReadsWithPotentialChimera(hostReadsWithPotentialChimera,
-   potentialLTR,
-   proviralSeqs = proviralSeqs,
-   clipMinLen = args.LTRClipLen)
-  
-  printGreen("Finding valid chimeras from proviral reads")
-  proviralProcessedReads = parseProviralReads(
-    readPairs = dualProviralAlignedReads,
-    proviralSeqs = proviralSeqs,
-    hostClipFastaFn = outputFNs["viralReadHostClipFasta"],
-    clipMinLen = args.hostClipLen)
-    
-  printCyanOnGrey("Found {} potential valid chimera(s)".format(len(proviralProcessedReads["potentialValidChimeras"].keys())))
-
-  printGreen("Aligning host clips found on viruses to host genome")
-  validChimerasFromViralReads = alignClipToHost(fafile=outputFNs["viralReadHostClipFasta"],
-    hostGenomeIndex = args.hostGenomeIndex,
-    potentialChimeras = proviralProcessedReads["potentialValidChimeras"],
-    hostClipLen = args.hostClipLen)
-  
-  printGreen("Finding valid unmapped reads that might span between integration site")
-  procUnmappedReads = parseUnmappedReads(unmappedPotentialChimera,
-    proviralSeqs,
-    potentialLTR,
-    unmappedHostClipFn = outputFNs["unmappedHostClipFasta"],
-    LTRClipMinLen = args.LTRClipLen,
-    hostClipMinLen = args.hostClipLen)
-   
-  printCyanOnGrey("Found {} valid unmapped + {} with a potentially valid integration site".format(
-    len(procUnmappedReads["viralFrags"]),
-    len(procUnmappedReads["validChimera"])))
-
-  validChimerasFromUnmappedReads = alignClipToHost(fafile = outputFNs["unmappedHostClipFasta"],
-    hostGenomeIndex = args.hostGenomeIndex,
-    potentialChimeras = procUnmappedReads["validChimera"],
-    hostClipLen = args.hostClipLen)
+  # the host chimera, proviral read and unmapped read paths are independent once parsing
+  # is done. Parsing runs in worker processes and host alignments run on threads
+  # waiting on bwa, so the alignments overlap with the remaining parsing
+  printGreen("Finding valid chimeras from host reads, proviral reads and unmapped reads")
+  # profiled stages run serially so each profile only holds its own stage
+  serial = args.serialStages or profiler is not None
+  scheduler = StageScheduler(workers = 1 if serial else resources.stageWorkers(nStages = 3),
+    progress = metrics.stageProgress if metrics is not None else None)
+
+  settings = [(a, b) for a in LTRClipLens for b in hostClipLens]
+
+  # one viral read alignment per hostClipLen and one unmapped read alignment per setting.
+  # As many of them as there are workers may run next to the worker processes
+  if scheduler.workers <= 1:
+    alignerThreads = resources.alignerThreads()
+  else:
+    nAlignerStages = len(hostClipLens) + len(settings)
+    alignerThreads = resources.alignerThreads(concurrentAligners = min(scheduler.workers, nAlignerStages),
+      workerProcesses = scheduler.workers)
+  settingFNs = {}
+  settingStages = {}
+  for LTRClipLen, hostClipLen in settings:
+    if not sweep:
+      settingFNs[(LTRClipLen, hostClipLen)] = outputFNs
+    else:
+      settingDir = "{}/sweep/LTRClipLen{}_hostClipLen{}".format(args.outputDir, LTRClipLen, hostClipLen)
+      if not os.path.exists(settingDir):
+        os.makedirs(settingDir)
+
+      settingFNs[(LTRClipLen, hostClipLen)] = {
+        "viralReadHostClipFasta": "{}/sweep/hostClipLen{}_viralReadHostClipFasta.fa".format(args.outputDir, hostClipLen),
+        "unmappedHostClipFasta": settingDir + "/unmappedHostClipFasta.fa",
+        "integrationSites": settingDir + "/integrationSites.tsv",
+        "viralFragsFromIntegrationSites": settingDir + "/integrationSites_viralFrags.tsv",
+        "viralFrags": settingDir + "/viralFrags.tsv",
+        "viralCoverage": settingDir + "/viralCoverage"}
+
+    settingStages[(LTRClipLen, hostClipLen)] = scheduleAnalysisStages(scheduler,
+      dualProviralAlignedReads = dualProviralAlignedReads,
+      hostReadsWithPotentialChimera = hostReadsWithPotentialChimera,
+      unmappedPotentialChimera = unmappedPotentialChimera,
+      proviralSeqs = proviralSeqs,
+      potentialLTR = potentialLTR,
+      hostGenomeIndex = args.hostGenomeIndex,
+      hostKmerIndex = hostKmerIndex,
+      LTRClipLen = LTRClipLen,
+      hostClipLen = hostClipLen,
+      viralReadHostClipFasta = settingFNs[(LTRClipLen, hostClipLen)]["viralReadHostClipFasta"],
+      unmappedHostClipFasta = settingFNs[(LTRClipLen, hostClipLen)]["unmappedHostClipFasta"],
+      alignerThreads = alignerThreads,
+      adapterFilter = adapterFilter)
+
+  if profiler is not None:
+    profiler.wrapStages(scheduler)
+
+  stageResults = scheduler.run()
+
+  if profiler is not None:
+    printGreen("Writing stage profiles to {}".format(profiler.profileDir))
+    profiler.writeSummary()
 
   #############################
-  # Compile reads
+  # Export proc files
   #############################
 
-  printGreen("Compiling dataset")
-  compiled = CompiledDataset(
-    validChimerasFromHostReads=validChimerasFromHostReads,
-    validChimerasFromViralReads=validChimerasFromViralReads,
-    validChimerasFromUnmappedReadsHost=procUnmappedReads["validChimera"],
-    validChimerasFromUnmappedReadsViral=validChimerasFromUnmappedReads,
-    validViralReads=proviralProcessedReads["validReads"],
-    unmappedViralReads=procUnmappedReads["viralFrags"]
-  )
+  if metrics is not None:
+    metrics.setStage("export")
 
-  #############################
-  # Export proc files
-  #############################
+  compiledBySetting = {}
+  for setting in settings:
+    stages = settingStages[setting]
+    compiled = stageResults[stages["compiled"]]
+
+    if topUp is not None:
+      compiled = topUp.merge(compiled, outputFNs["integrationSites"], outputFNs["viralFragsFromIntegrationSites"],
+        outputFNs["viralFrags"])
+      printCyanOnGrey("Top-up adds {} integration site(s) and {} viral fragment(s). Skipped {} with a known read name and {} duplicate(s) of known fragments".format(
+        topUp.entry["integrationSites"], topUp.entry["viralFrags"], topUp.entry["duplicateReadnames"], topUp.entry["duplicateFragments"]))
+
+    compiledBySetting[setting] = compiled
+
+    if sweep:
+      printGreen("LTRClipLen = {}, hostClipLen = {}".format(*setting))
+
+    printCyanOnGrey("Found {} potential valid chimera(s)".format(
+      len(stageResults[stages["proviralReads"]]["potentialValidChimeras"].keys())))
+    printCyanOnGrey("Found {} valid unmapped + {} with a potentially valid integration site".format(
+      len(stageResults[stages["unmappedReads"]]["viralFrags"]),
+      len(stageResults[stages["unmappedReads"]]["validChimera"])))
+
+    # write out processed files
+    printGreen("Writing out compiled dataset")
+    compiled.exportIntegrationSiteTSV(settingFNs[setting]["integrationSites"], settingFNs[setting]["viralFragsFromIntegrationSites"])
+    compiled.exportProviralCoverageTSV(settingFNs[setting]["viralFrags"])
+    compiled.exportCoverageBedGraphs(settingFNs[setting]["viralCoverage"], seqLengths = proviralSeqLengths)
+    if barcodeGroups is not None:
+      compiled.exportCoverageBedGraphs(settingFNs[setting]["viralCoverage"], seqLengths = proviralSeqLengths,
+        barcodeGroups = barcodeGroups)
+
+  if args.siteDatabase is not None:
+    sampleName = args.sampleName if args.sampleName is not None else os.path.basename(os.path.normpath(args.outputDir))
+    siteDatabase = SiteDatabase(args.siteDatabase)
+    nAdded = compiledBySetting[settings[0]].exportToSiteDatabase(siteDatabase, sampleName, args.donor)
+    siteDatabase.close()
+    printGreen("Added {} integration site(s) of {} to {}".format(nAdded, sampleName, args.siteDatabase))
+
+  if topUp is not None:
+    topUp.finish()
 
-  # write out processed files
-  printGreen("Writing out compiled dataset")
-  compiled.exportIntegrationSiteTSV(outputFNs["integrationSites"], outputFNs["viralFragsFromIntegrationSites"])
-  compiled.exportProviralCoverageTSV(outputFNs["viralFrags"])
+  if sweep:
+    exportSweepSummaryTSV(args.outputDir + "/sweep/sweepSummary.tsv", compiledBySetting)
+
+  for grouper in readGroupers:
+    grouper.close()
+
+  if os.path.exists(tmpDir) and len(os.listdir(tmpDir)) == 0:
+    os.rmdir(tmpDir)
+
+  if metrics is not None:
+    metrics.setStage("done")
 
 if __name__ == '__main__':
   # set up command line arguments
@@ -845,7 +317,7 @@ if __name__ == '__main__':
 
   parser.add_argument("--bamfile",
     required = True,
-    help = "Name sorted Cellranger BAM file")
+    help = "Cellranger BAM or CRAM file (name or coordinate sorted). Use - to read from stdin (a named pipe can also be given)")
   parser.add_argument("--outputDir",
     required = True,
     help = "Output bam files")
@@ -860,6 +332,12 @@ if __name__ == '__main__':
     help = "blastn table output format for LTR matches to HXB2 LTR")
   parser.add_argument("--LTRpositions",
     help = "if only using one viral sequence, detail LTR positions (1-index) by 5' start, 5' end, 3' start, 3'end (ex: 1,634,9086,9719)")
+  parser.add_argument("--locateLTRs",
+    action = "store_true",
+    help = "Locate 5' and 3' LTRs of each viral sequence by k-mer seeding against an LTR reference (replaces LTRmatches)")
+  parser.add_argument("--LTRreference",
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ltr", "hxb2_ltr5.fa"),
+    help = "LTR fasta used by --locateLTRs. Default is the bundled HXB2 5' LTR")
   parser.add_argument("--LTRClipLen",
     default = 11,
     type = int,
@@ -868,28 +346,122 @@ if __name__ == '__main__':
     default = 17,
     type = int,
     help = "Number of bp to extend into host genome from a chimeric fragment")
+  parser.add_argument("--threads",
+    type = int,
+    help = "Total number of threads shared by BAM (de)compression, worker processes and bwa. Default is the number of available CPUs")
+  parser.add_argument("--memory",
+    help = "Memory ceiling (ex: 16G) after which in-memory read groups are spilled to disk. Default is unbounded")
+  parser.add_argument("--reference",
+    help = "Fasta of the chimeric host + viral reference used to decode CRAM input")
+  parser.add_argument("--refCache",
+    help = "Local reference cache directory (REF_CACHE layout) used to decode CRAM input. Populated from --reference if both are set")
+  parser.add_argument("--tmpDir",
+    help = "Directory for read groups spilled to disk. Default is a tmp directory inside outputDir")
+  parser.add_argument("--skipIntermediateBams",
+    action = "store_true",
+    help = "Don't write proviralReads.bam, hostWithPotentialChimera.bam and unmappedWithPotentialChimera.bam")
+  parser.add_argument("--keepAdapterClips",
+    action = "store_true",
+    help = "Don't reject soft clips that start with Tn5/Nextera adapter sequence (1 mismatch allowed)")
+  parser.add_argument("--noLTRPrescreen",
+    action = "store_true",
+    help = "Keep every host read with a long enough soft clip while parsing, instead of only those whose clip k-mers are all found in an LTR end")
+  parser.add_argument("--checkpointEvery",
+    type = int,
+    help = "Save parsed candidate reads and the position in the input BAM every n reads, so an interrupted parse resumes from there. Default is no checkpoints")
+  parser.add_argument("--dedup",
+    action = "store_true",
+    help = "Remove duplicate fragments (same cell barcode, mate positions and strand) among candidate reads, for BAMs without duplicates marked")
+  parser.add_argument("--dedupMaxEntries",
+    default = 1000000,
+    type = int,
+    help = "Number of fragments remembered by --dedup before the oldest are forgotten. Default is 1000000")
+  parser.add_argument("--serialStages",
+    action = "store_true",
+    help = "Run the host chimera, proviral read and unmapped read analyses one after another instead of concurrently")
+  parser.add_argument("--barcodeGroups",
+    help = "Tab separated file of cell barcode and group (ex: cluster), without header. Viral coverage is also written per group")
+  parser.add_argument("--topUp",
+    action = "store_true",
+    help = "Add the reads of a new BAM (ex: more sequencing of the same library) to the existing results in outputDir. Only the new BAM is processed")
+  parser.add_argument("--siteDatabase",
+    help = "SQLite database of integration sites shared across samples. Sites of this run are added (or replaced) under sampleName")
+  parser.add_argument("--sampleName",
+    help = "Sample name used in siteDatabase. Default is the name of outputDir")
+  parser.add_argument("--donor",
+    help = "Donor of this sample, stored in siteDatabase")
+  parser.add_argument("--profile",
+    action = "store_true",
+    help = "Profile the BAM parse and each analysis stage (run serially). Profiles and a summary of the top functions are written to outputDir/profile")
+  parser.add_argument("--profileCounters",
+    action = "store_true",
+    help = "With --profile, also count regex calls and Seq allocations per stage and per read group")
+  parser.add_argument("--metricsFile",
+    help = "File to write progress metrics to while running (stage, reads parsed, reads/s, candidate reads, memory and estimated parse completion)")
+  parser.add_argument("--metricsFormat",
+    default = "prometheus",
+    choices = metricsFormats,
+    help = "prometheus replaces metricsFile with a Prometheus textfile (ex: for the node exporter textfile collector), jsonl appends a JSON object per update. Default is prometheus")
+  parser.add_argument("--metricsInterval",
+    default = 10,
+    type = float,
+    help = "Minimum seconds between metrics updates while parsing. Default is 10")
   parser.add_argument("--hostGenomeIndex",
     help = "Prefix of bwa indexed host reference genome (NO provirus sequences included)")
+  parser.add_argument("--sweepLTRClipLen",
+    help = "Comma separated LTRClipLen values to evaluate in a single pass (ex: 8,11,15). Replaces LTRClipLen")
+  parser.add_argument("--sweepHostClipLen",
+    help = "Comma separated hostClipLen values to evaluate in a single pass (ex: 15,17,20). Replaces hostClipLen")
+  parser.add_argument("--hostKmerIndex",
+    help = "Directory of memory-mapped host k-mer index for exact placement of host clips (bwa is used for clips the index can't resolve). Built from hostGenomeIndex's fasta if not present")
 
   args = parser.parse_args()
 
   if not os.path.exists(args.outputDir):
     os.makedirs(args.outputDir)
 
-  if not os.path.exists(args.bamfile):
+  if args.bamfile != "-" and not os.path.exists(args.bamfile):
     raise Exception("BAM file not found")
 
+  for sweepArg in [args.sweepLTRClipLen, args.sweepHostClipLen]:
+    if sweepArg is not None and not re.fullmatch(r"\d+(,\d+)*", sweepArg):
+      raise Exception("sweep values must be comma separated integers (ex: 8,11,15)")
+
+  if args.siteDatabase is not None and (args.sweepLTRClipLen is not None or args.sweepHostClipLen is not None):
+    raise Exception("siteDatabase can't be used with a parameter sweep")
+
+  if args.barcodeGroups is not None and not os.path.exists(args.barcodeGroups):
+    raise Exception("barcodeGroups file not found")
+
+  if args.topUp and (args.sweepLTRClipLen is not None or args.sweepHostClipLen is not None):
+    raise Exception("topUp can't be used with a parameter sweep")
+  elif args.topUp and not all(os.path.exists(args.outputDir + "/" + fn) for fn in
+    ["integrationSites.tsv", "integrationSites_viralFrags.tsv", "viralFrags.tsv"]):
+    raise Exception("topUp needs the results of an earlier run in outputDir")
+
+  if args.metricsInterval <= 0:
+    raise Exception("metricsInterval must be greater than 0")
+
+  if args.threads is not None and args.threads < 1:
+    raise Exception("threads must be at least 1")
+
+  if args.reference is not None and not os.path.exists(args.reference):
+    raise Exception("reference FASTA file not found")
+
   if not os.path.exists(args.viralFasta):
     raise Exception("viral FASTA file not found")
 
-  if args.LTRmatches is not None and args.LTRpositions is not None:
-    raise Exception("LTRmatches and LTRpositions cannot both be set")
-  elif args.LTRmatches is None and args.LTRpositions is None:
-    raise Exception("One of LTRmatches and LTRpositions must be specified")
+  LTRModes = [args.LTRmatches is not None, args.LTRpositions is not None, args.locateLTRs]
+  if sum(LTRModes) > 1:
+    raise Exception("Only one of LTRmatches, LTRpositions and locateLTRs can be set")
+  elif sum(LTRModes) == 0:
+    raise Exception("One of LTRmatches, LTRpositions and locateLTRs must be specified")
   elif args.LTRpositions is not None and len(args.LTRpositions.split(",")) != 4:
     raise Exception("LTRpositions must have LTR positions: 5' start, 5' end, 3' start, 3'end (ex: 1,634,9086,9719)")
   elif args.LTRmatches is not None and not os.path.exists(args.LTRmatches):
     raise Exception("LTRmatches file does not exist")
+  elif args.locateLTRs and not os.path.exists(args.LTRreference):
+    raise Exception("LTRreference file does not exist")
 
 
   main(args)
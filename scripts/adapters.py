@@ -0,0 +1,71 @@
+from Bio.Seq import Seq
+
+# sequence read after the insert when a read runs through into the adapter: the Tn5
+# mosaic end (reverse complement) followed by the Nextera i7 or i5 adapter
+adapterReadThrough = {
+  "nexteraRead1": "CTGTCTCTTATACACATCTCCGAGCCCACGAGAC",
+  "nexteraRead2": "CTGTCTCTTATACACATCTGACGCTGCCGACGA"
+}
+
+
+def mismatchVariants(seq, mismatches = 1):
+  variants = {seq}
+  for i in range(mismatches):
+    for variant in list(variants):
+      for j in range(len(variant)):
+        for base in "ACGTN":
+          variants.add(variant[:j] + base + variant[j + 1:])
+
+  return variants
+
+
+class AdapterClipFilter(object):
+  def __init__(self, minLen = 10, maxLen = 20, mismatches = 1):
+    super().__init__()
+
+    # adapter sequence starts at the junction with the aligned part of the read. A 3'
+    # clip starts with it, a 5' clip (reverse strand in the BAM) ends with its reverse
+    # complement. Tables hold the first n bp of each adapter with up to `mismatches`
+    # substitutions, for n from minLen to maxLen, read outward from the junction
+    self.minLen = minLen
+    self.maxLen = maxLen
+    self.rejected = 0
+
+    self.prefixes3 = {}
+    self.prefixes5 = {}
+    for n in range(minLen, maxLen + 1):
+      self.prefixes3[n] = set()
+      self.prefixes5[n] = set()
+
+      for adapter in adapterReadThrough.values():
+        prefix = adapter[:n]
+        self.prefixes3[n].update(mismatchVariants(prefix, mismatches))
+
+        # 5' clips are read backwards from the junction
+        self.prefixes5[n].update(mismatchVariants(str(Seq(prefix).reverse_complement())[::-1], mismatches))
+
+  def isAdapter(self, clip, clip5Present):
+    clip = str(clip)
+    n = min(len(clip), self.maxLen)
+    if n < self.minLen:
+      return False
+
+    if clip5Present:
+      isAdapter = clip[::-1][:n] in self.prefixes5[n]
+    else:
+      isAdapter = clip[:n] in self.prefixes3[n]
+
+    if isAdapter:
+      self.rejected += 1
+
+    return isAdapter
+
+  def isAdapterRead(self, read):
+    # soft clip at either end of a read from the BAM
+    cigar = read.cigartuples
+    if cigar[0][0] == 4 and self.isAdapter(read.query_sequence[:cigar[0][1]], True):
+      return True
+    elif cigar[-1][0] == 4 and self.isAdapter(read.query_sequence[-cigar[-1][1]:], False):
+      return True
+
+    return False
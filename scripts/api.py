@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from scripts.pipeline import *
+from scripts.hostIndex import HostKmerIndex, buildHostKmerIndex, hostKmerIndexExists
+from scripts.resources import ResourceBudget, parseMemory
+from scripts.nameGrouping import ExternalNameGrouper
+from scripts.dedup import FragmentDeduplicator
+
+defaultLTRReference = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ltr", "hxb2_ltr5.fa")
+
+
+class IntegrationPipeline(object):
+  # same analysis as main.py without the output files. References are loaded once so a
+  # long-lived process can run it over many samples or regions (see README)
+  def __init__(self, viralFasta, hostGenomeIndex, LTRmatches = None, LTRpositions = None, locateLTRs = False,
+    LTRreference = defaultLTRReference, LTRClipLen = 11, hostClipLen = 17, hostKmerIndex = None,
+    threads = None, memory = None, workDir = None, reference = None, refCache = None, dedup = False, dedupMaxEntries = 1000000,
+    keepAdapterClips = False, noLTRPrescreen = False):
+    super().__init__()
+
+    self.hostGenomeIndex = hostGenomeIndex
+    self.LTRClipLen = LTRClipLen
+    self.hostClipLen = hostClipLen
+    self.workDir = workDir
+    self.reference = reference
+    self.refCache = refCache
+    self.dedup = dedup
+    self.dedupMaxEntries = dedupMaxEntries
+    self.adapterFilter = None if keepAdapterClips else AdapterClipFilter()
+    self.noLTRPrescreen = noLTRPrescreen
+
+    if isinstance(memory, str):
+      memory = parseMemory(memory)
+    self.resources = ResourceBudget(threads = threads, memory = memory)
+
+    self.proviralSeqs = defaultdict(lambda: [])
+    self.proviralFastaIds = getProviralFastaIDs(viralFasta, self.proviralSeqs)
+    self.potentialLTR = loadPotentialLTRs(self.proviralSeqs,
+      LTRmatches = LTRmatches,
+      LTRpositions = LTRpositions,
+      locateLTRs = locateLTRs,
+      LTRreference = LTRreference)
+
+    self.hostKmerIndex = None
+    if hostKmerIndex is not None:
+      if not hostKmerIndexExists(hostKmerIndex):
+        buildHostKmerIndex(hostGenomeIndex, hostKmerIndex, memoryLimit = self.resources.memory)
+
+      self.hostKmerIndex = HostKmerIndex(hostKmerIndex)
+
+  def groupReads(self, reads, runDir, top_n = -1):
+    # spilled read group runs are the only BAMs written while parsing
+    decompressionThreads, compressionThreads = self.resources.parseThreads(nOutputs = 1 if self.resources.memory is not None else 0)
+    groupers = [ExternalNameGrouper(memoryLimit = self.resources.memoryShare(3), tmpDir = runDir, threads = compressionThreads)
+      for i in range(3)]
+    proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera = groupers
+
+    # a file opened from a path is closed here, an iterable passed in is left to the caller
+    bam = None
+    if isinstance(reads, str):
+      bam = reads = openAlignmentInput(reads, threads = decompressionThreads,
+        reference = self.reference, refCache = self.refCache)
+
+    ltrPrescreen = None
+    if not self.noLTRPrescreen:
+      ltrPrescreen = LTRKmerPrescreen(self.potentialLTR, k = min(11, self.LTRClipLen))
+
+    try:
+      partitionReads(reads, self.proviralFastaIds, proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera,
+        top_n = top_n, softClipMinLen = min(11, self.LTRClipLen),
+        deduplicator = FragmentDeduplicator(maxEntries = self.dedupMaxEntries) if self.dedup else None,
+        ltrPrescreen = ltrPrescreen,
+        adapterFilter = self.adapterFilter,
+        hostMates = HostMateTracker(min(11, self.LTRClipLen), dropClipLen = self.LTRClipLen))
+    finally:
+      if bam is not None:
+        bam.close()
+
+    for grouper in groupers:
+      grouper.finalize()
+
+    return groupers
+
+  def run(self, reads, top_n = -1, dataset = None):
+    # the input is parsed in full first, then the stages run one after another in this
+    # process. Records are yielded as soon as the stage producing them is done. Pass a
+    # CompiledDataset to also collect every record
+    if dataset is None:
+      dataset = CompiledDataset()
+
+    if self.workDir is not None and not os.path.exists(self.workDir):
+      os.makedirs(self.workDir)
+
+    runDir = tempfile.mkdtemp(dir = self.workDir)
+    groupers = []
+
+    try:
+      groupers = self.groupReads(reads, runDir, top_n = top_n)
+      proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera = groupers
+
+      nSites, nFrags = 0, 0
+      def newRecords():
+        nonlocal nSites, nFrags
+        records = dataset.integrationSites[nSites:] + dataset.viralFrags[nFrags:]
+        nSites, nFrags = len(dataset.integrationSites), len(dataset.viralFrags)
+        return records
+
+      # host reads with LTR clips
+      dataset.addHostChimeras(parseHostReadsWithPotentialChimera(hostReadsWithPotentialChimera,
+        self.potentialLTR, self.proviralSeqs, self.LTRClipLen, adapterFilter = self.adapterFilter))
+      yield from newRecords()
+
+      # proviral reads with host clips
+      proviral = parseProviralReads(proviralReads, self.proviralSeqs,
+        os.path.join(runDir, "viralReadHostClipFasta.fa"), clipMinLen = self.hostClipLen, adapterFilter = self.adapterFilter)
+      dataset.addViralChimeras(alignClipToHost(os.path.join(runDir, "viralReadHostClipFasta.fa"),
+        self.hostGenomeIndex, proviral["potentialValidChimeras"],
+        hostClipLen = self.hostClipLen,
+        hostKmerIndex = self.hostKmerIndex,
+        threads = self.resources.alignerThreads()), proviral["validReads"])
+      dataset.addViralReads(proviral["validReads"])
+      yield from newRecords()
+
+      # read pairs with one proviral and one host mate
+      unmapped = parseUnmappedReads(unmappedPotentialChimera, self.proviralSeqs, self.potentialLTR,
+        os.path.join(runDir, "unmappedHostClipFasta.fa"),
+        LTRClipMinLen = self.LTRClipLen,
+        hostClipMinLen = self.hostClipLen,
+        adapterFilter = self.adapterFilter)
+      dataset.addUnmappedHostChimeras(unmapped["validChimera"])
+      dataset.addUnmappedViralChimeras(alignClipToHost(os.path.join(runDir, "unmappedHostClipFasta.fa"),
+        self.hostGenomeIndex, unmapped["validChimera"],
+        hostClipLen = self.hostClipLen,
+        hostKmerIndex = self.hostKmerIndex,
+        threads = self.resources.alignerThreads()))
+      dataset.addUnmappedViralReads(unmapped["viralFrags"])
+      yield from newRecords()
+
+    finally:
+      for grouper in groupers:
+        grouper.close()
+
+      shutil.rmtree(runDir, ignore_errors = True)
+
+  def integrationSites(self, reads, top_n = -1):
+    for record in self.run(reads, top_n = top_n):
+      if isinstance(record, ChimericRead):
+        yield record
+
+  def proviralFragments(self, reads, top_n = -1):
+    for record in self.run(reads, top_n = top_n):
+      if isinstance(record, ProviralFragment):
+        yield record
+
+  def compile(self, reads, top_n = -1):
+    # everything at once, i.e. for the TSV exports of CompiledDataset
+    dataset = CompiledDataset()
+    for record in self.run(reads, top_n = top_n, dataset = dataset):
+      pass
+
+    return dataset
@@ -6,11 +6,13 @@ def separateCigarString(cigarstring):
 
   return cigarSepExpanded
 
+def parseIntList(values):
+  return sorted(set(int(x) for x in values.split(",")))
+
 def extractCellBarcode(read):
   # accept only CB tag because it passes the allowlist set by 10X
-  tags = dict(read.tags)
-  if "CB" in tags:
-      barcode = tags["CB"]
+  if read.has_tag("CB"):
+      barcode = read.get_tag("CB")
   else:
       barcode = None
 
@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import hashlib
+import pysam
+
+manifestName = "manifest.json"
+rejectedNamesName = "rejectedHostNames.txt"
+
+
+def inputIdentity(bamfile, **params):
+  # a checkpoint is only resumed for the same input and parse parameters
+  fileStat = os.stat(bamfile)
+  return dict(bamfile = os.path.abspath(bamfile), size = fileStat.st_size, mtime = fileStat.st_mtime, **params)
+
+
+def proviralDigest(proviralFastaIds, proviralLTRSeqs = None):
+  # reads are classified by the viral fasta ids and host clips are prescreened against
+  # the LTR sequences, so a change to either invalidates the parsed candidates
+  digest = hashlib.sha1()
+  for name in proviralFastaIds:
+    digest.update("id\t{}\n".format(name).encode())
+
+  if proviralLTRSeqs is not None:
+    for key in sorted(proviralLTRSeqs):
+      for ltrType in sorted(proviralLTRSeqs[key]):
+        digest.update("ltr\t{}\t{}\t{}\n".format(key, ltrType, proviralLTRSeqs[key][ltrType]).encode())
+
+  return digest.hexdigest()
+
+
+class ScanCheckpointer(object):
+  def __init__(self, checkpointDir, bam, identity, every = 10000000, threads = 1, hostMates = None, deduplicator = None):
+    super().__init__()
+
+    # candidate reads are also written to chunk BAMs. Every `every` reads, at the first
+    # read of a new query name, the open chunks are closed and the BGZF virtual offset of
+    # that read is saved with them. A restart reloads the chunks and seeks to the offset
+    self.checkpointDir = checkpointDir
+    self.bam = bam
+    self.identity = identity
+    self.every = every
+    self.threads = threads
+    # names and clip lengths of host reads rejected while parsing are appended to a text
+    # file at each checkpoint, so their mates are still handled after a restart
+    self.hostMates = hostMates
+    self.rejectedNamesFn = os.path.join(checkpointDir, rejectedNamesName)
+    if hostMates is not None:
+      hostMates.pending = []
+    # the kept fragments are registered again from the chunks on a restart, and the
+    # count of duplicates removed so far is saved with each checkpoint
+    self.deduplicator = deduplicator
+
+    self.chunks = 0
+    self.chunkBams = None
+    self.offset = bam.tell()
+    self.lastName = None
+    self.readsSinceCheckpoint = 0
+
+    if not os.path.exists(checkpointDir):
+      os.makedirs(checkpointDir)
+
+  def chunkFn(self, chunk, key):
+    return os.path.join(self.checkpointDir, "{}.{}.bam".format(key, chunk))
+
+  def loadManifest(self):
+    fn = os.path.join(self.checkpointDir, manifestName)
+    if not os.path.exists(fn):
+      return None
+
+    with open(fn, "r") as fhandle:
+      manifest = json.load(fhandle)
+
+    if manifest["identity"] != self.identity:
+      return None
+
+    return manifest
+
+  def resume(self, readGroups, teeBams = None):
+    # returns the number of reads already scanned (0 if there is no usable checkpoint)
+    manifest = self.loadManifest()
+    if manifest is None:
+      self.clear()
+      return 0
+
+    for chunk in range(manifest["chunks"]):
+      for key in manifest["keys"]:
+        with pysam.AlignmentFile(self.chunkFn(chunk, key), "rb", threads = self.threads) as chunkBam:
+          for read in chunkBam:
+            # registers the fragments kept before the restart
+            if self.deduplicator is not None:
+              self.deduplicator.isDuplicate(read)
+
+            readGroups[key].addRead(read)
+            if self.hostMates is not None and key == "hostWithPotentialChimera":
+              self.hostMates.addKept(read)
+            if teeBams is not None:
+              teeBams[key].write(read)
+
+    # names written after the last checkpoint are cut off
+    if self.hostMates is not None:
+      rejectedNamesSize = manifest.get("rejectedNamesSize", 0)
+      if os.path.exists(self.rejectedNamesFn):
+        with open(self.rejectedNamesFn, "r+") as fhandle:
+          fhandle.truncate(rejectedNamesSize)
+          for line in fhandle.read().splitlines():
+            name, clipLen = line.split("\t")
+            self.hostMates.addRejected(name, int(clipLen))
+
+    if self.deduplicator is not None:
+      self.deduplicator.duplicates = manifest.get("duplicates", 0)
+
+    self.chunks = manifest["chunks"]
+    self.offset = manifest["offset"]
+    self.bam.seek(self.offset)
+
+    return manifest["readIndex"]
+
+  def nextRead(self, read, readIndex, keys):
+    # called before each read is handled. self.offset is where this read starts
+    if self.readsSinceCheckpoint >= self.every and read.query_name != self.lastName:
+      self.checkpoint(readIndex, keys)
+
+    self.offset = self.bam.tell()
+    self.lastName = read.query_name
+    self.readsSinceCheckpoint += 1
+
+  def addCandidate(self, key, read, keys):
+    if self.chunkBams is None:
+      self.chunkBams = {k: pysam.AlignmentFile(self.chunkFn(self.chunks, k), "wb", template = self.bam,
+        threads = self.threads) for k in keys}
+
+    self.chunkBams[key].write(read)
+
+  def checkpoint(self, readIndex, keys):
+    if self.chunkBams is not None:
+      for chunkBam in self.chunkBams.values():
+        chunkBam.close()
+
+      self.chunkBams = None
+      self.chunks += 1
+
+    rejectedNamesSize = 0
+    if self.hostMates is not None:
+      with open(self.rejectedNamesFn, "a") as fhandle:
+        fhandle.write("".join("{}\t{}\n".format(name, clipLen) for name, clipLen in self.hostMates.pending))
+        rejectedNamesSize = fhandle.tell()
+      self.hostMates.pending = []
+
+    manifest = {
+      "identity": self.identity,
+      "keys": list(keys),
+      "chunks": self.chunks,
+      "offset": self.offset,
+      "readIndex": readIndex,
+      "rejectedNamesSize": rejectedNamesSize,
+      "duplicates": self.deduplicator.duplicates if self.deduplicator is not None else 0}
+
+    fn = os.path.join(self.checkpointDir, manifestName)
+    with open(fn + ".tmp", "w") as fhandle:
+      json.dump(manifest, fhandle)
+    os.replace(fn + ".tmp", fn)
+
+    self.readsSinceCheckpoint = 0
+
+  def clear(self):
+    for fn in os.listdir(self.checkpointDir):
+      os.remove(os.path.join(self.checkpointDir, fn))
+
+  def finish(self):
+    # the parse completed, so the checkpoint is no longer needed
+    if self.chunkBams is not None:
+      for chunkBam in self.chunkBams.values():
+        chunkBam.close()
+
+    shutil.rmtree(self.checkpointDir, ignore_errors = True)
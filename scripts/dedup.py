@@ -0,0 +1,62 @@
+import re
+from collections import OrderedDict
+from scripts.baseFunctions import extractCellBarcode
+
+# cigar operations that consume the reference
+referenceOps = set("MDN=X")
+
+
+def cigarReferenceLength(cigarstring):
+  return sum(int(length) for length, op in re.findall(r"(\d+)([MIDNSHP=X])", cigarstring) if op in referenceOps)
+
+
+def fivePrimeEnds(read):
+  # reference position of the 5' end of the read and of its mate: the start of a forward
+  # read, the end of a reverse one. The mate's end comes from its cigar (MC tag).
+  # Without the tag its start is used, which the same mate of a duplicate pair shares
+  ownEnd = read.reference_end if read.is_reverse and not read.is_unmapped else read.reference_start
+
+  mateEnd = read.next_reference_start
+  if read.mate_is_reverse and read.has_tag("MC"):
+    mateEnd += cigarReferenceLength(read.get_tag("MC"))
+
+  return (read.reference_id, ownEnd), (read.next_reference_id, mateEnd)
+
+
+def fragmentKey(read):
+  # same key for both mates: reference and start of the fragment, reference and end of
+  # the fragment (the end of the reverse mate), strand of read 1 and cell barcode
+  start, end = sorted(fivePrimeEnds(read))
+  read1Reverse = read.is_reverse if read.is_read1 else read.mate_is_reverse
+
+  return (start[0], start[1], end[0], end[1], read1Reverse, extractCellBarcode(read))
+
+
+class FragmentDeduplicator(object):
+  def __init__(self, maxEntries = 1000000):
+    super().__init__()
+
+    # hashed fragment key -> hashed name of the first read pair seen with that key.
+    # Oldest entries are evicted past maxEntries, so memory stays bounded
+    self.maxEntries = maxEntries
+    self.seen = OrderedDict()
+    self.duplicates = 0
+
+  def isDuplicate(self, read):
+    key = hash(fragmentKey(read))
+    qname = hash(read.query_name)
+
+    seenQname = self.seen.get(key)
+    if seenQname is None:
+      self.seen[key] = qname
+      if len(self.seen) > self.maxEntries:
+        self.seen.popitem(last = False)
+
+      return False
+
+    # mate of the pair that was kept
+    if seenQname == qname:
+      return False
+
+    self.duplicates += 1
+    return True
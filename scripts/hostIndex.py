@@ -0,0 +1,245 @@
+import os
+import json
+import numpy as np
+
+# A/C/G/T -> 0-3, anything else (N, IUPAC) -> 4
+baseCodes = np.full(256, 4, dtype = np.uint8)
+for i, base in enumerate(b"ACGT"):
+  baseCodes[base] = i
+  baseCodes[base + 32] = i
+
+indexFiles = {
+  "meta": "meta.json",
+  "genome": "genome.npy",
+  "keys": "kmerKeys.npy",
+  "positions": "kmerPositions.npy"
+}
+
+
+def encodeSeq(seq):
+  if isinstance(seq, str):
+    seq = seq.encode()
+
+  return baseCodes[np.frombuffer(seq, dtype = np.uint8)]
+
+
+def readFastaCodes(fafile):
+  name = None
+  lines = []
+
+  with open(fafile, "rb") as fhandle:
+    for line in fhandle:
+      if line.startswith(b">"):
+        if name is not None:
+          yield name, encodeSeq(b"".join(lines))
+
+        name = line[1:].split()[0].decode()
+        lines = []
+      else:
+        lines.append(line.rstrip())
+
+  if name is not None:
+    yield name, encodeSeq(b"".join(lines))
+
+
+def kmerKeys(codes, k):
+  # 2 bit packed k-mers (k <= 16 fits in uint32) and a mask of windows without N's
+  nWindows = len(codes) - k + 1
+  if nWindows <= 0:
+    return np.zeros(0, dtype = np.uint32), np.zeros(0, dtype = bool)
+
+  keys = np.zeros(nWindows, dtype = np.uint32)
+  for j in range(k):
+    keys = (keys << np.uint32(2)) | (codes[j:j + nWindows] & 3).astype(np.uint32)
+
+  nCounts = np.concatenate(([0], np.cumsum(codes == 4)))
+  valid = (nCounts[k:] - nCounts[:nWindows]) == 0
+
+  return keys, valid
+
+
+# peak memory of buildHostKmerIndex per host base: the packed (k-mer, position)
+# entries before and after they are joined, and the key and position columns split
+# from them
+buildBytesPerBase = 24
+
+
+def fastaBases(fafile):
+  # sequence length from the fasta index if there is one, else the file size (an
+  # upper bound)
+  if os.path.exists(fafile + ".fai"):
+    with open(fafile + ".fai", "r") as fhandle:
+      return sum(int(line.split("\t")[1]) for line in fhandle if line.strip() != "")
+
+  return os.path.getsize(fafile)
+
+
+def availableMemory():
+  # MemAvailable of /proc/meminfo, or None where it can't be read
+  try:
+    with open("/proc/meminfo", "r") as fhandle:
+      for line in fhandle:
+        if line.startswith("MemAvailable:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+
+  return None
+
+
+def hostKmerIndexExists(indexDir):
+  return all(os.path.exists(os.path.join(indexDir, fn)) for fn in indexFiles.values())
+
+
+def buildHostKmerIndex(fafile, indexDir, k = 16, memoryLimit = None):
+  if k > 16:
+    raise Exception("Host k-mer index supports k <= 16")
+
+  # every k-mer position is indexed, so bwa's seeds are all found (a sampled index
+  # would miss seeds shorter than k plus the sampling step). The build is checked
+  # against the free memory and memoryLimit (--memory) before it starts
+  needed = fastaBases(fafile) * buildBytesPerBase
+  limits = [x for x in [availableMemory(), memoryLimit] if x is not None]
+  if len(limits) != 0 and needed > min(limits):
+    raise Exception("Building the host k-mer index of {} needs about {:.1f} GB of memory and {:.1f} GB is available. Build it on a larger machine or run without hostKmerIndex".format(
+      fafile, needed / 1024 ** 3, min(limits) / 1024 ** 3))
+
+  if not os.path.exists(indexDir):
+    os.makedirs(indexDir)
+
+  names = []
+  offsets = []
+  genomeParts = []
+  entries = []
+  offset = 0
+
+  for name, codes in readFastaCodes(fafile):
+    keys, valid = kmerKeys(codes, k)
+    positions = np.nonzero(valid)[0].astype(np.uint64) + np.uint64(offset)
+
+    # key in the high bits so a single sort orders by k-mer, then by position
+    entries.append((keys[valid].astype(np.uint64) << np.uint64(32)) | positions)
+
+    names.append(name)
+    offsets.append(offset)
+    genomeParts.append(codes)
+
+    # separate chromosomes with an N so exact matches can't span two of them
+    genomeParts.append(np.full(1, 4, dtype = np.uint8))
+    offset += len(codes) + 1
+
+  if offset >= 2 ** 32:
+    raise Exception("Host genome is too large for a 32-bit position index")
+
+  entries = np.concatenate(entries)
+  entries.sort()
+
+  np.save(os.path.join(indexDir, indexFiles["keys"]), (entries >> np.uint64(32)).astype(np.uint32))
+  np.save(os.path.join(indexDir, indexFiles["positions"]), (entries & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+  del entries
+
+  np.save(os.path.join(indexDir, indexFiles["genome"]), np.concatenate(genomeParts))
+
+  with open(os.path.join(indexDir, indexFiles["meta"]), "w") as fhandle:
+    json.dump({"k": k, "fasta": os.path.abspath(fafile), "names": names, "offsets": offsets}, fhandle)
+
+
+class HostKmerIndex(object):
+  def __init__(self, indexDir, maxCandidates = 10000):
+    super().__init__()
+
+    with open(os.path.join(indexDir, indexFiles["meta"]), "r") as fhandle:
+      meta = json.load(fhandle)
+
+    self.k = meta["k"]
+    self.names = meta["names"]
+    self.offsets = np.array(meta["offsets"], dtype = np.int64)
+    self.maxCandidates = maxCandidates
+
+    # memory mapped so the OS page cache shares the index between runs
+    self.genome = np.load(os.path.join(indexDir, indexFiles["genome"]), mmap_mode = "r")
+    self.keys = np.load(os.path.join(indexDir, indexFiles["keys"]), mmap_mode = "r")
+    self.positions = np.load(os.path.join(indexDir, indexFiles["positions"]), mmap_mode = "r")
+
+  def seedDiagonals(self, codes, seedLen):
+    # genome positions of clip base 0 for every exact seed match. Seeds shorter than k
+    # are looked up as a key prefix range. bwa only extends alignments from seeds of at
+    # least its -k, so these are the loci it could report (seeds in the last k - seedLen
+    # bases of a chromosome aren't indexed)
+    s = min(self.k, seedLen)
+    keys, valid = kmerKeys(codes, s)
+    if len(keys) == 0:
+      return np.zeros(0, dtype = np.int64)
+
+    shift = np.uint32(2 * (self.k - s))
+    seedOffsets = np.nonzero(valid)[0]
+    prefixes = keys[valid] << shift
+    left = np.searchsorted(self.keys, prefixes, side = "left")
+    right = np.searchsorted(self.keys, prefixes | ((np.uint32(1) << shift) - np.uint32(1)), side = "right")
+
+    if (right - left).sum() > self.maxCandidates:
+      return None
+
+    diagonals = [self.positions[l:r].astype(np.int64) - offset for l, r, offset in zip(left, right, seedOffsets)]
+    return np.unique(np.concatenate(diagonals))
+
+  def ungappedScores(self, codes, diagonals):
+    # best local ungapped score on each diagonal with bwa mem's default scoring
+    # (match 1, mismatch 4) and the number of mismatches over the full clip
+    idx = diagonals[:, None] + np.arange(len(codes))
+    inside = (idx >= 0) & (idx < len(self.genome))
+    matches = inside & (self.genome[np.clip(idx, 0, len(self.genome) - 1)] == codes)
+
+    cumScore = np.concatenate((np.zeros((len(diagonals), 1), dtype = np.int64),
+      np.cumsum(np.where(matches, 1, -4), axis = 1)), axis = 1)
+    best = (cumScore - np.minimum.accumulate(cumScore, axis = 1)).max(axis = 1)
+
+    return best, (~matches).sum(axis = 1)
+
+  def place(self, clip, minScore, seedLen):
+    # returns a list of (chr, 0-based pos, isReverse) exact placements or None if the
+    # clip needs a full aligner. bwa mem -a -T minScore rejects a clip with a second
+    # alignment scoring minScore or more, so a single exact placement is only returned
+    # when no other locus reachable from a seed could score that high. Nearby diagonals
+    # (within bwa's band) are combined as a gapped alignment, at a cost of a gap open
+    # and extension each
+    codes = encodeSeq(str(clip))
+    if len(codes) < self.k or (codes == 4).any():
+      return None
+
+    hits = []
+    others = []
+    for isReverse, strandCodes in ((False, codes), (True, (3 - codes[::-1]).astype(np.uint8))):
+      diagonals = self.seedDiagonals(strandCodes, seedLen)
+      if diagonals is None:
+        return None
+      elif len(diagonals) == 0:
+        continue
+
+      best, mismatches = self.ungappedScores(strandCodes, diagonals)
+      exact = mismatches == 0
+      for pos in diagonals[exact]:
+        chromIndex = int(np.searchsorted(self.offsets, pos, side = "right")) - 1
+        hits.append((self.names[chromIndex], int(pos - self.offsets[chromIndex]), isReverse))
+
+      others.append((diagonals[~exact], best[~exact]))
+
+    if len(hits) != 1:
+      return hits if len(hits) > 1 else None
+
+    for diagonals, best in others:
+      if len(diagonals) != 0 and self.bestLocusScore(diagonals, best, len(codes)) >= minScore:
+        return None
+
+    return hits
+
+  def bestLocusScore(self, diagonals, best, clipLen, bandWidth = 100, gapCost = 7):
+    # upper bound of a gapped alignment over diagonals within bandWidth of each other
+    loci = np.split(np.arange(len(diagonals)), np.nonzero(np.diff(diagonals) > bandWidth)[0] + 1)
+    bound = 0
+    for locus in loci:
+      scores = np.sort(best[locus])[::-1]
+      combined = np.cumsum(scores) - gapCost * np.arange(len(scores))
+      bound = max(bound, min(clipLen, int(combined.max())))
+
+    return bound
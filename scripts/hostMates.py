@@ -0,0 +1,90 @@
+from scripts.baseFunctions import separateCigarString
+
+# tag set on a kept host read whose mate was rejected while parsing. It holds the length
+# of the mate's soft clip, so each clip length setting can tell if the pair had two clips
+mateClipTag = "ZR"
+
+
+def endClipLen(read):
+  # longest soft clip at either end of a read
+  cigar = read.cigartuples
+  if cigar is None:
+    return 0
+
+  return max(cigar[0][1] if cigar[0][0] == 4 else 0, cigar[-1][1] if cigar[-1][0] == 4 else 0)
+
+
+def mateMayHaveHostClip(read, softClipMinLen = 11):
+  # the mate cigar (MC tag) tells whether the mate can be a host clip read too. Without
+  # the tag that has to be assumed
+  if not read.has_tag("MC"):
+    return True
+
+  cigar = separateCigarString(read.get_tag("MC"))
+  if len(cigar) == 0:
+    return True
+
+  return (cigar[0][1] == "S" and int(cigar[0][0]) >= softClipMinLen) or \
+    (cigar[-1][1] == "S" and int(cigar[-1][0]) >= softClipMinLen)
+
+
+class HostMateTracker(object):
+  def __init__(self, softClipMinLen = 11, dropClipLen = None):
+    super().__init__()
+
+    # parseHostReadsWithPotentialChimera skips a query name with more than one clipped
+    # read. A read rejected while parsing (adapter clip or LTR prescreen) must not
+    # leave its mate as the only clipped read of the pair, so the decision is made per
+    # pair: a rejected read whose mate was already kept is kept as well. A read whose
+    # mate was rejected before is dropped if the mate's clip is at least dropClipLen
+    # (the longest clip length of a sweep), or else kept with the mate's clip length in
+    # mateClipTag. Either way the pair gives no host chimera at a clip length the mate
+    # passes, as without the filters
+    self.softClipMinLen = softClipMinLen
+    self.dropClipLen = dropClipLen if dropClipLen is not None else softClipMinLen
+    # rejected query name -> clip length
+    self.rejected = {}
+    self.kept = set()
+    # rejected (name, clip length) not yet saved to a checkpoint (only collected when
+    # checkpointing)
+    self.pending = None
+
+    self.keptForMate = 0
+    self.droppedForMate = 0
+    self.taggedForMate = 0
+
+  def keepRejected(self, read):
+    # called for a read one of the filters rejected. True if it has to be kept anyway
+    name = read.query_name
+    if name in self.kept:
+      self.keptForMate += 1
+      return True
+
+    if mateMayHaveHostClip(read, self.softClipMinLen):
+      clipLen = max(endClipLen(read), self.rejected.get(name, 0))
+      self.rejected[name] = clipLen
+      if self.pending is not None:
+        self.pending.append((name, clipLen))
+
+    return False
+
+  def dropPassing(self, read):
+    # called for a read the filters passed. True if its mate was rejected with a clip
+    # long enough for every setting, otherwise the mate's clip length is tagged
+    clipLen = self.rejected.get(read.query_name)
+    if clipLen is None:
+      return False
+
+    if clipLen >= self.dropClipLen:
+      self.droppedForMate += 1
+      return True
+
+    read.set_tag(mateClipTag, clipLen, value_type = "i")
+    self.taggedForMate += 1
+    return False
+
+  def addKept(self, read):
+    self.kept.add(read.query_name)
+
+  def addRejected(self, name, clipLen):
+    self.rejected[name] = max(clipLen, self.rejected.get(name, 0))
@@ -1,10 +1,29 @@
+import os
+import stat
+import csv
 import pysam
+import copyreg
+import hashlib
 from collections import defaultdict
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
 
+# pysam records can't be pickled by default. Reduce them to their SAM text so reads
+# can be returned from worker processes (the header is pickled once per payload)
+def reduceAlignmentHeader(header):
+  return (pysam.AlignmentHeader.from_dict, (header.to_dict(), ))
+
+
+def reduceAlignedSegment(read):
+  return (pysam.AlignedSegment.fromstring, (read.to_string(), read.header))
+
+
+copyreg.pickle(pysam.AlignmentHeader, reduceAlignmentHeader)
+copyreg.pickle(pysam.AlignedSegment, reduceAlignedSegment)
+
+
 def writeBam(fn, templateBam, reads):
   outputBam = pysam.AlignmentFile(fn, "wb", template = templateBam)
   
@@ -17,8 +36,65 @@ def writeBam(fn, templateBam, reads):
         outputBam.write(read)
 
 
-def importProcessedBam(bamfile, returnDict = True):
-  bam = pysam.AlignmentFile(bamfile, "rb", threads = 20)
+def refCachePath(refCache):
+  # same layout as samtools' seq_cache_populate.pl (REF_CACHE=dir/%2s/%2s/%s)
+  return os.path.join(refCache, "%2s", "%2s", "%s")
+
+
+def populateRefCache(fafile, refCache):
+  added = 0
+  for record in SeqIO.parse(fafile, format = "fasta"):
+    seq = str(record.seq).upper().encode()
+    md5 = hashlib.md5(seq).hexdigest()
+
+    cacheFn = os.path.join(refCache, md5[0:2], md5[2:4], md5[4:])
+    if os.path.exists(cacheFn):
+      continue
+
+    if not os.path.exists(os.path.dirname(cacheFn)):
+      os.makedirs(os.path.dirname(cacheFn))
+
+    with open(cacheFn + ".tmp", "wb") as fhandle:
+      fhandle.write(seq)
+    os.replace(cacheFn + ".tmp", cacheFn)
+    added += 1
+
+  return added
+
+
+def isStreamInput(fn):
+  # stdin ("-") or a named pipe. These can only be read once, front to back
+  return fn == "-" or (os.path.exists(fn) and stat.S_ISFIFO(os.stat(fn).st_mode))
+
+
+def openAlignmentInput(fn, threads = 1, reference = None, refCache = None):
+  # BAM or CRAM (format is detected by htslib), from a file, a named pipe or stdin ("-").
+  # CRAM references are either given directly or looked up by the M5 tags of the header
+  # in the local cache
+  if refCache is not None:
+    os.environ["REF_PATH"] = refCachePath(refCache)
+    os.environ["REF_CACHE"] = refCachePath(refCache)
+
+  if reference is not None:
+    return pysam.AlignmentFile(fn, "rb", threads = threads, reference_filename = reference)
+  else:
+    return pysam.AlignmentFile(fn, "rb", threads = threads)
+
+
+def openTeeBams(fns, templateBam, threads = 1):
+  # written under a temporary name and renamed once complete so that a partially
+  # written BAM is never mistaken for a finished parse
+  return {k: pysam.AlignmentFile(fns[k] + ".tmp", "wb", template = templateBam, threads = threads) for k in fns}
+
+
+def closeTeeBams(bams, fns):
+  for k in bams:
+    bams[k].close()
+    os.replace(fns[k] + ".tmp", fns[k])
+
+
+def importProcessedBam(bamfile, returnDict = True, threads = 1):
+  bam = pysam.AlignmentFile(bamfile, "rb", threads = threads)
 
   if returnDict:
     val = defaultdict(list)
@@ -34,6 +110,16 @@ def importProcessedBam(bamfile, returnDict = True):
   return val
 
 
+def readBarcodeGroups(fn):
+  barcodeGroups = {}
+  with open(fn, "r") as fhandle:
+    for row in csv.reader(fhandle, delimiter = "\t"):
+      if len(row) >= 2:
+        barcodeGroups[row[0]] = row[1]
+
+  return barcodeGroups
+
+
 def writeFasta(chimeras, fastafn):
   records = []
   for qnameKey in chimeras:
@@ -0,0 +1,143 @@
+from Bio import SeqIO
+from Bio.Seq import Seq
+from collections import defaultdict
+
+
+def loadLTRReference(fafile):
+  record = next(SeqIO.parse(fafile, format = "fasta"))
+  return str(record.seq).upper()
+
+
+def buildLTRKmerIndex(ltrSeq, k):
+  # seeds from both strands so that reverse oriented viral sequences are still found
+  index = defaultdict(list)
+  ltrRevComp = str(Seq(ltrSeq).reverse_complement())
+
+  for strand, s in (("+", ltrSeq), ("-", ltrRevComp)):
+    for i in range(len(s) - k + 1):
+      index[s[i:i + k]].append((strand, i))
+
+  return index
+
+
+def bestDiagonalBand(seeds, bandWidth):
+  # seeds are (seqPos, ltrPos) pairs. Seeds from a true LTR hit share (roughly) the
+  # same diagonal, neighbouring bands are merged so small indels stay in one hit
+  bands = defaultdict(list)
+  for seqPos, ltrPos in seeds:
+    bands[(seqPos - ltrPos) // bandWidth].append((seqPos, ltrPos))
+
+  bandSize = lambda b: len(bands[b]) + len(bands.get(b - 1, [])) + len(bands.get(b + 1, []))
+  best = max(bands, key = bandSize)
+
+  return sorted(bands.get(best - 1, []) + bands[best] + bands.get(best + 1, []))
+
+
+def alignFlank(ltrFlank, seqFlank, band, match = 1, mismatch = -1, gap = -2):
+  # banded global alignment of ltrFlank against a prefix of seqFlank, both read outward
+  # from the seeded region. Returns how many seqFlank bases the best alignment uses, or
+  # None if the sequence ends before the LTR could
+  n = len(ltrFlank)
+  m = len(seqFlank)
+  if n == 0:
+    return 0
+
+  none = float("-inf")
+  prev = [gap * j if j <= band else none for j in range(m + 1)]
+  for i in range(1, n + 1):
+    row = [none] * (m + 1)
+    if i <= band:
+      row[0] = gap * i
+    for j in range(max(1, i - band), min(m, i + band) + 1):
+      row[j] = max(prev[j - 1] + (match if ltrFlank[i - 1] == seqFlank[j - 1] else mismatch),
+        prev[j] + gap,
+        row[j - 1] + gap)
+    prev = row
+
+  # the LTR edge is where the best alignment of the whole flank ends, the one without
+  # net indels on a tie
+  ends = [j for j in range(max(0, n - band), min(m, n + band) + 1) if prev[j] != none]
+  if len(ends) == 0:
+    return None
+
+  return max(ends, key = lambda j: (prev[j], -abs(j - n)))
+
+
+def findLTRInWindow(seq, windowStart, windowEnd, ltrIndex, ltrSeqs, k, bandWidth):
+  # ltrSeqs is the LTR reference of each strand ("+", "-")
+  ltrLen = len(ltrSeqs["+"])
+  seeds = {"+": [], "-": []}
+  for i in range(windowStart, windowEnd - k + 1):
+    hits = ltrIndex.get(seq[i:i + k])
+    if hits is None:
+      continue
+
+    for strand, ltrPos in hits:
+      seeds[strand].append((i, ltrPos))
+
+  best = None
+  for strand in seeds:
+    if len(seeds[strand]) == 0:
+      continue
+
+    band = bestDiagonalBand(seeds[strand], bandWidth)
+    if best is None or len(band) > len(best[1]):
+      best = (strand, band)
+
+  if best is None:
+    return None
+
+  strand, band = best
+  firstSeqPos, firstLtrPos = band[0]
+  lastSeqPos, lastLtrPos = band[-1]
+
+  # extend the seeded region out to where the LTR ends would be, bounded by the sequence.
+  # Without seeds right at the LTR ends, the unseeded LTR edges are aligned in a band so
+  # indels there don't shift the ends
+  seqStart = max(0, firstSeqPos - firstLtrPos)
+  seqEnd = min(len(seq) - 1, lastSeqPos + k - 1 + (ltrLen - k - lastLtrPos))
+  ltrSeq = ltrSeqs[strand]
+  if firstLtrPos != 0:
+    ltrFlank = ltrSeq[:firstLtrPos][::-1]
+    used = alignFlank(ltrFlank, seq[max(0, firstSeqPos - len(ltrFlank) - bandWidth):firstSeqPos][::-1], bandWidth)
+    if used is not None:
+      seqStart = firstSeqPos - used
+
+  if lastLtrPos + k != ltrLen:
+    ltrFlank = ltrSeq[lastLtrPos + k:]
+    used = alignFlank(ltrFlank, seq[lastSeqPos + k:lastSeqPos + k + len(ltrFlank) + bandWidth], bandWidth)
+    if used is not None:
+      seqEnd = lastSeqPos + k - 1 + used
+
+  # report 1-indexed coordinates like blastn (subject start > end if on minus strand)
+  if strand == "+":
+    return (seqStart + 1, seqEnd + 1)
+  else:
+    return (seqEnd + 1, seqStart + 1)
+
+
+def locateLTRs(proviralSeqs, ltrReference, k = 11, bandWidth = 16):
+  ltrSeq = loadLTRReference(ltrReference)
+  ltrLen = len(ltrSeq)
+  ltrIndex = buildLTRKmerIndex(ltrSeq, k)
+  ltrSeqs = {"+": ltrSeq, "-": str(Seq(ltrSeq).reverse_complement())}
+
+  # LTRs are only searched for at the ends of each sequence. Window is wide
+  # enough to allow for insertions in the autologous LTR
+  windowLen = ltrLen + ltrLen // 2
+
+  matches = []
+  for subjID in proviralSeqs:
+    seq = str(proviralSeqs[subjID][0]).upper()
+    slen = len(seq)
+
+    windows = [(0, min(windowLen, slen))]
+    if slen > windowLen:
+      windows.append((max(0, slen - windowLen), slen))
+
+    for windowStart, windowEnd in windows:
+      match = findLTRInWindow(seq, windowStart, windowEnd, ltrIndex, ltrSeqs, k, bandWidth)
+      if match is not None:
+        matches.append((subjID, match[0], match[1]))
+
+  return matches
@@ -0,0 +1,61 @@
+# length of the LTR end that a host soft clip has to match (see isSoftClipProviral)
+LTREndWindow = 50
+
+# LTR ends a clip is compared against, by which end of the read is clipped
+clipSideLTRKeys = {
+  "clip5": {"3p": "end", "5pRevComp": "end"},
+  "clip3": {"5p": "start", "3pRevComp": "start"}
+}
+
+
+class LTRKmerPrescreen(object):
+  def __init__(self, proviralLTRSeqs, k = 11):
+    super().__init__()
+
+    # every k-mer of an LTR end window, for each clipped side. A clip that
+    # isSoftClipProviral accepts is a substring of one of these windows, so all of its
+    # k-mers are in the set of its side
+    self.k = k
+    self.kmers = {side: set() for side in clipSideLTRKeys}
+    self.rejected = 0
+
+    for key in proviralLTRSeqs:
+      for side, ltrTypes in clipSideLTRKeys.items():
+        for ltrType, windowEnd in ltrTypes.items():
+          s = proviralLTRSeqs[key][ltrType]
+          if s is None:
+            continue
+
+          strS = str(s)
+          window = strS[:LTREndWindow] if windowEnd == "start" else strS[-LTREndWindow:]
+          for i in range(len(window) - k + 1):
+            self.kmers[side].add(window[i:i + k])
+
+  def mayBeProviral(self, read):
+    cigar = read.cigartuples
+    passing = True
+
+    # same single soft clip requirement as getSoftClip
+    if sum(1 for op, length in cigar if op == 4) != 1:
+      passing = False
+    elif cigar[0][0] == 4 and cigar[0][1] >= self.k:
+      clip = read.query_sequence[:cigar[0][1]]
+      passing = self.allKmersIn(clip, self.kmers["clip5"])
+    elif cigar[-1][0] == 4 and cigar[-1][1] >= self.k:
+      clip = read.query_sequence[-cigar[-1][1]:]
+      passing = self.allKmersIn(clip, self.kmers["clip3"])
+    else:
+      passing = False
+
+    if not passing:
+      self.rejected += 1
+
+    return passing
+
+  def allKmersIn(self, clip, kmers):
+    k = self.k
+    for i in range(len(clip) - k + 1):
+      if clip[i:i + k] not in kmers:
+        return False
+
+    return True
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import resource
+from scripts.io import isStreamInput
+
+metricsFormats = ["prometheus", "jsonl"]
+metricPrefix = "hivhaystack_"
+
+
+def currentRSS():
+  # resident set size in bytes. Falls back to the peak where /proc isn't available
+  try:
+    with open("/proc/self/statm", "r") as fhandle:
+      return int(fhandle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError):
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def escapeLabel(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class RunMetrics(object):
+  def __init__(self, fn, format = "prometheus", interval = 10):
+    super().__init__()
+
+    # the file is written at most every `interval` seconds from the parse loop, and on
+    # every stage change. A prometheus textfile is replaced each time, JSON lines are
+    # appended (one object per write)
+    if format not in metricsFormats:
+      raise Exception("Unknown metrics format: {}".format(format))
+
+    self.fn = fn
+    self.format = format
+    self.interval = interval
+
+    self.startTime = time.time()
+    self.lastWrite = 0
+    self.stage = "setup"
+    self.stagesDone = 0
+    self.stagesTotal = 0
+
+    self.readsProcessed = 0
+    self.candidates = {}
+    self.parseStartTime = None
+    self.parseStartReads = 0
+    self.parseEndTime = None
+    self.parseFraction = None
+
+    self.bam = None
+    self.bamSize = None
+    self.startOffset = 0
+    self.top_n = -1
+
+    if format == "jsonl" and os.path.exists(fn):
+      os.remove(fn)
+
+  def setStage(self, stage):
+    self.stage = stage
+    self.write()
+
+  def startParse(self, bam, bamfile, top_n = -1, readIndex = 0):
+    # the compressed offset of a BAM file gives the fraction parsed. Streams and CRAM
+    # files have no usable offset, so only reads and throughput are reported for them
+    self.stage = "parse"
+    self.bam = bam
+    self.top_n = top_n
+    self.readsProcessed = readIndex
+    self.parseStartReads = readIndex
+    self.parseStartTime = time.time()
+
+    if not isStreamInput(bamfile) and bam.is_bam:
+      self.bamSize = os.path.getsize(bamfile)
+      self.startOffset = bam.tell() >> 16
+
+    self.write()
+
+  def parseProgress(self, readsProcessed, candidates, force = False):
+    self.readsProcessed = readsProcessed
+    self.candidates = dict(candidates)
+
+    if force or time.time() - self.lastWrite >= self.interval:
+      self.write()
+
+  def endParse(self, readsProcessed, candidates):
+    self.parseEndTime = time.time()
+    self.parseFraction = 1.0
+    self.bam = None
+    self.parseProgress(readsProcessed, candidates, force = True)
+
+  def stageProgress(self, running, done, total):
+    self.stage = "analysis:" + ",".join(running) if len(running) != 0 else "analysis"
+    self.stagesDone = done
+    self.stagesTotal = total
+    self.write()
+
+  def parseRemaining(self):
+    # sets parseFraction and returns the share of the work since startParse that is
+    # still left (None if unknown)
+    if self.bam is None:
+      return None
+
+    if self.top_n != -1:
+      self.parseFraction = min(1.0, self.readsProcessed / max(1, self.top_n))
+      done = self.readsProcessed - self.parseStartReads
+      left = max(0, self.top_n - self.readsProcessed)
+    elif self.bamSize:
+      # upper 48 bits of a BGZF virtual offset are the compressed file offset. Progress is
+      # measured from the offset the parse started at (after the header, or a checkpoint)
+      offset = self.bam.tell() >> 16
+      self.parseFraction = min(1.0, offset / self.bamSize)
+      done = offset - self.startOffset
+      left = max(0, self.bamSize - offset)
+    else:
+      return None
+
+    return left / done if done > 0 else None
+
+  def values(self):
+    now = time.time()
+    remaining = self.parseRemaining()
+
+    readsPerSecond = 0.0
+    etaSeconds = None
+    if self.parseStartTime is not None:
+      parseElapsed = (self.parseEndTime if self.parseEndTime is not None else now) - self.parseStartTime
+      if parseElapsed > 0:
+        readsPerSecond = (self.readsProcessed - self.parseStartReads) / parseElapsed
+
+      if self.parseEndTime is None and remaining is not None:
+        etaSeconds = parseElapsed * remaining
+
+    return {
+      "timestamp": now,
+      "stage": self.stage,
+      "elapsedSeconds": now - self.startTime,
+      "readsProcessed": self.readsProcessed,
+      "readsPerSecond": readsPerSecond,
+      "candidates": self.candidates,
+      "parseFraction": self.parseFraction,
+      "parseEtaSeconds": etaSeconds,
+      "stagesDone": self.stagesDone,
+      "stagesTotal": self.stagesTotal,
+      "rssBytes": currentRSS()}
+
+  def write(self):
+    values = self.values()
+    self.lastWrite = values["timestamp"]
+
+    if self.format == "jsonl":
+      with open(self.fn, "a") as fhandle:
+        fhandle.write(json.dumps(values) + "\n")
+      return
+
+    # node exporter picks up the textfile, so it is replaced in one step
+    with open(self.fn + ".tmp", "w") as fhandle:
+      fhandle.write(self.prometheusText(values))
+    os.replace(self.fn + ".tmp", self.fn)
+
+  def prometheusText(self, values):
+    lines = []
+
+    def gauge(name, help, samples):
+      lines.append("# HELP {}{} {}".format(metricPrefix, name, help))
+      lines.append("# TYPE {}{} gauge".format(metricPrefix, name))
+      for labels, value in samples:
+        labelText = ",".join("{}=\"{}\"".format(k, escapeLabel(v)) for k, v in labels.items())
+        lines.append("{}{}{} {}".format(metricPrefix, name, "{" + labelText + "}" if labelText else "", value))
+
+    gauge("stage_info", "Current pipeline stage", [({"stage": values["stage"]}, 1)])
+    gauge("elapsed_seconds", "Seconds since the run started", [({}, "{:.1f}".format(values["elapsedSeconds"]))])
+    gauge("reads_processed", "Input reads parsed", [({}, values["readsProcessed"])])
+    gauge("reads_per_second", "Parse throughput", [({}, "{:.1f}".format(values["readsPerSecond"]))])
+    gauge("candidate_reads", "Candidate reads kept while parsing, by read group",
+      [({"group": k}, v) for k, v in values["candidates"].items()])
+    if values["parseFraction"] is not None:
+      gauge("parse_fraction", "Fraction of the input parsed", [({}, "{:.4f}".format(values["parseFraction"]))])
+    if values["parseEtaSeconds"] is not None:
+      gauge("parse_eta_seconds", "Estimated seconds until the parse completes", [({}, "{:.0f}".format(values["parseEtaSeconds"]))])
+    gauge("stages_done", "Analysis stages completed", [({}, values["stagesDone"])])
+    gauge("stages_total", "Analysis stages scheduled", [({}, values["stagesTotal"])])
+    gauge("rss_bytes", "Resident memory of the main process", [({}, values["rssBytes"])])
+    gauge("last_update_timestamp_seconds", "Time of this update", [({}, "{:.0f}".format(values["timestamp"]))])
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,137 @@
+import os
+import heapq
+import tempfile
+import pysam
+
+# rough in-memory size of a pysam record and its place in the group dict
+readOverheadBytes = 600
+
+
+def estimateReadBytes(read):
+  return readOverheadBytes + 2 * read.query_length
+
+
+def groupConsecutive(reads):
+  currentName = None
+  currentReads = []
+
+  for read in reads:
+    if read.query_name != currentName and len(currentReads) != 0:
+      yield currentName, currentReads
+      currentReads = []
+
+    currentName = read.query_name
+    currentReads.append(read)
+
+  if len(currentReads) != 0:
+    yield currentName, currentReads
+
+
+class ExternalNameGrouper(object):
+  def __init__(self, memoryLimit = None, tmpDir = None, threads = 1):
+    super().__init__()
+
+    # groups are kept in memory in the order they are first seen. Once they would
+    # take more than memoryLimit bytes, they are written out as a name sorted run
+    self.memoryLimit = memoryLimit
+    self.tmpDir = tmpDir
+    self.threads = threads
+
+    self.groups = {}
+    self.bufferBytes = 0
+    self.header = None
+    self.runs = []
+    self.mergedFn = None
+    self.nGroups = None
+
+  def addRead(self, read):
+    if self.mergedFn is not None:
+      raise Exception("Can't add reads after groups have been merged")
+
+    if self.header is None:
+      self.header = read.header
+
+    if read.query_name in self.groups:
+      self.groups[read.query_name].append(read)
+    else:
+      self.groups[read.query_name] = [read]
+
+    self.bufferBytes += estimateReadBytes(read)
+    if self.memoryLimit is not None and self.bufferBytes > self.memoryLimit:
+      self.spill()
+
+  def newTmpBam(self):
+    if self.tmpDir is not None and not os.path.exists(self.tmpDir):
+      os.makedirs(self.tmpDir)
+
+    fd, fn = tempfile.mkstemp(suffix = ".bam", dir = self.tmpDir)
+    os.close(fd)
+    return fn
+
+  def spill(self):
+    if len(self.groups) == 0:
+      return
+
+    runFn = self.newTmpBam()
+    # uncompressed since runs are only read back once
+    with pysam.AlignmentFile(runFn, "wbu", header = self.header, threads = self.threads) as run:
+      for qname in sorted(self.groups):
+        for read in self.groups[qname]:
+          run.write(read)
+
+    self.runs.append(runFn)
+    self.groups = {}
+    self.bufferBytes = 0
+
+  def finalize(self):
+    # merge spilled runs into a single name grouped file
+    if len(self.runs) == 0 or self.mergedFn is not None:
+      return
+
+    self.spill()
+    self.mergedFn = self.newTmpBam()
+    self.nGroups = 0
+
+    runBams = [pysam.AlignmentFile(fn, "rb") for fn in self.runs]
+    with pysam.AlignmentFile(self.mergedFn, "wbu", header = self.header, threads = self.threads) as merged:
+      # runs are merged in the order they were written, so mates keep their input order
+      mergedReads = heapq.merge(*runBams, key = lambda r: r.query_name)
+      for qname, reads in groupConsecutive(mergedReads):
+        self.nGroups += 1
+        for read in reads:
+          merged.write(read)
+
+    for runBam, fn in zip(runBams, self.runs):
+      runBam.close()
+      os.remove(fn)
+
+    self.runs = []
+
+  def items(self):
+    self.finalize()
+
+    if self.mergedFn is None:
+      for item in self.groups.items():
+        yield item
+    else:
+      # read on the calling thread, which may be a stage worker process
+      with pysam.AlignmentFile(self.mergedFn, "rb") as merged:
+        for item in groupConsecutive(merged):
+          yield item
+
+  def __len__(self):
+    self.finalize()
+
+    if self.mergedFn is None:
+      return len(self.groups)
+    else:
+      return self.nGroups
+
+  def close(self):
+    for fn in self.runs + ([self.mergedFn] if self.mergedFn is not None else []):
+      if os.path.exists(fn):
+        os.remove(fn)
+
+    self.runs = []
+    self.mergedFn = None
+    self.groups = {}
@@ -1,5 +1,10 @@
 from scripts.baseFunctions import extractCellBarcode, separateCigarString
-from csv import writer
+from scripts.terminalPrinting import printRed
+from csv import writer, reader
+import os
+from collections import defaultdict
+import re
+import numpy as np
 
 class IntegrationSite(object):
   def __init__(self, chr, orient, pos):
@@ -40,6 +45,18 @@ class ProviralFragment(object):
     self.usingAlt = usingAlt
     self.readname = readname
 
+  def setFromRow(self, row):
+    # row of viralFrags.tsv or integrationSites_viralFrags.tsv (returnAsList as text)
+    self.cbc = row[0]
+    self.seqname = row[1]
+    self.startBp = int(row[2])
+    self.endBp = int(row[3])
+    self.readname = row[4]
+    self.usingAlt = None if row[5] == "None" else row[5]
+    self.confirmedAlt = row[6] == "True"
+    if len(row) > 7:
+      self.alreadyRecordedInIntegration = row[7] == "True"
+
   def setFromRead(self, read):
     self.seqname = read.reference_name
     self.startBp = read.reference_start
@@ -73,6 +90,14 @@ class ProviralFragment(object):
     return [self.cbc, self.seqname, self.startBp, self.endBp,
     self.readname, str(self.usingAlt), str(self.confirmedAlt), str(self.alreadyRecordedInIntegration)]
 
+
+def proviralFragmentFields(read, alts, cbc = None):
+  # what setFromRead and setAlt take from a read, for fragments that are only exported
+  # (see CompiledDataset.addViralFragFields). alts is the parsed XA tag, and the cell
+  # barcode is looked up unless it is passed
+  return (read.reference_name, read.reference_start, read.reference_end - 1,
+    cbc if cbc is not None else extractCellBarcode(read), read.qname, alts)
+
   
 class ChimericRead(object):
   def __init__(self, read, intsite, proviralFragment):
@@ -133,27 +158,52 @@ class ReadPairDualProviral(object):
 
 class CompiledDataset(object):
   def __init__(self,
-    validChimerasFromHostReads,
-    validChimerasFromViralReads,
-    validChimerasFromUnmappedReadsHost,
-    validChimerasFromUnmappedReadsViral,
-    validViralReads,
-    unmappedViralReads):
+    validChimerasFromHostReads = None,
+    validChimerasFromViralReads = None,
+    validChimerasFromUnmappedReadsHost = None,
+    validChimerasFromUnmappedReadsViral = None,
+    validViralReads = None,
+    unmappedViralReads = None):
 
     super().__init__()
     self.integrationSites = []
     self.pairedViralFrags = []
     self.collatedViralFrags = []
+    # ProviralFragment of each collated row, or its fields until viralFrags is read
+    self.fragments = []
+    self.fragmentsBuilt = 0
+    self.unmappedValidChimeraReadNames = []
+
+    # (seqname, cbc) -> fragment starts and ends. Coverage is built from these in one
+    # pass at export instead of walking the fragments again
+    self.coverageEvents = {}
+
+    # each result set can also be added on its own as it becomes available (see scripts/api.py).
+    # Viral chimeras must be added before the viral reads they flag
+    self.addViralChimeras(validChimerasFromViralReads, validViralReads)
+    self.addHostChimeras(validChimerasFromHostReads)
+    self.addUnmappedHostChimeras(validChimerasFromUnmappedReadsHost)
+    self.addUnmappedViralChimeras(validChimerasFromUnmappedReadsViral)
+    self.addViralReads(validViralReads)
+    self.addUnmappedViralReads(unmappedViralReads)
+
+
+  def addViralChimeras(self, validChimerasFromViralReads, validViralReads):
+    if validChimerasFromViralReads is None:
+      return
+
+    for k in validChimerasFromViralReads:
+      keypair = validChimerasFromViralReads[k]
+      
+      for c in keypair:
+        self.integrationSites.append(c)
+        validViralReads[c.proviralFragment.readname].setIntegrationAnalysisFlag(True)
 
-    if validChimerasFromViralReads is not None:
-      for k in validChimerasFromViralReads:
-        keypair = validChimerasFromViralReads[k]
-        
-        for c in keypair:
-          self.integrationSites.append(c)
-          validViralReads[c.proviralFragment.readname].setIntegrationAnalysisFlag(True)
+        # self.collatedViralFrags.append(c.proviralFragment.returnAsList())
 
-          # self.collatedViralFrags.append(c.proviralFragment.returnAsList())
+  def addHostChimeras(self, validChimerasFromHostReads):
+    if validChimerasFromHostReads is None:
+      return
 
     for x in validChimerasFromHostReads:
       if len(x['minus']) != 0:
@@ -162,6 +212,10 @@ class CompiledDataset(object):
       elif len(x['plus']) != 0:
         self.integrationSites = self.integrationSites + x['plus']
 
+  def addUnmappedHostChimeras(self, validChimerasFromUnmappedReadsHost):
+    if validChimerasFromUnmappedReadsHost is None:
+      return
+
     for x in validChimerasFromUnmappedReadsHost:
       if len(x['minus']) != 0:
         self.integrationSites = self.integrationSites + x['minus']
@@ -170,7 +224,7 @@ class CompiledDataset(object):
         v = x['minus'][0].proviralFragment
         v.setIntegrationAnalysisFlag(True)
 
-        self.collatedViralFrags.append(v.returnAsList())
+        self.addViralFrag(v)
 
       elif len(x['plus']) != 0:
         self.integrationSites = self.integrationSites + x['plus']
@@ -178,39 +232,88 @@ class CompiledDataset(object):
         v = x['plus'][0].proviralFragment
         v.setIntegrationAnalysisFlag(True)
 
-        self.collatedViralFrags.append(v.returnAsList())
-    
-    unmappedValidChimeraReadNames = []
-    if validChimerasFromUnmappedReadsViral is not None:
-      for key in validChimerasFromUnmappedReadsViral:
-        alignedSites = validChimerasFromUnmappedReadsViral[key]
-        for i in alignedSites:
-          self.integrationSites.append(i)
-          unmappedValidChimeraReadNames.append(i.proviralFragment.readname)
-
-    # parse through paired viral reads
+        self.addViralFrag(v)
+
+  def addUnmappedViralChimeras(self, validChimerasFromUnmappedReadsViral):
+    if validChimerasFromUnmappedReadsViral is None:
+      return
+
+    for key in validChimerasFromUnmappedReadsViral:
+      alignedSites = validChimerasFromUnmappedReadsViral[key]
+      for i in alignedSites:
+        self.integrationSites.append(i)
+        self.unmappedValidChimeraReadNames.append(i.proviralFragment.readname)
+
+  def addViralReads(self, validViralReads):
+    if validViralReads is None:
+      return
+
+    # parse through paired viral reads. Pairs that weren't chimera candidates come as
+    # the fields of both fragments (see parseProviralReads)
     for v in validViralReads:
       readPair = validViralReads[v]
+      if isinstance(readPair, tuple):
+        self.addViralFragFields(readPair[0])
+        self.addViralFragFields(readPair[1])
+        continue
+
       self.pairedViralFrags.append(readPair)
       
-      readPairList = readPair.returnAsList()
-      self.collatedViralFrags.append(readPairList[0])
-      self.collatedViralFrags.append(readPairList[1])
+      self.addViralFrag(readPair.read1)
+      self.addViralFrag(readPair.read2)
+
+  def addUnmappedViralReads(self, unmappedViralReads):
+    if unmappedViralReads is None:
+      return
 
     # parse through unampped viral reads
     for v in unmappedViralReads:
-      if v.readname in unmappedValidChimeraReadNames:
+      if v.readname in self.unmappedValidChimeraReadNames:
         v.setIntegrationAnalysisFlag(True)
       
-      self.collatedViralFrags.append(v.returnAsList())
+      self.addViralFrag(v)
+
+  def addViralFrag(self, proviralFragment):
+    self.fragments.append(proviralFragment)
+    self.collatedViralFrags.append(proviralFragment.returnAsList())
+
+    starts, ends = self.coverageEvents.setdefault((proviralFragment.seqname, proviralFragment.cbc), ([], []))
+    starts.append(proviralFragment.startBp)
+    ends.append(proviralFragment.endBp)
+
+  def addViralFragFields(self, fields):
+    # same row and coverage as addViralFrag for a fragment from proviralFragmentFields.
+    # Its ProviralFragment is only built if viralFrags is read
+    seqname, startBp, endBp, cbc, readname, usingAlt = fields
+    self.fragments.append(fields)
+    self.collatedViralFrags.append([cbc, seqname, startBp, endBp, readname, str(usingAlt), "False", "False"])
+
+    starts, ends = self.coverageEvents.setdefault((seqname, cbc), ([], []))
+    starts.append(startBp)
+    ends.append(endBp)
+
+  @property
+  def viralFrags(self):
+    for i in range(self.fragmentsBuilt, len(self.fragments)):
+      if isinstance(self.fragments[i], tuple):
+        seqname, startBp, endBp, cbc, readname, usingAlt = self.fragments[i]
+        proviralFrag = ProviralFragment()
+        proviralFrag.setManually(seqname, startBp, endBp, cbc, readname)
+        proviralFrag.setAlt(usingAlt)
+        self.fragments[i] = proviralFrag
+
+    self.fragmentsBuilt = len(self.fragments)
+    return self.fragments
 
 
   def exportIntegrationSiteTSV(self, fnIntSite, fnIntSiteFrag):
     output = [[x.proviralFragment.cbc] + x.intsite.returnAsList() for x in self.integrationSites]
     outputPV = [x.proviralFragment.returnAsList() for x in self.integrationSites]
 
+    # written under a temporary name and renamed once complete, since a top-up rewrites
+    # these files in place
     # export integration sites
-    with open(fnIntSite, "w") as tsvfile:
+    with open(fnIntSite + ".tmp", "w") as tsvfile:
       writ1 = writer(tsvfile, delimiter = "\t")
 
       writ1.writerow(["cbc", "chr", "orient", "pos"])
@@ -218,7 +321,7 @@ class CompiledDataset(object):
         writ1.writerow(o)
     
     # export proviral frags from integration sites
-    with open(fnIntSiteFrag, "w") as tsvfile2:
+    with open(fnIntSiteFrag + ".tmp", "w") as tsvfile2:
       writ2 = writer(tsvfile2, delimiter = "\t")
 
       writ2.writerow(["cbc", "seqname", "startBp", "endBp",
@@ -226,12 +329,139 @@ class CompiledDataset(object):
       for o in outputPV:
         writ2.writerow(o[:-1])
 
+    os.replace(fnIntSite + ".tmp", fnIntSite)
+    os.replace(fnIntSiteFrag + ".tmp", fnIntSiteFrag)
+
+
+  def summaryCounts(self):
+    sites = set(tuple(x.intsite.returnAsList()) for x in self.integrationSites)
+    cells = set(x.proviralFragment.cbc for x in self.integrationSites)
+
+    return [len(self.integrationSites), len(sites), len(cells), len(self.collatedViralFrags)]
+
+
+  def siteSupport(self):
+    # reads and distinct cells supporting each integration site
+    readnames = defaultdict(set)
+    cells = defaultdict(set)
+    for x in self.integrationSites:
+      site = tuple(x.intsite.returnAsList())
+      readnames[site].add(x.proviralFragment.readname)
+      cells[site].add(x.proviralFragment.cbc)
+
+    return {site: (len(readnames[site]), len(cells[site])) for site in readnames}
+
+
+  def exportToSiteDatabase(self, siteDatabase, sample, donor = None):
+    return siteDatabase.addSample(sample, donor, self.siteSupport())
+
+
+  def coverageArrays(self, seqLengths = None, barcodeGroups = None):
+    # per base coverage of each viral sequence, for all cells or for each barcode group
+    # ({cbc: group}). Returns {group: {seqname: array}}
+    events = defaultdict(lambda: defaultdict(lambda: ([], [])))
+    for (seqname, cbc), (starts, ends) in self.coverageEvents.items():
+      group = "all" if barcodeGroups is None else barcodeGroups.get(cbc)
+      if group is None:
+        continue
+
+      events[group][seqname][0].extend(starts)
+      events[group][seqname][1].extend(ends)
+
+    coverage = {}
+    warned = set()
+    for group in events:
+      coverage[group] = {}
+      for seqname, (starts, ends) in events[group].items():
+        starts = np.array(starts, dtype = np.int64)
+        ends = np.array(ends, dtype = np.int64) + 1 # endBp is inclusive
+
+        # fragments past the end of the sequence (ex: alt aligns or a shorter fasta
+        # record) extend the array instead of being cut off
+        seqLen = int(ends.max())
+        if seqLengths is not None and seqname in seqLengths:
+          if seqLen > seqLengths[seqname] and seqname not in warned:
+            warned.add(seqname)
+            printRed("{}: viral fragments end up to {} bp past the sequence length of {}. Coverage is reported up to {}".format(
+              seqname, seqLen - seqLengths[seqname], seqLengths[seqname], seqLen))
+          seqLen = max(seqLen, seqLengths[seqname])
+
+        # difference array: +1 at each start, -1 after each end
+        diff = np.bincount(np.clip(starts, 0, seqLen), minlength = seqLen + 1)[:seqLen + 1] - \
+          np.bincount(np.clip(ends, 0, seqLen), minlength = seqLen + 1)[:seqLen + 1]
+        coverage[group][seqname] = np.cumsum(diff[:seqLen])
+
+    return coverage
+
+
+  def exportCoverageBedGraphs(self, fnPrefix, seqLengths = None, barcodeGroups = None):
+    # fnPrefix.bedGraph for all cells or fnPrefix_{group}.bedGraph for each barcode group
+    fns = []
+    for group, coverage in self.coverageArrays(seqLengths, barcodeGroups).items():
+      fn = fnPrefix + ".bedGraph" if barcodeGroups is None else "{}_{}.bedGraph".format(fnPrefix, re.sub(r"[^\w.-]", "_", str(group)))
+
+      with open(fn, "w") as fhandle:
+        for seqname in sorted(coverage):
+          cov = coverage[seqname]
+          if len(cov) == 0:
+            continue
+
+          # run length encode into intervals of constant coverage
+          bounds = np.concatenate(([0], np.flatnonzero(np.diff(cov)) + 1, [len(cov)]))
+          for start, end in zip(bounds[:-1], bounds[1:]):
+            if cov[start] != 0:
+              fhandle.write("{}\t{}\t{}\t{}\n".format(seqname, start, end, cov[start]))
+
+      fns.append(fn)
+
+    return fns
+
 
   def exportProviralCoverageTSV(self, fn):
-    with open(fn, "w") as tsvfile:
+    with open(fn + ".tmp", "w") as tsvfile:
       writ = writer(tsvfile, delimiter = "\t")
 
       writ.writerow(["cbc", "seqname", "startBp", "endBp",
       "readname", "usingAlt", "confirmedAlt", "alreadyRecordedInIntegration"])
       for o in self.collatedViralFrags:
         writ.writerow(o)
+
+    os.replace(fn + ".tmp", fn)
+
+
+def exportSweepSummaryTSV(fn, compiledBySetting):
+  with open(fn, "w") as tsvfile:
+    writ = writer(tsvfile, delimiter = "\t")
+
+    writ.writerow(["LTRClipLen", "hostClipLen", "integrationSites", "uniqueIntegrationSites", "cells", "viralFrags"])
+    for setting in compiledBySetting:
+      writ.writerow(list(setting) + compiledBySetting[setting].summaryCounts())
+
+
+def importCompiledDataset(fnIntSite, fnIntSiteFrag, fnViralFrags):
+  # rebuild a dataset from its TSV exports. Integration sites have no read attached
+  dataset = CompiledDataset()
+
+  with open(fnIntSite, "r") as siteFile, open(fnIntSiteFrag, "r") as fragFile:
+    siteRows = reader(siteFile, delimiter = "\t")
+    fragRows = reader(fragFile, delimiter = "\t")
+    next(siteRows)
+    next(fragRows)
+
+    for siteRow, fragRow in zip(siteRows, fragRows):
+      proviralFrag = ProviralFragment()
+      proviralFrag.setFromRow(fragRow)
+      intsite = IntegrationSite(chr = siteRow[1], orient = siteRow[2], pos = int(siteRow[3]))
+
+      dataset.integrationSites.append(ChimericRead(read = None, intsite = intsite, proviralFragment = proviralFrag))
+
+  with open(fnViralFrags, "r") as fragFile:
+    fragRows = reader(fragFile, delimiter = "\t")
+    next(fragRows)
+
+    for fragRow in fragRows:
+      proviralFrag = ProviralFragment()
+      proviralFrag.setFromRow(fragRow)
+      dataset.addViralFrag(proviralFrag)
+
+  return dataset
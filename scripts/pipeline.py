@@ -0,0 +1,1076 @@
+import pysam
+from Bio import SeqIO
+from Bio.Seq import Seq
+from collections import defaultdict
+import os
+import csv
+import re
+import subprocess
+import numpy as np
+from scripts.outputModules import *
+from scripts.baseFunctions import *
+from scripts.io import *
+from scripts.terminalPrinting import *
+from scripts.ltrLocator import locateLTRs as locateLTRPositions
+from scripts.checkpoint import ScanCheckpointer, inputIdentity, proviralDigest
+from scripts.ltrPrescreen import LTRKmerPrescreen, LTREndWindow
+from scripts.hostMates import HostMateTracker, endClipLen, mateClipTag
+from scripts.adapters import AdapterClipFilter
+from scripts.proviralIndex import ProviralTidIndex, tidIndexFor
+
+# per read messages of the parse stages are throttled, since samples with many hits
+# otherwise spend their time printing
+readLog = ThrottledPrinter()
+readHitLog = ThrottledPrinter(printFunc = printBlue)
+readWarningLog = ThrottledPrinter(printFunc = printRed)
+
+
+def flushReadLogs():
+  for log in [readLog, readHitLog, readWarningLog]:
+    log.flush()
+
+
+def getProviralFastaIDs(fafile, recordSeqs):
+  ids = []
+  for record in SeqIO.parse(fafile, format = "fasta"):
+    ids.append(record.id)
+    recordSeqs[record.id].append(record.seq)
+
+  return ids
+
+
+def getLTRseq(seq, start, end):
+  ltrSeq = seq[start - 1:end]
+  return ltrSeq
+
+
+def addLTRMatch(LTRdict, proviralSeqs, subjID, sstart, send, endBuffer = 20):
+  slen = len(proviralSeqs[subjID][0])
+
+  # must be at least 550bp long
+  if abs(send - sstart) < 550:
+    return
+  elif sstart < endBuffer:
+    if send > sstart:
+      seq = getLTRseq(proviralSeqs[subjID][0], 1, send)
+      LTRdict[subjID]["5pEnd"] = send
+    else:
+      seq = getLTRseq(proviralSeqs[subjID][0], 1, sstart)
+      LTRdict[subjID]["5pEnd"] = sstart
+
+    LTRdict[subjID]["5p"] = seq
+    LTRdict[subjID]["5pStart"] = 1
+    LTRdict[subjID]["5pRevComp"] = seq.reverse_complement()
+
+  elif slen - send < endBuffer:
+    if send > sstart:
+      seq = getLTRseq(proviralSeqs[subjID][0], sstart, slen)
+      LTRdict[subjID]["3pStart"] = sstart
+    
+    else:
+      seq = getLTRseq(proviralSeqs[subjID][0], send, slen)
+      LTRdict[subjID]["3pStart"] = send
+
+    LTRdict[subjID]["3p"] = seq
+    LTRdict[subjID]["3pEnd"] = slen          
+    LTRdict[subjID]["3pRevComp"] = seq.reverse_complement()
+
+
+def parseLTRMatches(LTRargs, proviralSeqs, position = False, located = False, endBuffer = 20):
+  LTRdict = defaultdict(lambda: {
+    "5p": None,
+    "5pRevComp": None,
+    "5pStart": None,
+    "5pEnd": None,
+    "3p": None,
+    "3pStart": None,
+    "3pEnd": None,
+    "3pRevComp": None})
+
+  if position:
+    marks = [int(x) for x in LTRargs.split(",")]
+
+    for k in proviralSeqs:
+      proviralSeq = proviralSeqs[k][0]
+      ltr5p = getLTRseq(proviralSeq, marks[0], marks[1])
+      ltr3p = getLTRseq(proviralSeq, marks[2], marks[3])
+
+      LTRdict[k]["5p"] = ltr5p
+      LTRdict[k]["5pStart"] = marks[0]
+      LTRdict[k]["5pEnd"] = marks[1]
+      LTRdict[k]["5pRevComp"] = ltr5p.reverse_complement()
+      LTRdict[k]["3p"] = ltr3p
+      LTRdict[k]["3pStart"] = marks[2]
+      LTRdict[k]["3pEnd"] = marks[3]
+      LTRdict[k]["3pRevComp"] = ltr3p.reverse_complement()
+
+  elif located:
+    # LTRargs is a list of (subject ID, subject start, subject end) from locateLTRs
+    for subjID, sstart, send in LTRargs:
+      addLTRMatch(LTRdict, proviralSeqs, subjID, sstart, send, endBuffer)
+
+  else:
+    with open(LTRargs, "r") as fhandle:
+      rd = csv.reader(fhandle, delimiter = "\t")
+
+      for row in rd:
+        # index 1 = subject ID (i.e. the original sample's viral fasta ID)
+        # index 2 = percent match
+        # index 6 = query start
+        # index 7 = query end
+        # index 8 = subject start
+        # index 9 = subject end
+        addLTRMatch(LTRdict, proviralSeqs, row[1], int(row[8]), int(row[9]), endBuffer)
+
+  return LTRdict
+
+
+def loadPotentialLTRs(proviralSeqs, LTRmatches = None, LTRpositions = None, locateLTRs = False, LTRreference = None):
+  if LTRmatches is not None:
+    printGreen("Getting potential LTRs")
+    return parseLTRMatches(LTRmatches, proviralSeqs)
+  elif LTRpositions is not None:
+    printGreen("LTR positions provided as {}".format(LTRpositions))
+    return parseLTRMatches(LTRpositions, proviralSeqs, position = True)
+  elif locateLTRs:
+    printGreen("Locating LTRs with {}".format(LTRreference))
+    LTRlocations = locateLTRPositions(proviralSeqs, LTRreference)
+    return parseLTRMatches(LTRlocations, proviralSeqs, located = True)
+
+  raise Exception("One of LTRmatches, LTRpositions and locateLTRs must be specified")
+
+
+def getSoftClip(read, clipMinLen, softClipPad, useAlt = None, adapterFilter = None):
+  # cutoff same as epiVIA
+  cigar = read.cigartuples
+  clippedFrag = Seq("")
+  adjacentFrag = Seq("")
+
+  clip5Present = False
+  clip3Present = False
+
+  if useAlt is None:
+    # loop through cigar to make sure there's only 1 soft clip
+    if read.cigarstring.count("S") > 1:
+      return None
+
+    passing5p = cigar[0][0] == 4 and cigar[0][1] >= clipMinLen
+    passing3p = cigar[-1][0] == 4 and cigar[-1][1] >= clipMinLen
+
+    clipLen5p = cigar[0][1]
+    clipLen3p = cigar[-1][1]
+
+  else:
+    if useAlt["cigarstring"].count("S") > 1:
+      return None
+    
+    readAltCigar = separateCigarString(useAlt["cigarstring"])
+    passing5p = readAltCigar[0][1] == "S" and int(readAltCigar[0][0]) >= clipMinLen
+    passing3p = readAltCigar[-1][1] == "S" and int(readAltCigar[-1][0]) >= clipMinLen
+
+    clipLen5p = int(readAltCigar[0][0])
+    clipLen3p = int(readAltCigar[-1][0])
+
+  if passing5p:
+    clippedFrag = read.seq[0:clipLen5p]
+    adjacentFrag = read.seq[clipLen5p:clipLen5p + softClipPad]
+    clip5Present = True
+  
+  if passing3p:
+    clippedFrag = read.seq[clipLen3p * -1: ]
+    adjacentFrag = read.seq[clipLen3p * -1 - softClipPad: clipLen3p * -1]
+    clip3Present = True    
+
+  # clip can only be present at one end
+  if clip5Present and clip3Present:
+    return None
+  elif not clip5Present and not clip3Present:
+    return None
+  # Tn5/Nextera adapter read-through can't be a junction with the host
+  elif adapterFilter is not None and adapterFilter.isAdapter(clippedFrag, clip5Present):
+    return None
+  else:
+    if clip5Present:
+      adjacentPos = read.reference_start + len(clippedFrag)
+    else:
+      adjacentPos = read.reference_start + (len(read.query_sequence) - len(clippedFrag) - 1)
+
+    clippedFragObj = {
+      "clippedFrag": clippedFrag,
+      "adjacentFrag": adjacentFrag,
+      "useAlt": useAlt,
+      "adjacentPosToClip": adjacentPos,
+      "clip5Present": clip5Present,
+      "clip3Present": clip3Present}
+
+    return clippedFragObj
+
+
+def isSoftClipProviral(read, proviralLTRSeqs, proviralSeqs, clipMinLen = 11, softClipPad = 3, adapterFilter = None):
+  clippedFragObj = getSoftClip(read, clipMinLen, softClipPad, adapterFilter = adapterFilter)
+  
+  # skip if no clipped fragment long enough is found
+  if clippedFragObj is None:
+    return False
+
+  strClippedFrag = str(clippedFragObj["clippedFrag"])
+
+  # skip if there are any characters other than ATGC 
+  if bool(re.compile(r'[^ATGC]').search(strClippedFrag)):
+    return False
+  
+  hits = {
+    "plus": [],
+    "minus" : [],
+    "clip5P": clippedFragObj["clip5Present"],
+    "clip3P": clippedFragObj["clip3Present"]}
+
+  allowedLTRKeys = []
+  # only allow specific keys based on orientation
+  if clippedFragObj["clip5Present"]:
+    allowedLTRKeys = ["3p", "5pRevComp"]
+  elif clippedFragObj["clip3Present"]:
+    allowedLTRKeys = ["5p", "3pRevComp"]
+
+  # find hits...
+  foundHit = False
+  for key in proviralLTRSeqs:
+    keyPair = proviralLTRSeqs[key]
+
+    for ltrType in allowedLTRKeys:
+      s = keyPair[ltrType]
+      if s is None:
+        continue
+
+      # find orientation
+      orient = "plus" if ltrType == "5p" or ltrType == "3p" else "minus"
+
+      # adjust this as needed based on read length...
+      interestLen = LTREndWindow
+      strS = str(s)
+      if (ltrType == "5p" or ltrType == "3pRevComp"):
+        sInterest = strS[0:interestLen]
+      elif (ltrType == "3p" or ltrType == "5pRevComp"):
+        sInterest = strS[-interestLen:]
+
+      matches = [x.start() for x in re.finditer(strClippedFrag, sInterest)]
+      if len(matches) == 0:
+        continue
+
+      ltrLen = len(str(s))
+      # add to matches to get compatibility with original code
+      if (ltrType == "3p" or ltrType == "5pRevComp"):
+        matches = [x + (ltrLen - interestLen) for x in matches]
+
+      # check if match is within soft buffer zone
+      if (ltrType == "5p" or ltrType == "3pRevComp") and min(matches) > softClipPad:
+        continue
+      elif (ltrType == "3p" or ltrType == "5pRevComp") and max(matches) + len(strClippedFrag) < ltrLen - softClipPad:
+        continue
+
+      # check if the adjacent host clips could have also been aligned to the viral LTR,
+      # thus explaining the lack of viral clip not being at either end of LTR
+      ltrEnd = ""
+      adjustment = 0
+      if (ltrType == "5p" or ltrType == "3pRevComp") and min(matches) != 0:
+        adjustment = -1 * min(matches)
+        ltrEnd = str(s)[0:min(matches)]
+        hostAdjacentSeq = clippedFragObj["adjacentFrag"][adjustment:]
+
+      elif (ltrType == "3p" or ltrType == "5pRevComp") and max(matches) != ltrLen - softClipPad:
+        adjustment = ltrLen - max(matches) - len(strClippedFrag)
+        ltrEnd = str(s)[max(matches) + len(strClippedFrag): ltrLen]
+        hostAdjacentSeq = clippedFragObj["adjacentFrag"][0:adjustment]
+        
+      if ltrEnd != "" and ltrEnd != hostAdjacentSeq:
+        # print("{}: Viral clip not found at the end of LTR".format(read.query_name))
+        continue
+
+      # passes all checks!
+      readLog("{}: chimeric match found".format(read.query_name))
+      
+      if ltrType == "5p" or ltrType == "5pRevComp":
+        proviralStartPos = 0
+        proviralEndPos = len(clippedFragObj["clippedFrag"]) + abs(adjustment) - 1
+      elif ltrType == "3p" or ltrType == "3pRevComp":
+        proviralStartPos = len(proviralSeqs[key][0]) - len(clippedFragObj["clippedFrag"]) - abs(adjustment)
+        proviralEndPos = len(proviralSeqs[key][0]) - 1
+
+      intsite = IntegrationSite(
+        chr = read.reference_name,
+        orient = "-" if orient == "minus" else "+",
+        pos = clippedFragObj["adjacentPosToClip"] + adjustment)
+
+      proviralFrag = ProviralFragment()
+      proviralFrag.setManually(
+        seqname = key,
+        startBp = proviralStartPos,
+        endBp = proviralEndPos,
+        cbc = extractCellBarcode(read),
+        readname = read.qname,
+        usingAlt = None
+      )
+
+      chimera = ChimericRead(read = read, intsite = intsite, proviralFragment = proviralFrag)
+      hits[orient].append(chimera)
+      foundHit = True
+
+  # can only be plus orientation OR minus orientation only
+  if not foundHit:
+    return False
+  elif len(hits["plus"]) != 0 and len(hits["minus"]) == 0:
+    return hits
+  elif len(hits["minus"]) != 0 and len(hits["plus"]) == 0:
+    return hits
+
+
+def parseHostReadsWithPotentialChimera(readPairs, proviralLTRSeqs, proviralSeqs, clipMinLen, adapterFilter = None):
+  adapterRejected = adapterFilter.rejected if adapterFilter is not None else 0
+  validChimeras = []
+  readPairLen = len(readPairs)
+  readKeyCounter = 0
+
+  for key, reads in readPairs.items():
+    if (readKeyCounter % 100000 == 0):
+      printProgressBar(readKeyCounter, readPairLen, "Processing Host Reads with Chimera")
+      
+    readKeyCounter += 1
+
+    # a sweep groups reads at its shortest clip length, so only clips long enough for
+    # this setting count. A mate rejected while parsing counts by its tagged clip length
+    reads = [read for read in reads if endClipLen(read) >= clipMinLen]
+    if any(read.has_tag(mateClipTag) and read.get_tag(mateClipTag) >= clipMinLen for read in reads):
+      continue
+
+    # only allow one read mate to have soft clip
+    if len(reads) != 1:
+      continue 
+    
+    read = reads[0]
+    # must contain valid cell barcode passing allowlist
+    if extractCellBarcode(read) is None:
+     continue
+    
+    validHits = isSoftClipProviral(read, proviralLTRSeqs, proviralSeqs, clipMinLen, adapterFilter = adapterFilter)
+    if validHits:
+      readHitLog("{}\n{}".format([str(x) for x in validHits['minus']], [str(x) for x in validHits['plus']]))
+      validChimeras.append(validHits)
+
+  flushReadLogs()
+  printAdapterRejections(adapterFilter, adapterRejected, "host reads")
+  return validChimeras
+
+
+def checkForPotentialHostClip(read, refLen, proviralSeqs, clipMinLen = 17, useAlts = None, softClipPad = 3, adapterFilter = None):
+  readInfo = {
+    "start": read.reference_start,
+    "cigar": read.cigar,
+    "cigarstring": read.cigarstring
+  }
+
+  if useAlts is not None:
+    readInfo["start"] = int(useAlts[1].lstrip("[+-]"))
+    readInfo["cigarstring"] = useAlts[2]
+
+    readClip = getSoftClip(read, clipMinLen, softClipPad, useAlt = readInfo, adapterFilter = adapterFilter)
+  
+  else:
+    readClip = getSoftClip(read, clipMinLen, softClipPad, adapterFilter = adapterFilter)
+
+  readNear5p = readInfo["start"] <= softClipPad
+  readNear3p = readInfo["start"] >= refLen - read.query_length - softClipPad - 1
+
+  if readClip is None or (not readNear5p and not readNear3p):
+    # print("{} is not close enough to LTR".format(read1.query_name))
+    return None
+
+  clip = readClip["clippedFrag"]
+  provirusStart = readInfo["start"]
+
+  returnObj = {
+    "read": read,
+    "hostSoftClip": readClip,
+    "adjustment": 0,
+    "adjustedHostSoftClip": None,
+    "provirusStart": provirusStart
+  }
+
+  if readNear5p:
+    adjustment = 0 - provirusStart
+    clipPartial = clip[adjustment: ]
+    provirusActual = proviralSeqs[read.reference_name][0][0:provirusStart]
+
+    if provirusStart == 0:
+      return returnObj
+    elif provirusStart != 0 and clipPartial == provirusActual:
+      returnObj["adjustment"] = adjustment
+      returnObj["adjustedHostSoftClip"] = clip[:len(clip) + adjustment]
+      return returnObj
+  
+  elif readNear3p:
+    fragmentLen = len(clip)
+    readProviralLen = len(read.seq) - fragmentLen
+
+    proviralEnd = refLen
+    reqProviralStartPos = proviralEnd - readProviralLen
+    
+    adjustment = reqProviralStartPos - read.reference_start
+
+    clipPartial = clip[:adjustment]
+    provirusActual = proviralSeqs[read.reference_name][0][-1 * adjustment:]
+
+    if provirusStart == reqProviralStartPos:
+      return returnObj
+    
+    elif provirusStart != reqProviralStartPos and clipPartial == provirusActual:
+      returnObj["adjustment"] = adjustment
+      returnObj["adjustedHostSoftClip"] = clip[adjustment:]
+      returnObj["provirusStart"] = reqProviralStartPos
+      return returnObj
+
+  return None
+
+
+def addHostPlacement(qname, chrom, pos, alignedSeq, potentialChimeras, validIntSites, nonChimeras = None):
+  # check orientation of alignment
+  currentChimera = potentialChimeras[qname]
+  if currentChimera["adjustment"] != 0:
+    if str(currentChimera["adjustedHostSoftClip"]) != str(alignedSeq):
+      orient = "-"
+    else:
+      orient = "+"
+  else:
+    if str(currentChimera["hostSoftClip"]["clippedFrag"]) != str(alignedSeq):
+      orient = "-"
+    else:
+      orient = "+"
+
+  # TODO edit dualproviralobject if 1) edit is used, just change read and 2) if alt is used, change both
+
+  intsite = IntegrationSite(chrom, orient, pos)
+  proviralFrag = ProviralFragment()
+  proviralFrag.setManually(
+    seqname = currentChimera["read"].reference_name,
+    startBp = currentChimera["provirusStart"],
+    endBp = currentChimera["read"].reference_end - 1,
+    cbc = extractCellBarcode(currentChimera["read"]),
+    readname = currentChimera["read"].qname
+  )
+
+  if nonChimeras is not None:
+    nonChimeras[qname].updateWithConfirmedEdit(proviralFrag)
+
+  
+  chimera = ChimericRead(
+    read = currentChimera["read"],
+    intsite = intsite,
+    proviralFragment = proviralFrag
+  )
+
+  validIntSites[qname].append(chimera)
+
+
+def placeClipsWithIndex(fafile, hostKmerIndex, potentialChimeras, validIntSites, nonChimeras = None, hostClipLen = 17):
+  unresolved = []
+
+  for record in SeqIO.parse(fafile, format = "fasta"):
+    # same score threshold and seed length as the bwa mem command of alignClipToHost
+    hits = hostKmerIndex.place(record.seq, minScore = hostClipLen, seedLen = hostClipLen - 2)
+
+    # no exact placement, or another locus could also pass bwa's threshold. Leave it to
+    # bwa which allows for mismatches
+    if hits is None:
+      unresolved.append(record)
+
+    elif len(hits) > 1:
+      printRed("{}: integration site can't be found due to multiple hits in host genome".format(record.id))
+
+      if nonChimeras is not None:
+        nonChimeras[record.id].unsetPotentialClipEdit()
+
+    else:
+      chrom, pos, isReverse = hits[0]
+      alignedSeq = record.seq.reverse_complement() if isReverse else record.seq
+      addHostPlacement(record.id, chrom, pos, alignedSeq, potentialChimeras, validIntSites, nonChimeras)
+
+  return unresolved
+
+
+def alignClipToHost(fafile, hostGenomeIndex, potentialChimeras, hostClipLen = 17, nonChimeras = None, hostKmerIndex = None,
+  threads = 1):
+  if not os.path.exists(fafile) or os.stat(fafile).st_size == 0:
+    printGreen("No records in fasta file. Skipping alignment.") 
+    return None
+
+  validIntSites = defaultdict(list)
+
+  alignFafile = fafile
+  if hostKmerIndex is not None:
+    unresolved = placeClipsWithIndex(fafile, hostKmerIndex, potentialChimeras, validIntSites, nonChimeras,
+      hostClipLen = hostClipLen)
+    printCyanOnGrey("Placed clips with host k-mer index. {} clip(s) left for bwa".format(len(unresolved)))
+
+    if len(unresolved) == 0:
+      return validIntSites
+
+    alignFafile = fafile + ".unresolved.fa"
+    SeqIO.write(unresolved, alignFafile, "fasta")
+
+  outputSam = alignFafile + ".sam"
+  command = "bwa mem -t {threads} -T {quality} -k {seed} -a -Y -q {index} {fa} -o {sam}".format(
+      threads = threads,
+      index = hostGenomeIndex,
+      fa = alignFafile,
+      sam = outputSam,
+      quality = hostClipLen,
+      seed = hostClipLen - 2)
+
+  child = subprocess.Popen(command, shell = True)
+  child.wait()
+  if child.poll() != 0:
+    raise Exception("Error with alignment")
+  
+  qnamesWithMultipleHits = []
+  alignment = pysam.AlignmentFile(outputSam, "r")
+  for rec in alignment:
+    if rec.mapq == 0:
+      if nonChimeras is not None:
+        nonChimeras[rec.qname].unsetPotentialClipEdit()
+
+      continue
+
+    if len(validIntSites[rec.qname]) > 0:
+      printRed("{}: integration site can't be found due to multiple hits in host genome".format(rec.qname))
+      validIntSites.pop(rec.qname)
+      qnamesWithMultipleHits.append(rec.qname)
+
+      if nonChimeras is not None:
+        nonChimeras[rec.qname].unsetPotentialClipEdit()
+      continue
+    elif rec.qname in qnamesWithMultipleHits:
+      continue
+    
+    addHostPlacement(rec.qname, rec.reference_name, rec.reference_start, rec.seq,
+      potentialChimeras, validIntSites, nonChimeras)
+
+  return validIntSites
+
+
+def altClipColumns(sameRef):
+  # start, 5'/3' soft clip lengths and number of soft clips of a read's single alt align
+  # on its own reference, and how many such alt aligns there are
+  if len(sameRef) != 1:
+    return (0, 0, 0, 0, len(sameRef))
+
+  cigar = separateCigarString(sameRef[0][2])
+  return (int(sameRef[0][1].lstrip("[+-]")),
+    int(cigar[0][0]) if cigar[0][1] == "S" else 0,
+    int(cigar[-1][0]) if cigar[-1][1] == "S" else 0,
+    sameRef[0][2].count("S"),
+    1)
+
+
+def selectNearLTRCandidates(reads, alts, refLens, tidIndex, clipMinLen = 17, softClipPad = 3):
+  # reads holds read 1 and read 2 of each pair one after another, alts their parsed XA
+  # tags and refLens the provirus length of each pair. tidIndex resolves the references
+  # of the alt aligns (tids are the same for every copy of the BAM header). A pair can only hold a host clip
+  # if it has at most one soft clip and a long enough clip on a mate aligned within
+  # softClipPad of a provirus end (same bounds as checkForPotentialHostClip). If both
+  # mates have alt aligns, the same bounds are checked on a mate's single alt align on
+  # its own reference. Pairs with several such alt aligns stay candidates, so they are
+  # still reported
+  cigars = [read.cigartuples for read in reads]
+  starts = np.array([read.reference_start for read in reads], dtype = np.int64).reshape(-1, 2)
+  queryLens = np.array([read.query_length for read in reads], dtype = np.int64).reshape(-1, 2)
+  clips5 = np.array([cigar[0][1] if cigar[0][0] == 4 else 0 for cigar in cigars], dtype = np.int64).reshape(-1, 2)
+  clips3 = np.array([cigar[-1][1] if cigar[-1][0] == 4 else 0 for cigar in cigars], dtype = np.int64).reshape(-1, 2)
+  softClips = np.array([[op for op, length in cigar].count(4) for cigar in cigars], dtype = np.int64).reshape(-1, 2).sum(axis = 1)
+  refLens = np.array(refLens, dtype = np.int64)[:, None]
+
+  near = (starts <= softClipPad) | (starts >= refLens - queryLens - softClipPad - 1)
+  clipPassing = (clips5 >= clipMinLen) | (clips3 >= clipMinLen)
+  nearClip = np.any(clipPassing & near, axis = 1)
+
+  # alt columns are only parsed for reads with an XA tag
+  hasAlts = np.array([x is not None for x in alts], dtype = bool).reshape(-1, 2)
+  bothAlts = hasAlts.all(axis = 1)
+  altColumns = np.zeros((len(reads), 5), dtype = np.int64)
+  for i in np.flatnonzero(np.repeat(bothAlts, 2)):
+    altColumns[i] = altClipColumns(tidIndex.sameReferenceAlts(reads[i], alts[i]))
+
+  altStarts, altClips5, altClips3, altSoftClips, nAlts = [altColumns[:, j].reshape(-1, 2) for j in range(5)]
+  altNear = (altStarts <= softClipPad) | (altStarts >= refLens - queryLens - softClipPad - 1)
+  altClipPassing = (altSoftClips <= 1) & ((altClips5 >= clipMinLen) | (altClips3 >= clipMinLen))
+  altNearClip = np.any((nAlts == 1) & altClipPassing & altNear, axis = 1)
+  multipleAlts = np.any(nAlts > 1, axis = 1)
+
+  return (softClips <= 1) & (nearClip | (bothAlts & (altNearClip | multipleAlts)))
+
+
+def checkProviralPairForHostClip(read1, read2, read1AllAlts, read2AllAlts, refLen, proviralSeqs,
+  clipMinLen = 17, adapterFilter = None, tidIndex = None):
+  # returns (potential chimera, "read1" or "read2", isAlt) or None
+  potentialAltChimera = None
+  readContainingChimera = ""
+  if read1AllAlts is not None and read2AllAlts is not None:
+    if tidIndex is None:
+      tidIndex = ProviralTidIndex(read1.header, [])
+    read1Alts = tidIndex.sameReferenceAlts(read1, read1AllAlts)
+    read2Alts = tidIndex.sameReferenceAlts(read2, read2AllAlts)
+    
+    read1AltCheck = None
+    read2AltCheck = None
+    if len(read1Alts) > 1 or len(read2Alts) > 1:
+      readWarningLog("{}: has multiple alt aligns. Verify manually.".format(read1.qname))
+    
+    if len(read1Alts) == 1:
+      read1AltCheck = checkForPotentialHostClip(read1, refLen, proviralSeqs = proviralSeqs,
+        clipMinLen = clipMinLen, useAlts = read1Alts[0], adapterFilter = adapterFilter)
+    if len(read2Alts) == 1:
+      read2AltCheck = checkForPotentialHostClip(read2, refLen, proviralSeqs = proviralSeqs,
+        clipMinLen = clipMinLen, useAlts = read2Alts[0], adapterFilter = adapterFilter)
+
+    if read1AltCheck is None and read2AltCheck is not None:
+      potentialAltChimera = read2AltCheck
+      readContainingChimera = "read2"
+    elif read1AltCheck is not None and read2AltCheck is None:
+      potentialAltChimera = read1AltCheck
+      readContainingChimera = "read1"
+
+  potentialChimera = None
+  read1Check = checkForPotentialHostClip(read1, refLen, proviralSeqs = proviralSeqs,
+    clipMinLen = clipMinLen, useAlts = None, adapterFilter = adapterFilter)
+  read2Check = checkForPotentialHostClip(read2, refLen, proviralSeqs = proviralSeqs,
+    clipMinLen = clipMinLen, useAlts = None, adapterFilter = adapterFilter)  
+
+  if read1Check is None and read2Check is not None:
+    potentialChimera = read2Check
+    readContainingChimera = "read2"
+  elif read1Check is not None and read2Check is None:
+    potentialChimera = read1Check
+    readContainingChimera = "read1"
+
+  if potentialAltChimera is not None and potentialChimera is not None:
+    readWarningLog("{}: please verify. Clip identified in both alt and normal align.".format(read1.qname))
+  elif potentialAltChimera is not None:
+    return (potentialAltChimera, readContainingChimera, True)
+  elif potentialChimera is not None:
+    return (potentialChimera, readContainingChimera, False)
+
+  return None
+
+
+def parseProviralReads(readPairs, proviralSeqs, hostClipFastaFn, clipMinLen = 17, adapterFilter = None):
+  adapterRejected = adapterFilter.rejected if adapterFilter is not None else 0
+  validReads = defaultdict()
+  potentialValidChimeras = defaultdict()
+
+  pairReads = []
+  barcodes = []
+  refLens = []
+  tidIndex = None
+  for rpName, reads in readPairs.items():
+    # must be paired
+    if len(reads) != 2:
+      continue
+    
+    read1 = reads[0]
+    read2 = reads[1]
+    
+    # must contain a valid cell barcode passing allowlist
+    cbc1 = extractCellBarcode(read1)
+    if cbc1 is None:
+      continue
+
+    # skip if only single mate mapped
+    if read1.is_unmapped or read2.is_unmapped:
+      continue
+    
+    # rearrange depending on where alignment is
+    cbcs = (cbc1, None)
+    if read1.reference_start > read2.reference_start:
+      read1, read2 = read2, read1
+      cbcs = (None, cbc1)
+
+    tidIndex = tidIndexFor(read1, tidIndex, proviralSeqs.keys(), proviralSeqs)
+    pairReads.append(read1)
+    pairReads.append(read2)
+    barcodes.append(cbcs)
+    refLens.append(tidIndex.refLengths[read1.reference_id])
+
+  # XA tags are parsed once, for the candidate selection and the fragments
+  alts = [getAltAlign(read) for read in pairReads]
+
+  # only pairs near an LTR boundary go through the per-pair clip checks. The rest are
+  # recorded as the fields of their two viral fragments, without building objects
+  candidates = selectNearLTRCandidates(pairReads, alts, refLens, tidIndex, clipMinLen = clipMinLen)
+
+  for i, isCandidate in enumerate(candidates):
+    read1, read2 = pairReads[2 * i], pairReads[2 * i + 1]
+    read1AllAlts, read2AllAlts = alts[2 * i], alts[2 * i + 1]
+
+    if not isCandidate:
+      validReads[read1.qname] = (proviralFragmentFields(read1, read1AllAlts, barcodes[i][0]),
+        proviralFragmentFields(read2, read2AllAlts, barcodes[i][1]))
+      continue
+
+    # add to allowed proviral reads...
+    rd1ProviralFrag = ProviralFragment()
+    rd1ProviralFrag.setFromRead(read1)
+    rd1ProviralFrag.setAlt(read1AllAlts)
+
+    rd2ProviralFrag = ProviralFragment()
+    rd2ProviralFrag.setFromRead(read2)
+    rd2ProviralFrag.setAlt(read2AllAlts)
+
+    rdPair = ReadPairDualProviral(read1 = rd1ProviralFrag, read2 = rd2ProviralFrag)
+    validReads[read1.qname] = rdPair
+
+    # move on to chimera analysis
+    check = checkProviralPairForHostClip(read1, read2, read1AllAlts, read2AllAlts, refLens[i], proviralSeqs,
+      clipMinLen = clipMinLen, adapterFilter = adapterFilter, tidIndex = tidIndex)
+
+    if check is not None:
+      potentialChimera, readContainingChimera, isAlt = check
+      potentialValidChimeras[read1.qname] = potentialChimera
+      rdPair.setPotentialClipEdit(readContainingChimera, potentialChimera, isAlt = isAlt)
+
+  writeFasta(potentialValidChimeras, hostClipFastaFn)
+  flushReadLogs()
+  printAdapterRejections(adapterFilter, adapterRejected, "proviral reads")
+
+  returnVal = {"validReads" : validReads, "potentialValidChimeras": potentialValidChimeras}
+  return returnVal
+
+
+def parseUnmappedReads(readPairs, proviralSeqs, proviralLTRSeqs, unmappedHostClipFn,
+  LTRClipMinLen = 11, hostClipMinLen = 17, minHostQuality = 30, adapterFilter = None):
+  adapterRejected = adapterFilter.rejected if adapterFilter is not None else 0
+
+  viralFrags = []
+  validChimera = []
+  potentialChimera = []
+
+  tidIndex = None
+  for k, readPair in readPairs.items():
+    tidIndex = tidIndexFor(readPair[0], tidIndex, proviralSeqs.keys(), proviralSeqs, proviralLTRSeqs)
+    if tidIndex.isProviral[readPair[0].reference_id]:
+      viralRead = readPair[0]
+      hostRead = readPair[1]
+    else:
+      viralRead = readPair[1]
+      hostRead = readPair[0]
+
+    # host read must have high enough mapq
+    # for viral read, no check since mapq is unrealiable if using multiple viral seqs
+    if hostRead.mapq < minHostQuality:
+      continue
+    
+    hostReadSubs = hostRead.cigarstring.count("S")
+    viralReadSubs = viralRead.cigarstring.count("S")
+
+    readAllAlts = getAltAlign(viralRead)
+    proviralFrag = ProviralFragment()
+    proviralFrag.setFromRead(viralRead)
+    proviralFrag.setAlt(readAllAlts)
+    
+    # can't have mulutiple soft clips present
+    if hostReadSubs + viralReadSubs > 1:
+      viralFrags.append(proviralFrag)
+      continue
+
+    # if no soft clips, just save viral read
+    if hostReadSubs == 0 and viralReadSubs == 0:
+      viralFrags.append(proviralFrag)
+      continue
+
+    # special case. #TODO add this case.
+    if hostReadSubs == 1 and viralReadSubs == 1:
+      readWarningLog("{}: Soft clip detected in both host and viral".format(viralRead.query_name))
+
+    # host read soft clip
+    elif hostReadSubs == 1:
+      potentialHits = isSoftClipProviral(hostRead, proviralLTRSeqs, proviralSeqs, LTRClipMinLen, adapterFilter = adapterFilter)
+      if potentialHits:
+        validChimera.append(potentialHits)
+        viralFrags.append(proviralFrag)
+      else:
+        viralFrags.append(proviralFrag)
+
+    # viral read soft clip
+    elif viralReadSubs == 1:
+      refLen = tidIndex.refLengths[viralRead.reference_id]
+
+      viralSoftClipAlt = None
+      if readAllAlts is not None:
+        readAlts = tidIndex.sameReferenceAlts(viralRead, readAllAlts)
+        if len(readAlts) == 1:
+          viralSoftClipAlt = checkForPotentialHostClip(viralRead, refLen, proviralSeqs = proviralSeqs,
+            clipMinLen = hostClipMinLen, useAlts = readAlts[0], adapterFilter = adapterFilter)
+
+      viralSoftClip = checkForPotentialHostClip(viralRead, refLen, proviralSeqs = proviralSeqs,
+        clipMinLen = hostClipMinLen, useAlts = None, adapterFilter = adapterFilter)
+
+      if viralSoftClip is not None:
+        readLog("{}: Valid soft clip detected in virus. Proceed further\n{}".format(viralRead.query_name, viralRead.to_string()))
+        potentialChimera.append(viralSoftClip)
+      elif viralSoftClipAlt is not None:
+        readLog("{}: Valid alternate soft clip detected in virus. Proceed further\n{}".format(viralRead.query_name, viralRead.to_string()))
+        proviralFrag.setPotentialClipEdit(viralRead.query_name, potentialChimera, isAlt = False)
+        potentialChimera.append(viralSoftClipAlt)
+
+    else:
+      viralFrags.append(proviralFrag)
+
+  writeFasta(potentialChimera, unmappedHostClipFn)
+  flushReadLogs()
+  printAdapterRejections(adapterFilter, adapterRejected, "unmapped reads")
+
+  return {
+    "validChimera": validChimera,
+    "viralFrags": viralFrags,
+    "potentialChimera": potentialChimera}
+
+
+def printAdapterRejections(adapterFilter, rejectedBefore, readType):
+  if adapterFilter is not None:
+    printCyanOnGrey("Rejected {} adapter clip(s) in {}".format(adapterFilter.rejected - rejectedBefore, readType))
+
+
+def partitionReads(reads, proviralFastaIds, proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera, top_n = -1,
+  teeBams = None, softClipMinLen = 11, deduplicator = None, checkpointer = None, readIndex = 0, ltrPrescreen = None,
+  adapterFilter = None, metrics = None, metricsEvery = 10000, hostMates = None):
+  readGroups = {
+    "hostWithPotentialChimera": hostReadsWithPotentialChimera,
+    "proviralReads": proviralReads,
+    "umappedWithPotentialChimera": unmappedPotentialChimera}
+
+  # candidates kept by read group. The metrics file is offered an update every
+  # metricsEvery reads and writes it at most once per its interval
+  candidates = {k: 0 for k in readGroups}
+  nextMetricsIndex = readIndex + metricsEvery
+
+  # proviral references by tid, for the header of the reads
+  tidIndex = ProviralTidIndex(None, proviralFastaIds)
+
+  if hostMates is None and (adapterFilter is not None or ltrPrescreen is not None):
+    hostMates = HostMateTracker(softClipMinLen)
+
+  for read in reads:
+    if readIndex % 1000000 == 0:
+      print("Parsing {}th read".format(str(readIndex)), end = "\r")
+
+    if top_n != -1 and readIndex > top_n:
+      break
+
+    if checkpointer is not None:
+      checkpointer.nextRead(read, readIndex, readGroups.keys())
+
+    if metrics is not None and readIndex >= nextMetricsIndex:
+      metrics.parseProgress(readIndex, candidates)
+      nextMetricsIndex = readIndex + metricsEvery
+
+    readIndex += 1
+
+    # ignore if optical/PCR duplicate OR without a mate
+    if (read.flag & 1024) or (not read.flag & 1):
+      readIndex += 1
+      continue
+    
+    if read.header is not tidIndex.header:
+      tidIndex = ProviralTidIndex(read.header, proviralFastaIds)
+      if len(tidIndex.missing) != 0:
+        printRed("Viral sequence(s) not in the BAM header: {}".format(", ".join(tidIndex.missing)))
+
+    refnameIsProviral = tidIndex.isProviral[read.reference_id]
+    # supposed to take mate's ref id or if no mate, the next record in BAM file
+    nextRefnameIsProviral = tidIndex.isProviral[read.next_reference_id]
+    
+    cigarString = read.cigartuples
+    # 4 is soft clip
+    hasSoftClipAtEnd = cigarString != None and (cigarString[-1][0] == 4 or cigarString[0][0] == 4)
+    softClipIsLongEnough = cigarString != None and \
+      ((cigarString[-1][0] == 4 and cigarString[-1][1] >= softClipMinLen) or \
+        (cigarString[0][0] == 4 and cigarString[0][1] >= softClipMinLen))
+    
+    # if read is properly mapped in a pair AND not proviral aligned AND there is soft clipping involved
+    if (read.flag & 2) and (not refnameIsProviral) and (hasSoftClipAtEnd and softClipIsLongEnough):
+      # drop adapter read-through and clips that can't match an LTR end. Both mates of
+      # a pair are kept or dropped together (see HostMateTracker)
+      if hostMates is not None:
+        rejected = (adapterFilter is not None and adapterFilter.isAdapterRead(read)) or \
+          (ltrPrescreen is not None and not ltrPrescreen.mayBeProviral(read))
+        if rejected and not hostMates.keepRejected(read):
+          continue
+        if not rejected and hostMates.dropPassing(read):
+          continue
+
+      # move to chimera identification
+      teeKey = "hostWithPotentialChimera"
+    
+    # if there is a mate AND both are proviral only 
+    elif refnameIsProviral and nextRefnameIsProviral:
+      # save into proviral
+      teeKey = "proviralReads"
+
+    # read or mate must be mapped AND either read or its mate must be proviral
+    elif (not read.flag & 14) and (refnameIsProviral or nextRefnameIsProviral):
+      # move to chimera identification
+      teeKey = "umappedWithPotentialChimera"
+
+    else:
+      continue
+
+    # only candidate reads are checked, so the dedup set stays small
+    if deduplicator is not None and deduplicator.isDuplicate(read):
+      continue
+
+    readGroups[teeKey].addRead(read)
+    candidates[teeKey] += 1
+    if hostMates is not None and teeKey == "hostWithPotentialChimera":
+      hostMates.addKept(read)
+    if teeBams is not None:
+      teeBams[teeKey].write(read)
+    if checkpointer is not None:
+      checkpointer.addCandidate(teeKey, read, readGroups.keys())
+
+  if metrics is not None:
+    metrics.endParse(readIndex, candidates)
+
+
+def parseCellrangerBam(bamfile, proviralFastaIds, proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera, top_n = -1,
+  teeFNs = None, decompressionThreads = 1, compressionThreads = 1, reference = None, refCache = None, softClipMinLen = 11,
+  deduplicator = None, checkpointDir = None, checkpointEvery = 10000000, proviralLTRSeqs = None, adapterFilter = None,
+  metrics = None, LTRClipLens = None):
+  bam = openAlignmentInput(bamfile, threads = decompressionThreads, reference = reference, refCache = refCache)
+  printGreen("Input BAM sort order: {}".format(bam.header.to_dict().get("HD", {}).get("SO", "unknown")))
+
+  # classified reads are written out as they are seen instead of replaying the dicts afterwards
+  teeBams = None
+  if teeFNs is not None:
+    teeBams = openTeeBams(teeFNs, bam, threads = compressionThreads)
+
+  # host clips are only kept if every k-mer is found in the LTR ends they would have to match
+  ltrPrescreen = None
+  if proviralLTRSeqs is not None:
+    ltrPrescreen = LTRKmerPrescreen(proviralLTRSeqs, k = softClipMinLen)
+
+  # a pair with a rejected mate is only dropped if the mate's clip counts at every
+  # LTRClipLen of a sweep
+  hostMates = None
+  if adapterFilter is not None or ltrPrescreen is not None:
+    hostMates = HostMateTracker(softClipMinLen, dropClipLen = max(LTRClipLens) if LTRClipLens is not None else None)
+
+  # periodic checkpoints need to seek back into the input, so only BAM files are supported
+  checkpointer = None
+  readIndex = 0
+  if checkpointDir is not None:
+    if isStreamInput(bamfile) or not bam.is_bam:
+      printRed("Checkpoints need a seekable BAM file. Parsing without checkpoints")
+    else:
+      checkpointer = ScanCheckpointer(checkpointDir, bam,
+        identity = inputIdentity(bamfile, top_n = top_n, softClipMinLen = softClipMinLen, dedup = deduplicator is not None,
+          ltrPrescreen = ltrPrescreen is not None, adapterFilter = adapterFilter is not None,
+          proviral = proviralDigest(proviralFastaIds, proviralLTRSeqs)),
+        every = checkpointEvery,
+        threads = compressionThreads,
+        hostMates = hostMates,
+        deduplicator = deduplicator)
+
+      readGroups = {
+        "hostWithPotentialChimera": hostReadsWithPotentialChimera,
+        "proviralReads": proviralReads,
+        "umappedWithPotentialChimera": unmappedPotentialChimera}
+      readIndex = checkpointer.resume(readGroups, teeBams = teeBams)
+      if readIndex != 0:
+        printGreen("Resuming parse from checkpoint after {} reads".format(readIndex))
+
+  if metrics is not None:
+    metrics.startParse(bam, bamfile, top_n = top_n, readIndex = readIndex)
+
+  partitionReads(bam, proviralFastaIds, proviralReads, hostReadsWithPotentialChimera, unmappedPotentialChimera,
+    top_n = top_n, teeBams = teeBams, softClipMinLen = softClipMinLen, deduplicator = deduplicator,
+    checkpointer = checkpointer, readIndex = readIndex, ltrPrescreen = ltrPrescreen, adapterFilter = adapterFilter,
+    metrics = metrics, hostMates = hostMates)
+
+  if checkpointer is not None:
+    checkpointer.finish()
+
+  if deduplicator is not None:
+    printCyanOnGrey("Removed {} duplicate candidate read(s)".format(deduplicator.duplicates))
+  if adapterFilter is not None:
+    printCyanOnGrey("Removed {} host read(s) with adapter clips".format(adapterFilter.rejected))
+  if ltrPrescreen is not None:
+    printCyanOnGrey("Removed {} host read(s) with clips not matching an LTR end".format(ltrPrescreen.rejected))
+  if hostMates is not None:
+    printCyanOnGrey("Kept {} of these for a mate already kept, removed {} host read(s) whose mate was removed and tagged {} with a shorter removed mate clip".format(
+      hostMates.keptForMate, hostMates.droppedForMate, hostMates.taggedForMate))
+
+  if teeBams is not None:
+    closeTeeBams(teeBams, teeFNs)
+    
+  return bam
+
+
+def scheduleAnalysisStages(scheduler, dualProviralAlignedReads, hostReadsWithPotentialChimera, unmappedPotentialChimera,
+  proviralSeqs, potentialLTR, hostGenomeIndex, hostKmerIndex, LTRClipLen, hostClipLen,
+  viralReadHostClipFasta, unmappedHostClipFasta, alignerThreads = 1, adapterFilter = None):
+  # stages are named by the parameters they depend on. Settings sharing a parameter
+  # (i.e. in a parameter sweep) share that stage instead of running it again
+  hostStage = "hostChimeras:LTRClipLen{}".format(LTRClipLen)
+  proviralStage = "proviralReads:hostClipLen{}".format(hostClipLen)
+  viralChimeraStage = "viralChimeras:hostClipLen{}".format(hostClipLen)
+  unmappedStage = "unmappedReads:LTRClipLen{}:hostClipLen{}".format(LTRClipLen, hostClipLen)
+  unmappedChimeraStage = "unmappedChimeras:LTRClipLen{}:hostClipLen{}".format(LTRClipLen, hostClipLen)
+  compiledStage = "compiled:LTRClipLen{}:hostClipLen{}".format(LTRClipLen, hostClipLen)
+
+  if hostStage not in scheduler.stages:
+    scheduler.addStage(hostStage, parseHostReadsWithPotentialChimera, kwargs = {
+      "readPairs": hostReadsWithPotentialChimera,
+      "proviralLTRSeqs": potentialLTR,
+      "proviralSeqs": proviralSeqs,
+      "clipMinLen": LTRClipLen,
+      "adapterFilter": adapterFilter})
+
+  if proviralStage not in scheduler.stages:
+    scheduler.addStage(proviralStage, parseProviralReads, kwargs = {
+      "readPairs": dualProviralAlignedReads,
+      "proviralSeqs": proviralSeqs,
+      "hostClipFastaFn": viralReadHostClipFasta,
+      "clipMinLen": hostClipLen,
+      "adapterFilter": adapterFilter})
+
+    scheduler.addStage(viralChimeraStage, alignClipToHost, inProcess = False, kwargs = {
+      "fafile": viralReadHostClipFasta,
+      "hostGenomeIndex": hostGenomeIndex,
+      "hostClipLen": hostClipLen,
+      "hostKmerIndex": hostKmerIndex,
+      "threads": alignerThreads},
+      deps = {"potentialChimeras": (proviralStage, "potentialValidChimeras")})
+
+  scheduler.addStage(unmappedStage, parseUnmappedReads, kwargs = {
+    "readPairs": unmappedPotentialChimera,
+    "proviralSeqs": proviralSeqs,
+    "proviralLTRSeqs": potentialLTR,
+    "unmappedHostClipFn": unmappedHostClipFasta,
+    "LTRClipMinLen": LTRClipLen,
+    "hostClipMinLen": hostClipLen,
+    "adapterFilter": adapterFilter})
+
+  scheduler.addStage(unmappedChimeraStage, alignClipToHost, inProcess = False, kwargs = {
+    "fafile": unmappedHostClipFasta,
+    "hostGenomeIndex": hostGenomeIndex,
+    "hostClipLen": hostClipLen,
+    "hostKmerIndex": hostKmerIndex,
+    "threads": alignerThreads},
+    deps = {"potentialChimeras": (unmappedStage, "validChimera")})
+
+  scheduler.addStage(compiledStage, CompiledDataset, inProcess = False, deps = {
+    "validChimerasFromHostReads": hostStage,
+    "validChimerasFromViralReads": viralChimeraStage,
+    "validChimerasFromUnmappedReadsHost": (unmappedStage, "validChimera"),
+    "validChimerasFromUnmappedReadsViral": unmappedChimeraStage,
+    "validViralReads": (proviralStage, "validReads"),
+    "unmappedViralReads": (unmappedStage, "viralFrags")})
+
+  return {"compiled": compiledStage, "proviralReads": proviralStage, "unmappedReads": unmappedStage}
@@ -0,0 +1,97 @@
+import os
+import re
+import io
+import cProfile
+import pstats
+import functools
+from csv import writer
+
+# module level and compiled pattern entry points of re
+regexFunctions = {"compile", "search", "match", "fullmatch", "finditer", "findall", "split", "sub", "subn"}
+
+
+def isRegexCall(func):
+  filename, lineno, funcname = func
+  if filename.endswith(os.path.join("re", "__init__.py")) or filename.endswith("re.py"):
+    return funcname in regexFunctions
+
+  # C methods are listed as "<method 'search' of 're.Pattern' objects>"
+  return filename == "~" and "re.Pattern" in funcname
+
+
+def isSeqAllocation(func):
+  filename, lineno, funcname = func
+  return filename.endswith(os.path.join("Bio", "Seq.py")) and funcname == "__init__"
+
+
+def countCalls(stats, predicate):
+  return sum(nc for func, (cc, nc, tt, ct, callers) in stats.stats.items() if predicate(func))
+
+
+class StageProfiler(object):
+  def __init__(self, profileDir, counters = False, topN = 30):
+    super().__init__()
+
+    self.profileDir = profileDir
+    self.counters = counters
+    self.topN = topN
+
+    # stage name -> (.prof file, number of read groups handled by the stage)
+    self.stages = {}
+
+    if not os.path.exists(profileDir):
+      os.makedirs(profileDir)
+
+  def stageFn(self, name, ext):
+    return os.path.join(self.profileDir, re.sub(r"[^\w.-]", "_", name) + ext)
+
+  def call(self, name, func, kwargs):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, **kwargs)
+
+    profiler.dump_stats(self.stageFn(name, ".prof"))
+    with open(self.stageFn(name, ".txt"), "w") as fhandle:
+      stats = pstats.Stats(profiler, stream = fhandle)
+      stats.sort_stats("cumulative").print_stats(self.topN)
+
+    nGroups = len(kwargs["readPairs"]) if "readPairs" in kwargs else None
+    self.stages[name] = (self.stageFn(name, ".prof"), nGroups)
+
+    return result
+
+  def callStage(self, name, func, **kwargs):
+    return self.call(name, func, kwargs)
+
+  def wrapStages(self, scheduler):
+    # stages are run serially when profiling, so each profile only holds its own stage
+    for name, stage in scheduler.stages.items():
+      stage["func"] = functools.partial(self.callStage, name, stage["func"])
+
+  def writeSummary(self):
+    with open(os.path.join(self.profileDir, "summary.txt"), "w") as fhandle:
+      fhandle.write("Time per stage (s)\n")
+      for name, (fn, nGroups) in self.stages.items():
+        fhandle.write("{}\t{:.3f}\n".format(name, pstats.Stats(fn).total_tt))
+
+      # top functions over every stage
+      fhandle.write("\nTop functions by cumulative time (all stages)\n")
+      stats = pstats.Stats(*[fn for fn, nGroups in self.stages.values()], stream = fhandle)
+      stats.sort_stats("cumulative").print_stats(self.topN)
+
+    if not self.counters:
+      return
+
+    with open(os.path.join(self.profileDir, "counters.tsv"), "w") as tsvfile:
+      writ = writer(tsvfile, delimiter = "\t")
+
+      writ.writerow(["stage", "readGroups", "regexCalls", "seqAllocations", "regexCallsPerGroup", "seqAllocationsPerGroup"])
+      for name, (fn, nGroups) in self.stages.items():
+        stats = pstats.Stats(fn, stream = io.StringIO())
+        regexCalls = countCalls(stats, isRegexCall)
+        seqAllocations = countCalls(stats, isSeqAllocation)
+
+        perGroup = ["", ""]
+        if nGroups:
+          perGroup = ["{:.2f}".format(regexCalls / nGroups), "{:.2f}".format(seqAllocations / nGroups)]
+
+        writ.writerow([name, "" if nGroups is None else nGroups, regexCalls, seqAllocations] + perGroup)
@@ -0,0 +1,53 @@
+class ProviralTidIndex(object):
+  def __init__(self, header, proviralFastaIds, proviralSeqs = None, proviralLTRSeqs = None):
+    super().__init__()
+
+    # viral references resolved once against a BAM header, so per read checks index a
+    # list by tid instead of comparing reference names. Tables have one extra entry at
+    # the end, which tid -1 (unmapped) reads as non proviral
+    self.header = header
+    references = list(header.references) if header is not None else []
+    # every reference of the header, for the reference names of alt aligns
+    self.tids = {name: tid for tid, name in enumerate(references)}
+
+    self.isProviral = [False] * (len(references) + 1)
+    self.refLengths = [0] * (len(references) + 1)
+    # (start, end, length) of the 5' and 3' LTR, 1-based and inclusive as in the LTR
+    # matches. None where the LTR wasn't found
+    self.ltr5p = [None] * (len(references) + 1)
+    self.ltr3p = [None] * (len(references) + 1)
+    self.missing = []
+
+    for name in proviralFastaIds:
+      tid = self.tids.get(name)
+      if tid is None:
+        self.missing.append(name)
+        continue
+
+      self.isProviral[tid] = True
+      if proviralSeqs is not None:
+        self.refLengths[tid] = len(proviralSeqs[name][0])
+
+      if proviralLTRSeqs is not None and name in proviralLTRSeqs:
+        LTRs = proviralLTRSeqs[name]
+        if LTRs["5p"] is not None:
+          self.ltr5p[tid] = (LTRs["5pStart"], LTRs["5pEnd"], len(LTRs["5p"]))
+        if LTRs["3p"] is not None:
+          self.ltr3p[tid] = (LTRs["3pStart"], LTRs["3pEnd"], len(LTRs["3p"]))
+
+  def sameReferenceAlts(self, read, alts):
+    # alt aligns (parsed XA entries) on the reference of the read itself
+    if alts is None:
+      return []
+
+    tid = read.reference_id
+    return [alt for alt in alts if self.tids.get(alt[0]) == tid]
+
+
+def tidIndexFor(read, tidIndex, proviralFastaIds, proviralSeqs = None, proviralLTRSeqs = None):
+  # reads returned from worker processes carry their own copy of the header, so the
+  # index is rebuilt whenever the header object changes
+  if tidIndex is None or read.header is not tidIndex.header:
+    return ProviralTidIndex(read.header, proviralFastaIds, proviralSeqs, proviralLTRSeqs)
+
+  return tidIndex
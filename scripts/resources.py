@@ -0,0 +1,68 @@
+import os
+import re
+
+memoryUnits = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parseMemory(value):
+  # bytes or a number with a K/M/G/T suffix (ex: 16G)
+  match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMGT]?)B?", value.strip().upper())
+  if match is None:
+    raise Exception("Invalid memory value: {}".format(value))
+
+  return int(float(match.group(1)) * memoryUnits[match.group(2)])
+
+
+def availableThreads():
+  # CPUs this process may run on (its affinity mask under a batch scheduler)
+  if hasattr(os, "sched_getaffinity"):
+    return len(os.sched_getaffinity(0))
+
+  return os.cpu_count() or 1
+
+
+def poolThreads(n):
+  # pysam count for n threads next to the calling thread. pysam (de)compresses on the
+  # calling thread for 1 and starts a pool of that many threads above it
+  return n if n > 1 else 1
+
+
+class ResourceBudget(object):
+  def __init__(self, threads = None, memory = None):
+    super().__init__()
+
+    self.threads = max(1, threads) if threads is not None else availableThreads()
+    self.memory = memory # in bytes. None is unbounded
+
+  def parseThreads(self, nOutputs = 3):
+    # split between decompression of the input and compression of each BAM written while
+    # parsing. The parsing thread itself takes one thread of the budget
+    spare = self.threads - 1
+    if nOutputs == 0:
+      return poolThreads(spare), 1
+
+    decompression = spare // 2
+    compression = (spare - decompression) // nOutputs
+
+    return poolThreads(decompression), poolThreads(compression)
+
+  def decompressionThreads(self):
+    # for a BAM read while nothing else runs
+    return poolThreads(self.threads - 1)
+
+  def stageWorkers(self, nStages = 3):
+    # the scheduler's thread pool for aligners is as large as its process pool, so each
+    # worker process is budgeted together with at least one aligner thread. Below 4
+    # threads that leaves a single worker, i.e. stages run serially
+    return max(1, min(nStages, self.threads // 2))
+
+  def alignerThreads(self, concurrentAligners = 1, workerProcesses = 0):
+    # threads left by busy worker processes, split between aligners running at once
+    return max(1, (self.threads - workerProcesses) // max(1, concurrentAligners))
+
+  def memoryShare(self, nShares = 1):
+    # memory each in-memory structure may hold before spilling to disk
+    if self.memory is None:
+      return None
+
+    return self.memory // nShares
@@ -0,0 +1,117 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# worker processes are forked after stages are registered, so they look up the
+# stage by name here instead of pickling the function and its (large) arguments
+registeredStages = {}
+
+
+def resolveDependencies(stage, results):
+  depResults = {}
+  for argName, dep in stage["deps"].items():
+    # dependency is either a stage name or a (stage name, key) pair
+    if isinstance(dep, tuple):
+      depResults[argName] = results[dep[0]][dep[1]]
+    else:
+      depResults[argName] = results[dep]
+
+  return depResults
+
+
+def runRegisteredStage(name, depResults):
+  stage = registeredStages[name]
+  return stage["func"](**stage["kwargs"], **depResults)
+
+
+class StageScheduler(object):
+  def __init__(self, workers = 3, progress = None):
+    super().__init__()
+
+    # progress(running stage names, number of stages done, number of stages) is called
+    # whenever a stage starts or finishes
+    self.workers = workers
+    self.stages = {}
+    self.progress = progress
+
+  def reportProgress(self, running, done):
+    if self.progress is not None:
+      self.progress(sorted(running), done, len(self.stages))
+
+  def addStage(self, name, func, kwargs = None, deps = None, inProcess = True):
+    # inProcess stages are CPU bound and run in a worker process. Others (e.g. waiting
+    # on an aligner subprocess) run on a thread of the main process
+    self.stages[name] = {
+      "func": func,
+      "kwargs": kwargs if kwargs is not None else {},
+      "deps": deps if deps is not None else {},
+      "inProcess": inProcess}
+
+  def stageDepNames(self, name):
+    return [dep[0] if isinstance(dep, tuple) else dep for dep in self.stages[name]["deps"].values()]
+
+  def runSerial(self):
+    results = {}
+    remaining = list(self.stages.keys())
+
+    while len(remaining) != 0:
+      ready = [n for n in remaining if all(d in results for d in self.stageDepNames(n))]
+      if len(ready) == 0:
+        raise Exception("Stage dependencies can't be resolved: {}".format(", ".join(remaining)))
+
+      for name in ready:
+        stage = self.stages[name]
+        self.reportProgress([name], len(results))
+        results[name] = stage["func"](**stage["kwargs"], **resolveDependencies(stage, results))
+        remaining.remove(name)
+
+    self.reportProgress([], len(results))
+    return results
+
+  def run(self):
+    if self.workers <= 1:
+      return self.runSerial()
+
+    registeredStages.clear()
+    registeredStages.update(self.stages)
+
+    results = {}
+    running = {}
+    remaining = list(self.stages.keys())
+
+    processPool = ProcessPoolExecutor(max_workers = self.workers,
+      mp_context = multiprocessing.get_context("fork"))
+    threadPool = ThreadPoolExecutor(max_workers = self.workers)
+
+    try:
+      while len(remaining) != 0 or len(running) != 0:
+        ready = [n for n in remaining if all(d in results for d in self.stageDepNames(n))]
+        if len(ready) == 0 and len(running) == 0:
+          raise Exception("Stage dependencies can't be resolved: {}".format(", ".join(remaining)))
+
+        for name in ready:
+          stage = self.stages[name]
+          depResults = resolveDependencies(stage, results)
+
+          if stage["inProcess"]:
+            future = processPool.submit(runRegisteredStage, name, depResults)
+          else:
+            future = threadPool.submit(runRegisteredStage, name, depResults)
+
+          running[future] = name
+          remaining.remove(name)
+
+        if len(ready) != 0:
+          self.reportProgress(running.values(), len(results))
+
+        done, _ = wait(running, return_when = FIRST_COMPLETED)
+        for future in done:
+          results[running.pop(future)] = future.result()
+
+        self.reportProgress(running.values(), len(results))
+
+    finally:
+      processPool.shutdown()
+      threadPool.shutdown()
+      registeredStages.clear()
+
+    return results
@@ -0,0 +1,136 @@
+# Queries of a site database from the command line. Run from the repository root:
+# python -m scripts.siteDatabase sites.db {samples,near,shared} ...
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+
+# one row per sample and integration site. The (chr, pos) index turns window lookups
+# into range scans, so no interval tree is needed for point sites
+schema = [
+  """CREATE TABLE IF NOT EXISTS samples (
+    sample TEXT PRIMARY KEY,
+    donor TEXT,
+    added TEXT)""",
+  """CREATE TABLE IF NOT EXISTS sites (
+    sample TEXT NOT NULL,
+    donor TEXT,
+    chr TEXT NOT NULL,
+    orient TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    reads INTEGER NOT NULL,
+    cells INTEGER NOT NULL,
+    PRIMARY KEY (sample, chr, orient, pos))""",
+  "CREATE INDEX IF NOT EXISTS sitesByPos ON sites (chr, pos)",
+  "CREATE INDEX IF NOT EXISTS sitesByDonor ON sites (donor)"
+]
+
+
+class SiteDatabase(object):
+  def __init__(self, fn):
+    super().__init__()
+
+    self.fn = fn
+    self.connection = sqlite3.connect(fn)
+
+    with self.connection:
+      for statement in schema:
+        self.connection.execute(statement)
+
+  def addSample(self, sample, donor, siteSupport):
+    # siteSupport is {(chr, orient, pos): (reads, cells)}. Adding a sample again replaces it
+    rows = [(sample, donor, chr, orient, pos, reads, cells)
+      for (chr, orient, pos), (reads, cells) in siteSupport.items()]
+
+    with self.connection:
+      self.connection.execute("DELETE FROM sites WHERE sample = ?", (sample, ))
+      self.connection.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, ?)",
+        (sample, donor, datetime.now().isoformat(timespec = "seconds")))
+      self.connection.executemany("INSERT INTO sites VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    return len(rows)
+
+  def sitesNear(self, chr, pos, window = 10):
+    return self.connection.execute(
+      """SELECT sample, donor, chr, orient, pos, reads, cells FROM sites
+      WHERE chr = ? AND pos BETWEEN ? AND ?
+      ORDER BY pos, sample""", (chr, pos - window, pos + window)).fetchall()
+
+  def sharedSites(self, window = 10, donor = None):
+    # pairs of sites from different samples within window bp of each other
+    query = """SELECT a.sample, b.sample, a.chr, a.orient, a.pos, b.orient, b.pos, a.reads, b.reads, a.cells, b.cells
+      FROM sites a JOIN sites b
+      ON b.chr = a.chr AND b.pos BETWEEN a.pos - ? AND a.pos + ? AND b.sample > a.sample"""
+    params = [window, window]
+
+    if donor is not None:
+      query += " WHERE a.donor = ? AND b.donor = ?"
+      params += [donor, donor]
+
+    return self.connection.execute(query + " ORDER BY a.chr, a.pos", params).fetchall()
+
+  def samples(self):
+    return self.connection.execute("SELECT sample, donor, added FROM samples ORDER BY sample").fetchall()
+
+  def close(self):
+    self.connection.close()
+
+
+queryColumns = {
+  "samples": ["sample", "donor", "added"],
+  "near": ["sample", "donor", "chr", "orient", "pos", "reads", "cells"],
+  "shared": ["sampleA", "sampleB", "chr", "orientA", "posA", "orientB", "posB", "readsA", "readsB", "cellsA", "cellsB"]}
+
+
+def writeRows(rows, columns, fhandle):
+  fhandle.write("\t".join(columns) + "\n")
+  for row in rows:
+    fhandle.write("\t".join("" if x is None else str(x) for x in row) + "\n")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description = "Query integration sites shared across samples in a site database. Rows are written to stdout as tsv")
+  parser.add_argument("database",
+    help = "SQLite file written with --siteDatabase")
+  queries = parser.add_subparsers(dest = "query", required = True)
+
+  queries.add_parser("samples",
+    help = "Samples in the database")
+
+  nearParser = queries.add_parser("near",
+    help = "Sites of every sample within window bp of a position")
+  nearParser.add_argument("chr")
+  nearParser.add_argument("pos",
+    type = int)
+  nearParser.add_argument("--window",
+    default = 10,
+    type = int,
+    help = "Distance in bp. Default is 10")
+
+  sharedParser = queries.add_parser("shared",
+    help = "Pairs of sites from different samples within window bp of each other")
+  sharedParser.add_argument("--window",
+    default = 10,
+    type = int,
+    help = "Distance in bp. Default is 10")
+  sharedParser.add_argument("--donor",
+    help = "Only samples of this donor")
+
+  args = parser.parse_args()
+
+  # a missing file would be created empty by sqlite
+  if not os.path.exists(args.database):
+    raise Exception("Site database {} not found".format(args.database))
+
+  db = SiteDatabase(args.database)
+  if args.query == "samples":
+    rows = db.samples()
+  elif args.query == "near":
+    rows = db.sitesNear(args.chr, args.pos, window = args.window)
+  else:
+    rows = db.sharedSites(window = args.window, donor = args.donor)
+  db.close()
+
+  writeRows(rows, queryColumns[args.query], sys.stdout)
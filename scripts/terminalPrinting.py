@@ -1,3 +1,4 @@
+import time
 from termcolor import cprint
 
 printRed = lambda x: cprint(x, "red")
@@ -11,4 +12,31 @@ def printProgressBar(current, total, constantWord = "Progress", barLength = 30):
     arrow = '-' * int(percent / 100 * barLength - 1) + '>'
     spaces = ' ' * (barLength - len(arrow))
 
-    print('%s: [%s%s] %d %%' % (constantWord, arrow, spaces, percent), end = '\r')
\ No newline at end of file
+    print('%s: [%s%s] %d %%' % (constantWord, arrow, spaces, percent), end = '\r')
+
+
+class ThrottledPrinter(object):
+  def __init__(self, interval = 5, printFunc = print):
+    super().__init__()
+
+    # for per read messages from hot loops: prints at most one message every `interval`
+    # seconds and counts the rest, which are reported by the next printed message or flush
+    self.interval = interval
+    self.printFunc = printFunc
+    self.lastPrint = None
+    self.suppressed = 0
+
+  def __call__(self, message):
+    now = time.monotonic()
+    if self.lastPrint is not None and now - self.lastPrint < self.interval:
+      self.suppressed += 1
+      return
+
+    self.flush()
+    self.printFunc(message)
+    self.lastPrint = now
+
+  def flush(self):
+    if self.suppressed != 0:
+      self.printFunc("({} similar message(s) not shown)".format(self.suppressed))
+      self.suppressed = 0
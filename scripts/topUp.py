@@ -0,0 +1,116 @@
+import os
+import json
+import shutil
+from datetime import datetime
+from collections import OrderedDict
+from scripts.outputModules import importCompiledDataset
+from scripts.checkpoint import inputIdentity
+from scripts.terminalPrinting import printRed
+
+manifestName = "manifest.json"
+sourceName = "source.json"
+
+
+def siteKey(chimera):
+  frag = chimera.proviralFragment
+  return (frag.cbc, *chimera.intsite.returnAsList(), frag.seqname, frag.startBp, frag.endBp)
+
+
+def fragmentKey(frags):
+  # all viral fragments of a read name (i.e. both mates of a pair)
+  return (frags[0].cbc, tuple(sorted((f.seqname, f.startBp, f.endBp) for f in frags)))
+
+
+def groupByReadname(frags):
+  groups = OrderedDict()
+  for frag in frags:
+    groups.setdefault(frag.readname, []).append(frag)
+
+  return groups
+
+
+class TopUp(object):
+  def __init__(self, outputDir, bamfile):
+    super().__init__()
+
+    # every top-up gets its own directory for the parsed BAMs and clip fasta files of
+    # the new reads. The manifest lists the BAMs merged into outputDir so far
+    self.topUpsDir = os.path.join(outputDir, "topUps")
+    self.manifest = []
+    if os.path.exists(os.path.join(self.topUpsDir, manifestName)):
+      with open(os.path.join(self.topUpsDir, manifestName), "r") as fhandle:
+        self.manifest = json.load(fhandle)
+
+    bamfile = os.path.abspath(bamfile) if bamfile != "-" else bamfile
+    if bamfile != "-" and bamfile in [entry["bamfile"] for entry in self.manifest]:
+      raise Exception("{} was already added to {}".format(bamfile, outputDir))
+
+    # parsed BAMs left in runDir by an interrupted top-up are reused, but only for the
+    # same BAM. A different BAM (or a stream, which can't be told apart) starts over
+    self.runDir = os.path.abspath(os.path.join(self.topUpsDir, "topUp{}".format(len(self.manifest) + 1)))
+    source = inputIdentity(bamfile) if bamfile != "-" else None
+    sourceFn = os.path.join(self.runDir, sourceName)
+
+    if os.path.exists(self.runDir) and (source is None or self.loadSource(sourceFn) != source):
+      if len(os.listdir(self.runDir)) != 0:
+        printRed("Removing files of an interrupted top-up of a different BAM (or a stream) from {}".format(self.runDir))
+      shutil.rmtree(self.runDir)
+
+    if not os.path.exists(self.runDir):
+      os.makedirs(self.runDir)
+
+    with open(sourceFn, "w") as fhandle:
+      json.dump(source, fhandle)
+
+    self.entry = {"bamfile": bamfile, "runDir": self.runDir}
+
+  def loadSource(self, fn):
+    if not os.path.exists(fn):
+      return None
+
+    with open(fn, "r") as fhandle:
+      return json.load(fhandle)
+
+  def merge(self, compiled, fnIntSite, fnIntSiteFrag, fnViralFrags):
+    # read pairs never span two BAMs, so existing rows are kept as they are and only the
+    # new reads are checked against them: by read name and by fragment (same cell and
+    # coordinates, i.e. a PCR duplicate sequenced again)
+    merged = importCompiledDataset(fnIntSite, fnIntSiteFrag, fnViralFrags)
+
+    readnames = set(x.proviralFragment.readname for x in merged.integrationSites)
+    readnames.update(frag.readname for frag in merged.viralFrags)
+    siteKeys = set(siteKey(x) for x in merged.integrationSites)
+    fragmentKeys = set(fragmentKey(frags) for frags in groupByReadname(merged.viralFrags).values())
+
+    counts = {"integrationSites": 0, "viralFrags": 0, "duplicateReadnames": 0, "duplicateFragments": 0}
+
+    for x in compiled.integrationSites:
+      if x.proviralFragment.readname in readnames:
+        counts["duplicateReadnames"] += 1
+      elif siteKey(x) in siteKeys:
+        counts["duplicateFragments"] += 1
+      else:
+        merged.integrationSites.append(x)
+        counts["integrationSites"] += 1
+
+    for readname, frags in groupByReadname(compiled.viralFrags).items():
+      if readname in readnames:
+        counts["duplicateReadnames"] += len(frags)
+      elif fragmentKey(frags) in fragmentKeys:
+        counts["duplicateFragments"] += len(frags)
+      else:
+        for frag in frags:
+          merged.addViralFrag(frag)
+        counts["viralFrags"] += len(frags)
+
+    self.entry.update(counts)
+    return merged
+
+  def finish(self):
+    self.entry["added"] = datetime.now().isoformat(timespec = "seconds")
+    self.manifest.append(self.entry)
+
+    fn = os.path.join(self.topUpsDir, manifestName)
+    with open(fn + ".tmp", "w") as fhandle:
+      json.dump(self.manifest, fhandle, indent = 2)
+    os.replace(fn + ".tmp", fn)
@@ -0,0 +1,211 @@
+import random
+import pysam
+from collections import defaultdict
+from Bio.Seq import Seq
+from scripts.adapters import adapterReadThrough
+
+# a random host chromosome and provirus. The 5' and 3' LTRs are the same sequence, as
+# in a real provirus
+hostLen = 200000
+viralLen = 9700
+LTRLen = 634
+LTRpositions = "1,{},{},{}".format(LTRLen, viralLen - LTRLen + 1, viralLen)
+readLen = 50
+barcode = "AAACGAACAGGCTAGC-1"
+
+complement = str.maketrans("ACGT", "TGCA")
+
+
+def revComp(seq):
+  return seq.translate(complement)[::-1]
+
+
+class SyntheticSample(object):
+  def __init__(self, seed = 1):
+    super().__init__()
+
+    self.random = random.Random(seed)
+    ltr = self.randomSeq(LTRLen)
+    self.host = self.randomSeq(hostLen)
+    self.viral = ltr + self.randomSeq(viralLen - 2 * LTRLen) + ltr
+
+    self.header = pysam.AlignmentHeader.from_dict({
+      "HD": {"VN": "1.6", "SO": "unsorted"},
+      "SQ": [{"SN": "chr1", "LN": hostLen}, {"SN": "chrHIV", "LN": viralLen}]})
+    self.reads = []
+
+  def randomSeq(self, n):
+    return "".join(self.random.choice("ACGT") for i in range(n))
+
+  def proviralSeqs(self):
+    proviralSeqs = defaultdict(lambda: [])
+    proviralSeqs["chrHIV"].append(Seq(self.viral))
+    return proviralSeqs
+
+  def writeFasta(self, fn):
+    with open(fn, "w") as fhandle:
+      fhandle.write(">chrHIV\n{}\n".format(self.viral))
+
+  def makeRead(self, name, tid, pos, cigar, seq, read1, reverse, mateTid, matePos, mateReverse, flags = 2, cb = barcode):
+    read = pysam.AlignedSegment(self.header)
+    read.query_name = name
+    read.flag = 1 | flags | (64 if read1 else 128) | (16 if reverse else 0) | (32 if mateReverse else 0)
+    read.reference_id = tid
+    read.reference_start = pos
+    read.mapping_quality = 60
+    read.cigarstring = cigar
+    read.next_reference_id = mateTid
+    read.next_reference_start = matePos
+    read.query_sequence = seq
+    read.query_qualities = pysam.qualitystring_to_array("E" * len(seq))
+    if cb is not None:
+      read.set_tag("CB", cb)
+
+    return read
+
+  def hostPair(self, name, pos, clip1 = None, clip2 = None, mateOffset = 150, cb = barcode):
+    # read 1 on the forward strand at pos with an optional 3' soft clip, read 2 on the
+    # reverse strand with an optional 5' soft clip. Clips replace the end of the read
+    reads = []
+    for i, (clip, start, reverse) in enumerate([(clip1, pos, False), (clip2, pos + mateOffset, True)]):
+      clipLen = len(clip) if clip is not None else 0
+      if i == 0:
+        seq = self.host[start:start + readLen - clipLen] + (clip or "")
+        cigar = "{}M{}S".format(readLen - clipLen, clipLen) if clipLen else "{}M".format(readLen)
+        alignedStart = start
+      else:
+        seq = (clip or "") + self.host[start + clipLen:start + readLen]
+        cigar = "{}S{}M".format(clipLen, readLen - clipLen) if clipLen else "{}M".format(readLen)
+        alignedStart = start + clipLen
+
+      reads.append((seq, cigar, alignedStart, reverse))
+
+    return self.addPair(name, 0, reads, cb = cb)
+
+  def viralPair(self, name, pos, mateOffset = 150, cb = barcode):
+    reads = [(self.viral[pos:pos + readLen], "{}M".format(readLen), pos, False),
+      (self.viral[pos + mateOffset:pos + mateOffset + readLen], "{}M".format(readLen), pos + mateOffset, True)]
+    return self.addPair(name, 1, reads, cb = cb)
+
+  def addPair(self, name, tid, reads, cb = barcode):
+    (seq1, cigar1, pos1, rev1), (seq2, cigar2, pos2, rev2) = reads
+    pair = [
+      self.makeRead(name, tid, pos1, cigar1, seq1, True, rev1, tid, pos2, rev2, cb = cb),
+      self.makeRead(name, tid, pos2, cigar2, seq2, False, rev2, tid, pos1, rev1, cb = cb)]
+    pair[0].set_tag("MC", cigar2)
+    pair[1].set_tag("MC", cigar1)
+    self.reads.extend(pair)
+    return pair
+
+  def copyPair(self, pair, name):
+    # the same fragment under another read name, as a PCR duplicate
+    copies = [pysam.AlignedSegment.fromstring(read.to_string(), self.header) for read in pair]
+    for read in copies:
+      read.query_name = name
+    self.reads.extend(copies)
+    return copies
+
+  def chimericPair(self, name, hostPos, viralPos, cb = barcode):
+    # read 1 on the host, read 2 on the provirus: a candidate of the unmapped read path
+    seq1, seq2 = self.host[hostPos:hostPos + readLen], self.viral[viralPos:viralPos + readLen]
+    cigar = "{}M".format(readLen)
+    pair = [
+      self.makeRead(name, 0, hostPos, cigar, seq1, True, False, 1, viralPos, True, flags = 0, cb = cb),
+      self.makeRead(name, 1, viralPos, cigar, seq2, False, True, 0, hostPos, False, flags = 0, cb = cb)]
+    pair[0].set_tag("MC", cigar)
+    pair[1].set_tag("MC", cigar)
+    self.reads.extend(pair)
+    return pair
+
+  def ltrStart(self, n):
+    # first n bp of the 5' LTR, a 3' clip of a read at a 5' integration junction
+    return self.viral[:n]
+
+  def ltrEnd(self, n):
+    # last n bp of the 3' LTR, a 5' clip of a read at a 3' integration junction
+    return self.viral[-n:]
+
+  def writeBam(self, fn, reads = None):
+    with pysam.AlignmentFile(fn, "wb", header = self.header) as bam:
+      for read in (reads if reads is not None else self.reads):
+        bam.write(read)
+
+    return fn
+
+
+def hostChimeraSample(seed = 1, nPairs = 300):
+  # host read pairs with LTR clips of 8 to 20 bp on one mate, and on the other mate no
+  # clip, a random clip or an LTR clip of 8 to 20 bp
+  sample = SyntheticSample(seed)
+  for i in range(nPairs):
+    pos = 1000 + i * 500
+    clip1 = sample.ltrStart(sample.random.randint(8, 20))
+    kind = sample.random.choice(["none", "none", "random", "ltr"])
+    clipLen = sample.random.randint(8, 20)
+    clip2 = None if kind == "none" else sample.randomSeq(clipLen) if kind == "random" else sample.ltrEnd(clipLen)
+    pair = sample.hostPair("h{}".format(i), pos, clip1, clip2)
+
+    # mates in either order in the BAM
+    if sample.random.random() < 0.5:
+      sample.reads[-2:] = pair[::-1]
+
+  return sample
+
+
+def mixedSample(seed = 1, nPairs = 100):
+  # host chimera pairs (some with adapter read-through clips), viral pairs and host/viral
+  # pairs, with the reads shuffled so mates are far apart as in a coordinate sorted BAM
+  sample = hostChimeraSample(seed, nPairs = nPairs)
+  for i in range(nPairs // 5):
+    # a 5' clip of the reverse mate holds the adapter reverse complemented
+    sample.hostPair("a{}".format(i), 120000 + 500 * i, sample.ltrStart(15), revComp(adapterReadThrough["nexteraRead1"][:15]))
+  for i in range(nPairs):
+    sample.viralPair("v{}".format(i), sample.random.randrange(viralLen - 300))
+  for i in range(nPairs // 2):
+    sample.chimericPair("c{}".format(i), 150000 + 300 * i, sample.random.randrange(viralLen - readLen))
+
+  sample.random.shuffle(sample.reads)
+  return sample
+
+
+def readBam(fn):
+  with pysam.AlignmentFile(fn, "rb") as bam:
+    return [read.to_string() for read in bam]
+
+
+def parseBam(bamFn, tmpDir, memoryLimit = None, **kwargs):
+  # parseCellrangerBam as main.py calls it. Returns the read groups as
+  # {group: {query name: [reads as SAM lines]}}
+  from scripts.pipeline import parseCellrangerBam
+  from scripts.nameGrouping import ExternalNameGrouper
+
+  groupers = [ExternalNameGrouper(memoryLimit = memoryLimit, tmpDir = str(tmpDir)) for i in range(3)]
+  bam = parseCellrangerBam(bamFn, ["chrHIV"], *groupers, **kwargs)
+  bam.close()
+
+  groups = {}
+  for key, grouper in zip(["proviralReads", "hostWithPotentialChimera", "umappedWithPotentialChimera"], groupers):
+    grouper.finalize()
+    groups[key] = {name: [read.to_string() for read in reads] for name, reads in grouper.items()}
+    grouper.close()
+
+  return groups
+
+
+class Interrupted(Exception):
+  pass
+
+
+def interruptAfterCheckpoints(monkeypatch, n):
+  # the parse stops right after its n-th checkpoint, as if the job was killed
+  from scripts.checkpoint import ScanCheckpointer
+  checkpoint = ScanCheckpointer.checkpoint
+  calls = []
+
+  def interruptingCheckpoint(self, readIndex, keys):
+    checkpoint(self, readIndex, keys)
+    calls.append(readIndex)
+    if len(calls) == n:
+      raise Interrupted()
+
+  monkeypatch.setattr(ScanCheckpointer, "checkpoint", interruptingCheckpoint)
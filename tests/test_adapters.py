@@ -0,0 +1,51 @@
+from scripts.adapters import AdapterClipFilter, adapterReadThrough
+from scripts.pipeline import partitionReads, parseHostReadsWithPotentialChimera, parseLTRMatches
+from scripts.nameGrouping import ExternalNameGrouper
+from synthetic import mixedSample, revComp, LTRpositions
+
+
+def mismatch(seq, pos):
+  return seq[:pos] + ("A" if seq[pos] != "A" else "C") + seq[pos + 1:]
+
+
+def test_adapter_clips():
+  adapterFilter = AdapterClipFilter()
+  adapter = adapterReadThrough["nexteraRead2"]
+
+  # a 3' clip starts with the adapter, a 5' clip ends with its reverse complement
+  assert adapterFilter.isAdapter(adapter[:12], False)
+  assert adapterFilter.isAdapter(adapter[:25], False)
+  assert adapterFilter.isAdapter(revComp(adapter[:12]), True)
+  assert not adapterFilter.isAdapter(adapter[:12], True)
+
+  # up to one mismatch, and at least 10 bp
+  assert adapterFilter.isAdapter(mismatch(adapter[:15], 7), False)
+  assert not adapterFilter.isAdapter(mismatch(mismatch(adapter[:15], 7), 3), False)
+  assert not adapterFilter.isAdapter(adapter[:9], False)
+  assert adapterFilter.rejected == 4
+
+
+def hostSites(sample, tmp_path, adapterFilter):
+  proviralSeqs = sample.proviralSeqs()
+  potentialLTR = parseLTRMatches(LTRpositions, proviralSeqs, position = True)
+  groupers = [ExternalNameGrouper(tmpDir = str(tmp_path)) for i in range(3)]
+  proviralReads, hostReads, unmappedReads = groupers
+
+  partitionReads(sample.reads, ["chrHIV"], proviralReads, hostReads, unmappedReads, adapterFilter = adapterFilter)
+  chimeras = parseHostReadsWithPotentialChimera(hostReads, potentialLTR, proviralSeqs, 11)
+  for grouper in groupers:
+    grouper.close()
+
+  return set((x.read.query_name, *x.intsite.returnAsList()) for hits in chimeras for x in hits["plus"] + hits["minus"])
+
+
+def test_adapter_mates_leave_sites_unchanged(tmp_path):
+  # a pair with an LTR clip on one mate and an adapter clip on the other has two clipped
+  # reads, so it gives no site with or without the adapter filter
+  sample = mixedSample(seed = 3)
+  adapterFilter = AdapterClipFilter()
+  sites = hostSites(sample, tmp_path, adapterFilter)
+
+  assert adapterFilter.rejected == 20
+  assert len(sites) != 0 and not any(name.startswith("a") for name, *site in sites)
+  assert sites == hostSites(sample, tmp_path, None)
@@ -0,0 +1,56 @@
+import pytest
+from scripts.pipeline import parseLTRMatches
+from scripts.adapters import AdapterClipFilter
+from synthetic import mixedSample, parseBam, readBam, interruptAfterCheckpoints, Interrupted, LTRpositions
+
+groupKeys = ["proviralReads", "hostWithPotentialChimera", "umappedWithPotentialChimera"]
+
+
+def parseSample(sample, bamFn, outDir, **kwargs):
+  # groups and intermediate BAMs of a parse with the LTR prescreen and adapter filter
+  outDir.mkdir()
+  teeFNs = {k: str(outDir / (k + ".bam")) for k in groupKeys}
+  groups = parseBam(bamFn, outDir / "tmp", teeFNs = teeFNs,
+    proviralLTRSeqs = parseLTRMatches(LTRpositions, sample.proviralSeqs(), position = True),
+    adapterFilter = AdapterClipFilter(), LTRClipLens = [11], **kwargs)
+
+  return groups, {k: readBam(fn) for k, fn in teeFNs.items()}
+
+
+@pytest.mark.parametrize("interruptions", [[1], [1, 1]])
+def test_resume_matches_uninterrupted_parse(tmp_path, monkeypatch, interruptions):
+  sample = mixedSample()
+  bamFn = sample.writeBam(str(tmp_path / "sample.bam"))
+  expectedGroups, expectedBams = parseSample(sample, bamFn, tmp_path / "full")
+  assert all(len(expectedGroups[k]) != 0 for k in groupKeys)
+
+  checkpointDir = str(tmp_path / "checkpoint")
+  for i, n in enumerate(interruptions):
+    interruptAfterCheckpoints(monkeypatch, n)
+    with pytest.raises(Interrupted):
+      parseSample(sample, bamFn, tmp_path / "interrupted{}".format(i), checkpointDir = checkpointDir, checkpointEvery = 150)
+    monkeypatch.undo()
+
+  groups, bams = parseSample(sample, bamFn, tmp_path / "resumed", checkpointDir = checkpointDir, checkpointEvery = 150)
+  assert groups == expectedGroups
+  # the resumed intermediate BAMs hold the same reads, in the same order
+  assert bams == expectedBams
+
+
+def test_changed_LTRs_invalidate_checkpoint(tmp_path, monkeypatch):
+  sample = mixedSample()
+  bamFn = sample.writeBam(str(tmp_path / "sample.bam"))
+  checkpointDir = str(tmp_path / "checkpoint")
+
+  interruptAfterCheckpoints(monkeypatch, 2)
+  with pytest.raises(Interrupted):
+    parseSample(sample, bamFn, tmp_path / "interrupted", checkpointDir = checkpointDir, checkpointEvery = 150)
+  monkeypatch.undo()
+
+  # other LTR positions: the parse starts over instead of resuming
+  otherLTRs = parseLTRMatches("1,600,9101,9700", sample.proviralSeqs(), position = True)
+  restarted = parseBam(bamFn, tmp_path / "restarted", proviralLTRSeqs = otherLTRs, adapterFilter = AdapterClipFilter(),
+    LTRClipLens = [11], checkpointDir = checkpointDir, checkpointEvery = 150)
+  expected = parseBam(bamFn, tmp_path / "expected", proviralLTRSeqs = otherLTRs, adapterFilter = AdapterClipFilter(),
+    LTRClipLens = [11])
+  assert restarted == expected
@@ -0,0 +1,26 @@
+from scripts.outputModules import CompiledDataset
+
+
+def coverageDataset():
+  dataset = CompiledDataset()
+  # (seqname, startBp, endBp, cbc, readname, usingAlt), endBp inclusive
+  dataset.addViralFragFields(("chrHIV", 0, 9, "AAA-1", "r1", False))
+  dataset.addViralFragFields(("chrHIV", 5, 14, "CCC-1", "r2", False))
+  # alt align past the end of a 20 bp sequence
+  dataset.addViralFragFields(("chrHIV", 15, 24, "AAA-1", "r3", True))
+  return dataset
+
+
+def test_coverage_past_sequence_end(capsys):
+  coverage = coverageDataset().coverageArrays(seqLengths = {"chrHIV": 20})["all"]["chrHIV"]
+  assert list(coverage) == [1] * 5 + [2] * 5 + [1] * 5 + [1] * 10
+  assert "past the sequence length" in capsys.readouterr().out
+
+
+def test_coverage_padded_to_sequence_length():
+  dataset = coverageDataset()
+  coverage = dataset.coverageArrays(seqLengths = {"chrHIV": 40})["all"]["chrHIV"]
+  assert len(coverage) == 40 and coverage[24] == 1 and coverage[25:].sum() == 0
+
+  groups = dataset.coverageArrays(seqLengths = {"chrHIV": 40}, barcodeGroups = {"AAA-1": "a"})
+  assert list(groups) == ["a"] and groups["a"]["chrHIV"].sum() == 20
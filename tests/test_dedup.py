@@ -0,0 +1,55 @@
+import pytest
+from scripts.dedup import FragmentDeduplicator, fragmentKey
+from synthetic import SyntheticSample, parseBam, interruptAfterCheckpoints, Interrupted
+
+
+def dedupSample():
+  # viral pairs, every 5th sequenced again under another name
+  sample = SyntheticSample(5)
+  for i in range(200):
+    pair = sample.viralPair("v{}".format(i), 1000 + 20 * i)
+    if i % 5 == 0:
+      sample.copyPair(pair, "d{}".format(i))
+
+  return sample
+
+
+def test_fragment_key():
+  sample = SyntheticSample()
+  pair = sample.viralPair("a", 1000)
+  copy = sample.copyPair(pair, "b")
+  # same start, but the reverse mate ends 5 bp earlier
+  shorter = sample.viralPair("c", 1000)
+  shorter[1].cigarstring = "45M5S"
+  shorter[0].set_tag("MC", "45M5S")
+
+  assert fragmentKey(pair[0]) == fragmentKey(pair[1])
+  assert fragmentKey(pair[0]) == fragmentKey(copy[1])
+  assert fragmentKey(shorter[0]) == fragmentKey(shorter[1])
+  assert fragmentKey(shorter[0]) != fragmentKey(pair[0])
+
+  tid, start, endTid, end, read1Reverse, cb = fragmentKey(pair[0])
+  assert (tid, start, endTid, end, read1Reverse) == (1, 1000, 1, pair[1].reference_end, False)
+
+  deduplicator = FragmentDeduplicator()
+  assert [deduplicator.isDuplicate(read) for read in pair + copy + shorter] == [False, False, True, True, False, False]
+  assert deduplicator.duplicates == 2
+
+
+def test_duplicates_survive_resume(tmp_path, monkeypatch):
+  sample = dedupSample()
+  bamFn = sample.writeBam(str(tmp_path / "sample.bam"))
+
+  full = FragmentDeduplicator()
+  expected = parseBam(bamFn, tmp_path / "full", deduplicator = full)
+  assert full.duplicates == 2 * 40
+
+  checkpointDir = str(tmp_path / "checkpoint")
+  interruptAfterCheckpoints(monkeypatch, 3)
+  with pytest.raises(Interrupted):
+    parseBam(bamFn, tmp_path / "first", deduplicator = FragmentDeduplicator(), checkpointDir = checkpointDir, checkpointEvery = 100)
+  monkeypatch.undo()
+
+  resumed = FragmentDeduplicator()
+  assert parseBam(bamFn, tmp_path / "second", deduplicator = resumed, checkpointDir = checkpointDir, checkpointEvery = 100) == expected
+  assert resumed.duplicates == full.duplicates
@@ -0,0 +1,36 @@
+import os
+import pytest
+from scripts.hostIndex import HostKmerIndex, buildHostKmerIndex, hostKmerIndexExists, buildBytesPerBase
+from synthetic import SyntheticSample, hostLen, revComp
+
+
+@pytest.fixture
+def hostFasta(tmp_path):
+  sample = SyntheticSample()
+  fn = str(tmp_path / "host.fa")
+  with open(fn, "w") as fhandle:
+    fhandle.write(">chr1\n{}\n".format(sample.host))
+
+  return sample, fn
+
+
+def test_place_exact_clips(hostFasta, tmp_path):
+  sample, fn = hostFasta
+  indexDir = str(tmp_path / "index")
+  buildHostKmerIndex(fn, indexDir)
+  assert hostKmerIndexExists(indexDir)
+
+  index = HostKmerIndex(indexDir)
+  clip = sample.host[5000:5030]
+  assert index.place(clip, minScore = 17, seedLen = 15) == [("chr1", 5000, False)]
+  assert index.place(revComp(clip), minScore = 17, seedLen = 15) == [("chr1", 5000, True)]
+  # shorter than k, left to bwa
+  assert index.place(clip[:12], minScore = 17, seedLen = 15) is None
+
+
+def test_build_checks_memory(hostFasta, tmp_path):
+  sample, fn = hostFasta
+  indexDir = str(tmp_path / "index")
+  with pytest.raises(Exception, match = "needs about"):
+    buildHostKmerIndex(fn, indexDir, memoryLimit = hostLen * buildBytesPerBase // 2)
+  assert not os.path.exists(indexDir)
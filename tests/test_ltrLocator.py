@@ -0,0 +1,52 @@
+import random
+import pytest
+from collections import defaultdict
+from Bio.Seq import Seq
+from scripts.ltrLocator import locateLTRs, loadLTRReference
+from scripts.api import defaultLTRReference
+
+
+def mutate(seq, pos):
+  return seq[:pos] + {"A": "C", "C": "G", "G": "T", "T": "A"}[seq[pos]] + seq[pos + 1:]
+
+
+def divergentProvirus(seed = 1):
+  # HXB2 LTRs with mismatches near both LTR edges (so there are no seeds at the
+  # edges) and an indel between the edge and the first seed
+  rand = random.Random(seed)
+  ltr = loadLTRReference(defaultLTRReference)
+  ltrLen = len(ltr)
+
+  ltr5 = ltr
+  for pos in [4, 9, 16]:
+    ltr5 = mutate(ltr5, pos)
+  ltr5 = ltr5[:12] + "GTA" + ltr5[12:]
+
+  ltr3 = ltr
+  for pos in [ltrLen - 5, ltrLen - 8, ltrLen - 15]:
+    ltr3 = mutate(ltr3, pos)
+  ltr3 = ltr3[:ltrLen - 12] + ltr3[ltrLen - 9:]
+
+  flank = "".join(rand.choice("ACGT") for i in range(20))
+  body = "".join(rand.choice("ACGT") for i in range(8000))
+  seq = flank + ltr5 + body + ltr3 + flank
+
+  start5 = len(flank) + 1
+  end5 = len(flank) + len(ltr5)
+  start3 = end5 + len(body) + 1
+  end3 = start3 + len(ltr3) - 1
+  return seq, (start5, end5, start3, end3)
+
+
+def test_LTR_edges_with_indels():
+  seq, (start5, end5, start3, end3) = divergentProvirus()
+  proviralSeqs = defaultdict(lambda: [])
+  proviralSeqs["plus"].append(Seq(seq))
+  proviralSeqs["minus"].append(Seq(seq).reverse_complement())
+
+  matches = sorted(locateLTRs(proviralSeqs, defaultLTRReference))
+  slen = len(seq)
+  assert matches == sorted([
+    ("plus", start5, end5), ("plus", start3, end3),
+    # reverse strand hits are reported with start > end, like blastn
+    ("minus", slen - start3 + 1, slen - end3 + 1), ("minus", slen - start5 + 1, slen - end5 + 1)])
@@ -0,0 +1,37 @@
+import os
+from scripts.nameGrouping import ExternalNameGrouper, estimateReadBytes
+from synthetic import mixedSample, parseBam
+
+
+def groupReads(reads, tmpDir, memoryLimit = None):
+  grouper = ExternalNameGrouper(memoryLimit = memoryLimit, tmpDir = str(tmpDir))
+  for read in reads:
+    grouper.addRead(read)
+  return grouper
+
+
+def test_spilled_groups_match_in_memory(tmp_path):
+  reads = mixedSample().reads
+  inMemory = groupReads(reads, tmp_path / "memory")
+  spilled = groupReads(reads, tmp_path / "spilled", memoryLimit = 40 * estimateReadBytes(reads[0]))
+  assert len(spilled.runs) > 5 and len(inMemory.runs) == 0
+
+  # same groups, with the mates of a pair in their input order. Merged groups come in
+  # name order
+  expected = {name: [read.to_string() for read in group] for name, group in inMemory.items()}
+  assert {name: [read.to_string() for read in group] for name, group in spilled.items()} == expected
+  assert len(spilled) == len(inMemory) == len(reads) // 2
+
+  names = [name for name, group in spilled.items()]
+  assert names == sorted(names)
+
+  # only the merged file is left once the runs are merged, and nothing after close
+  assert os.listdir(tmp_path / "spilled") == [os.path.basename(spilled.mergedFn)]
+  spilled.close()
+  assert os.listdir(tmp_path / "spilled") == []
+
+
+def test_parse_with_spills(tmp_path):
+  sample = mixedSample()
+  bamFn = sample.writeBam(str(tmp_path / "sample.bam"))
+  assert parseBam(bamFn, tmp_path / "spilled", memoryLimit = 20000) == parseBam(bamFn, tmp_path / "memory")
@@ -0,0 +1,84 @@
+import random
+from scripts.pipeline import parseProviralReads, checkProviralPairForHostClip, parseLTRMatches
+from scripts.proviralIndex import ProviralTidIndex
+from scripts.baseFunctions import getAltAlign
+from scripts.outputModules import CompiledDataset
+from synthetic import SyntheticSample, viralLen, readLen, LTRLen, LTRpositions
+
+
+def viralPairsWithAlts(nPairs = 2000, seed = 3):
+  # viral pairs, many near a provirus end and with soft clips, most with XA tags on
+  # other references and some with alt aligns on their own reference
+  sample = SyntheticSample(seed)
+  rand = random.Random(seed)
+  cigars = ["50M", "50M", "20S30M", "30M20S"]
+  for i in range(nPairs):
+    pos = rand.choice([0, 1, 2, viralLen - readLen - 1, viralLen - readLen]) if i % 4 == 0 else rand.randrange(viralLen - 200)
+    # the mate goes before a read near the provirus end, to stay on the reference
+    pair = sample.viralPair("v{}".format(i), pos, mateOffset = -150 if pos > viralLen - 250 else 150)
+    for read in pair:
+      seq, qualities = read.query_sequence, read.query_qualities
+      read.cigarstring = rand.choice(cigars)
+      read.query_sequence, read.query_qualities = seq, qualities
+      kind = rand.random()
+      if kind < 0.8:
+        alts = ["chrOther,+{},50M,0".format(read.reference_start + 1)]
+        if kind < 0.3:
+          alts.append("chrHIV,-{},{},1".format(rand.choice([1, 2, 3, viralLen - readLen]), rand.choice(cigars + ["10S30M10S"])))
+        elif kind < 0.35:
+          alts += ["chrHIV,+100,50M,1", "chrHIV,+{},30M20S,1".format(viralLen - readLen)]
+        read.set_tag("XA", ";".join(alts) + ";")
+
+  return sample
+
+
+def test_candidate_selection_keeps_every_chimera(tmp_path):
+  sample = viralPairsWithAlts()
+  proviralSeqs = sample.proviralSeqs()
+  readPairs = {}
+  for read in sample.reads:
+    readPairs.setdefault(read.query_name, []).append(read)
+
+  result = parseProviralReads(readPairs, proviralSeqs, str(tmp_path / "clips.fa"))
+
+  # every pair through the per-pair check, as before candidates were selected
+  expected = set()
+  for name, (read1, read2) in readPairs.items():
+    if read1.reference_start > read2.reference_start:
+      read1, read2 = read2, read1
+    if read1.cigarstring.count("S") + read2.cigarstring.count("S") > 1:
+      continue
+    if checkProviralPairForHostClip(read1, read2, getAltAlign(read1), getAltAlign(read2), viralLen, proviralSeqs) is not None:
+      expected.add(name)
+
+  assert len(expected) != 0
+  assert set(result["potentialValidChimeras"]) == expected
+
+  # plain pairs are kept as fields, and export like fragments built from the reads
+  nPlain = sum(1 for x in result["validReads"].values() if isinstance(x, tuple))
+  assert 0 < nPlain < len(readPairs)
+
+  dataset = CompiledDataset(validViralReads = result["validReads"])
+  rows = {(row[4], row[2]): row for row in dataset.collatedViralFrags}
+  for frag in dataset.viralFrags:
+    assert frag.returnAsList() == rows[(frag.readname, frag.startBp)]
+  assert len(dataset.viralFrags) == 2 * len(readPairs)
+
+
+def test_tid_index_resolves_references_and_LTRs():
+  sample = SyntheticSample()
+  proviralSeqs = sample.proviralSeqs()
+  potentialLTR = parseLTRMatches(LTRpositions, proviralSeqs, position = True)
+  read = sample.viralPair("v0", 100)[0]
+  read.set_tag("XA", "chr1,+100,50M,0;chrHIV,-9000,50M,1;chrMissing,+5,50M,2;")
+
+  tidIndex = ProviralTidIndex(sample.header, ["chrHIV", "chrOther"], proviralSeqs, potentialLTR)
+  assert tidIndex.isProviral == [False, True, False]
+  assert tidIndex.refLengths[1] == viralLen
+  assert tidIndex.missing == ["chrOther"]
+  assert tidIndex.ltr5p[1] == (1, LTRLen, LTRLen)
+  assert tidIndex.ltr3p[1] == (viralLen - LTRLen + 1, viralLen, LTRLen)
+  assert tidIndex.ltr5p[0] is None and tidIndex.ltr3p[-1] is None
+
+  assert [alt[0] for alt in tidIndex.sameReferenceAlts(read, getAltAlign(read))] == ["chrHIV"]
+  assert tidIndex.sameReferenceAlts(read, None) == []
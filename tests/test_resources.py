@@ -0,0 +1,30 @@
+import pytest
+from scripts.resources import ResourceBudget, availableThreads
+
+
+def poolSize(threads):
+  # threads pysam starts for a count: none below 2
+  return threads if threads > 1 else 0
+
+
+@pytest.mark.parametrize("threads", list(range(1, 41)))
+@pytest.mark.parametrize("nOutputs", list(range(0, 8)))
+def test_parse_threads_stay_in_budget(threads, nOutputs):
+  decompression, compression = ResourceBudget(threads = threads).parseThreads(nOutputs = nOutputs)
+  # the parsing thread, the decompression pool and one compression pool per output
+  assert 1 + poolSize(decompression) + nOutputs * poolSize(compression) <= threads
+
+
+@pytest.mark.parametrize("threads", list(range(1, 41)))
+def test_stage_threads_stay_in_budget(threads):
+  resources = ResourceBudget(threads = threads)
+  workers = resources.stageWorkers(nStages = 3)
+  if workers <= 1:
+    assert resources.alignerThreads() <= threads
+  else:
+    assert workers + workers * resources.alignerThreads(concurrentAligners = workers, workerProcesses = workers) <= threads
+
+
+def test_default_is_available_cpus():
+  assert ResourceBudget().threads == availableThreads()
+  assert ResourceBudget().decompressionThreads() == max(1, availableThreads() - 1)
@@ -0,0 +1,77 @@
+import os
+import sys
+import subprocess
+import pytest
+from scripts.scheduler import StageScheduler
+from synthetic import mixedSample, LTRpositions
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def square(x):
+  return {"value": x * x, "pid": os.getpid()}
+
+
+def add(a, b):
+  return a + b
+
+
+def fail():
+  raise ValueError("stage failed")
+
+
+def addStages(scheduler):
+  # two independent stages, one on a thread, and a stage depending on both
+  scheduler.addStage("a", square, kwargs = {"x": 3})
+  scheduler.addStage("b", square, kwargs = {"x": 4})
+  scheduler.addStage("sum", add, inProcess = False, deps = {"a": ("a", "value"), "b": ("b", "value")})
+  scheduler.addStage("last", add, kwargs = {"b": 1}, deps = {"a": "sum"})
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_stages_run_after_their_dependencies(workers):
+  progress = []
+  scheduler = StageScheduler(workers = workers, progress = lambda running, done, total: progress.append((running, done, total)))
+  addStages(scheduler)
+  results = scheduler.run()
+
+  assert results["sum"] == 25 and results["last"] == 26
+  assert progress[-1] == ([], 4, 4)
+  # CPU bound stages run in worker processes unless the scheduler is serial
+  assert (results["a"]["pid"] != os.getpid()) == (workers > 1)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_stage_errors(workers):
+  scheduler = StageScheduler(workers = workers)
+  scheduler.addStage("missing", add, deps = {"a": "unknown", "b": "unknown"})
+  with pytest.raises(Exception, match = "can't be resolved"):
+    scheduler.run()
+
+  scheduler = StageScheduler(workers = workers)
+  scheduler.addStage("fail", fail)
+  with pytest.raises(ValueError, match = "stage failed"):
+    scheduler.run()
+
+
+def test_concurrent_stages_match_serial(tmp_path):
+  # main.py with concurrent and serial stages, on a sample without clips for bwa
+  sample = mixedSample(seed = 4)
+  bamFn = sample.writeBam(str(tmp_path / "sample.bam"))
+  viralFn = str(tmp_path / "viral.fa")
+  sample.writeFasta(viralFn)
+
+  outputs = {}
+  for key, args in [("serial", ["--threads=2", "--serialStages"]), ("concurrent", ["--threads=6"])]:
+    outDir = tmp_path / key
+    subprocess.run([sys.executable, "main.py", "--bamfile=" + bamFn, "--outputDir=" + str(outDir), "--viralFasta=" + viralFn,
+      "--LTRpositions=" + LTRpositions, "--hostGenomeIndex=" + viralFn, "--skipIntermediateBams", *args],
+      cwd = repoDir, capture_output = True, text = True, check = True)
+
+    outputs[key] = {}
+    for fn in ["integrationSites.tsv", "integrationSites_viralFrags.tsv", "viralFrags.tsv", "viralCoverage.bedGraph"]:
+      with open(outDir / fn, "r") as fhandle:
+        outputs[key][fn] = fhandle.read()
+
+  assert len(outputs["serial"]["integrationSites.tsv"].splitlines()) > 1
+  assert outputs["concurrent"] == outputs["serial"]
@@ -0,0 +1,42 @@
+import os
+import sys
+import subprocess
+import pytest
+from scripts.siteDatabase import SiteDatabase
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def querySites(*args):
+  result = subprocess.run([sys.executable, "-m", "scripts.siteDatabase", *args],
+    cwd = repoDir, capture_output = True, text = True, check = True)
+  return [line.split("\t") for line in result.stdout.splitlines()]
+
+
+@pytest.fixture
+def siteDb(tmp_path):
+  fn = str(tmp_path / "sites.db")
+  db = SiteDatabase(fn)
+  db.addSample("s1", "donor1", {("chr8", "+", 1000): (5, 2), ("chr1", "-", 500): (3, 1)})
+  db.addSample("s2", "donor1", {("chr8", "-", 1004): (2, 2)})
+  db.addSample("s3", "donor2", {("chr8", "+", 1008): (1, 1)})
+  db.close()
+  return fn
+
+
+def test_sites_near(siteDb):
+  rows = querySites(siteDb, "near", "chr8", "1002", "--window", "3")
+  assert rows[0] == ["sample", "donor", "chr", "orient", "pos", "reads", "cells"]
+  assert rows[1:] == [["s1", "donor1", "chr8", "+", "1000", "5", "2"], ["s2", "donor1", "chr8", "-", "1004", "2", "2"]]
+
+
+def test_shared_sites(siteDb):
+  assert [row[:2] for row in querySites(siteDb, "shared", "--window", "5")[1:]] == [["s1", "s2"], ["s2", "s3"]]
+  assert [row[:2] for row in querySites(siteDb, "shared", "--window", "10")[1:]] == [["s1", "s2"], ["s1", "s3"], ["s2", "s3"]]
+  assert [row[:2] for row in querySites(siteDb, "shared", "--window", "10", "--donor", "donor1")[1:]] == [["s1", "s2"]]
+
+
+def test_missing_database(tmp_path):
+  with pytest.raises(subprocess.CalledProcessError):
+    querySites(str(tmp_path / "missing.db"), "samples")
+  assert not os.path.exists(tmp_path / "missing.db")
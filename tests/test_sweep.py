@@ -0,0 +1,57 @@
+import pytest
+from scripts.pipeline import partitionReads, parseHostReadsWithPotentialChimera, parseLTRMatches
+from scripts.nameGrouping import ExternalNameGrouper
+from scripts.ltrPrescreen import LTRKmerPrescreen
+from scripts.adapters import AdapterClipFilter
+from scripts.hostMates import HostMateTracker
+from synthetic import hostChimeraSample, LTRpositions
+
+LTRClipLens = [8, 11, 14]
+
+
+def hostSites(sample, tmp_path, softClipMinLen, dropClipLen, settings):
+  # parse as main.py does for the given LTRClipLens, then run the host chimera analysis of
+  # each setting. Returns {LTRClipLen: set of (readname, chr, orient, pos)}
+  proviralSeqs = sample.proviralSeqs()
+  potentialLTR = parseLTRMatches(LTRpositions, proviralSeqs, position = True)
+  groupers = [ExternalNameGrouper(tmpDir = str(tmp_path)) for i in range(3)]
+  proviralReads, hostReads, unmappedReads = groupers
+
+  partitionReads(sample.reads, ["chrHIV"], proviralReads, hostReads, unmappedReads,
+    softClipMinLen = softClipMinLen,
+    ltrPrescreen = LTRKmerPrescreen(potentialLTR, k = softClipMinLen),
+    adapterFilter = AdapterClipFilter(),
+    hostMates = HostMateTracker(softClipMinLen, dropClipLen = dropClipLen))
+  hostReads.finalize()
+
+  sites = {}
+  for LTRClipLen in settings:
+    chimeras = parseHostReadsWithPotentialChimera(hostReads, potentialLTR, proviralSeqs, LTRClipLen)
+    sites[LTRClipLen] = set((x.read.query_name, *x.intsite.returnAsList())
+      for hits in chimeras for x in hits["plus"] + hits["minus"])
+
+  for grouper in groupers:
+    grouper.close()
+
+  return sites
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_sweep_matches_standalone(tmp_path, seed):
+  sample = hostChimeraSample(seed)
+  swept = hostSites(sample, tmp_path, min([11] + LTRClipLens), max(LTRClipLens), LTRClipLens)
+
+  for LTRClipLen in LTRClipLens:
+    standalone = hostSites(sample, tmp_path, min(11, LTRClipLen), LTRClipLen, [LTRClipLen])[LTRClipLen]
+    assert len(standalone) != 0
+    assert swept[LTRClipLen] == standalone
+
+
+def test_short_mate_clip_only_counts_at_its_length(tmp_path):
+  # an 8 bp clip on the mate rules the pair out at LTRClipLen 8, but not at 11
+  sample = hostChimeraSample(nPairs = 0)
+  sample.hostPair("h0", 1000, sample.ltrStart(20), sample.randomSeq(8))
+
+  swept = hostSites(sample, tmp_path, 8, 11, [8, 11])
+  assert swept[8] == set()
+  assert [x[0] for x in swept[11]] == ["h0"]
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+from scripts.topUp import TopUp
+from synthetic import hostChimeraSample, viralLen, LTRpositions
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def runMain(sample, bamFn, outDir, *args):
+  # main.py on a sample without clips near the provirus ends, so bwa is never started
+  viralFn = os.path.join(os.path.dirname(bamFn), "viral.fa")
+  sample.writeFasta(viralFn)
+  subprocess.run([sys.executable, "main.py", "--bamfile=" + bamFn, "--outputDir=" + str(outDir),
+    "--viralFasta=" + viralFn, "--LTRpositions=" + LTRpositions, "--hostGenomeIndex=" + viralFn, "--threads=2", *args],
+    cwd = repoDir, capture_output = True, text = True, check = True)
+
+
+def readRows(outDir, fn):
+  with open(os.path.join(outDir, fn), "r") as fhandle:
+    lines = fhandle.read().splitlines()
+
+  return lines[0], sorted(lines[1:])
+
+
+def readnames(outDir, fn):
+  header, rows = readRows(outDir, fn)
+  column = header.split("\t").index("readname")
+  return [row.split("\t")[column] for row in rows]
+
+
+@pytest.fixture
+def topUpBams(tmp_path):
+  # a first BAM, a second BAM of the same library and a BAM of both without the reads
+  # the second one sequenced again
+  sample = hostChimeraSample(nPairs = 100)
+  pairs = {}
+  for i in range(60):
+    sample.viralPair("v{}".format(i), sample.random.randrange(700, viralLen - 900))
+  for read in sample.reads:
+    pairs.setdefault(read.query_name, []).append(read)
+
+  first = [name for name in pairs if name[1:].isdigit() and int(name[1:]) < (50 if name[0] == "h" else 30)]
+  second = [name for name in pairs if name not in first]
+  # the same fragments under new names, and a read name of the first BAM again
+  copies = sample.copyPair(pairs["h0"], "dh0") + sample.copyPair(pairs["v0"], "dv0")
+
+  fns = {}
+  for key, names, extra in [("first", first, []), ("second", second + ["v1"], copies), ("union", first + second, [])]:
+    fns[key] = sample.writeBam(str(tmp_path / (key + ".bam")), [read for name in names for read in pairs[name]] + extra)
+
+  return sample, fns
+
+
+def test_top_up_matches_single_run(tmp_path, topUpBams):
+  sample, fns = topUpBams
+  runMain(sample, fns["first"], tmp_path / "out")
+  runMain(sample, fns["second"], tmp_path / "out", "--topUp")
+  runMain(sample, fns["union"], tmp_path / "union")
+
+  for fn in ["integrationSites.tsv", "integrationSites_viralFrags.tsv", "viralFrags.tsv"]:
+    assert readRows(tmp_path / "out", fn) == readRows(tmp_path / "union", fn)
+
+  with open(tmp_path / "out" / "topUps" / "manifest.json", "r") as fhandle:
+    manifest = json.load(fhandle)
+  assert [entry["bamfile"] for entry in manifest] == [fns["second"]]
+  # v1 (2 fragments) by name, dv0 (2 fragments) and the sites of dh0 by fragment
+  h0Sites = readnames(tmp_path / "out", "integrationSites_viralFrags.tsv").count("h0")
+  assert h0Sites != 0
+  assert manifest[0]["duplicateReadnames"] == 2
+  assert manifest[0]["duplicateFragments"] == 2 + h0Sites
+
+  # a BAM is only added once
+  with pytest.raises(subprocess.CalledProcessError) as error:
+    runMain(sample, fns["second"], tmp_path / "out", "--topUp")
+  assert "already added" in error.value.stderr
+
+
+def test_top_up_run_dir_tied_to_its_BAM(tmp_path, topUpBams):
+  sample, fns = topUpBams
+  outDir = str(tmp_path / "out")
+
+  # an interrupted top-up of one BAM leaves its parsed files to be reused by the same BAM
+  runDir = TopUp(outDir, fns["second"]).runDir
+  open(os.path.join(runDir, "proviralReads.bam"), "w").close()
+  assert TopUp(outDir, fns["second"]).runDir == runDir
+  assert os.path.exists(os.path.join(runDir, "proviralReads.bam"))
+
+  # but not by another one
+  assert TopUp(outDir, fns["union"]).runDir == runDir
+  assert os.listdir(runDir) == ["source.json"]